@@ -1,20 +1,50 @@
 import os
-import requests
+import asyncio
 import json
-import io
 import uuid
 from PIL import Image
 from google import genai
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional, Union, Literal, get_origin, get_args
+from typing import (
+    List,
+    Dict,
+    Any,
+    Optional,
+    Tuple,
+    Union,
+    Literal,
+    Callable,
+    get_origin,
+    get_args,
+)
+from contextvars import ContextVar
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, asdict, fields, is_dataclass, field
+from dataclasses import dataclass, fields, is_dataclass, field
 from enum import Enum
+from types import MappingProxyType
 from google.genai import types
 from datetime import datetime
 import time
-import base64
+import random
+import weakref
 from io import BytesIO
+from llm_cache import response_cache, cache_key
+from streaming_json import IncrementalJSONParser
+from storage import open_storage, COLLECTION_KEYS
+from indexed_collection import IndexedCollection
+from retrieval import retriever
+from prompt_budget import PromptAssembler, estimate_tokens, summarize_records
+from context_cache import context_cache
+from image_jobs import ImageJobQueue, placeholder_url, job_id_from_url
+from freepik import FreepikClient
+from image_cache import image_cache, IMAGE_CACHE
+from intent_classifier import (
+    IntentClassifier,
+    PublishDetector,
+    EMPTY_TURN,
+    FAST_PATH_MIN_CONFIDENCE,
+    FAST_PATH_SHADOW_RATE,
+)
 
 # --- API Client Setup ---
 load_dotenv()
@@ -28,32 +58,99 @@ if not GEMINI_API_KEY:
 user_native_language = "en"  # for ai to see where to give translation
 client = genai.Client(api_key=GEMINI_API_KEY)
 MODEL_ID = "gemini-2.5-flash"
+GEMINI_IMAGE_MODEL = "gemini-2.5-flash-image-preview"
 
 fallback_image_url = "https://images.pexels.com/photos/16653303/pexels-photo-16653303/free-photo-of-a-woman-in-a-sari-standing-in-a-field.jpeg"
 
+# --- Turn Events ---
+# Set by streaming endpoints to a callable(event, data); stages of a turn report
+# progress through emit_event. Unset (None) for normal requests.
+turn_events: ContextVar[Optional[Callable[[str, Dict], None]]] = ContextVar(
+    "turn_events", default=None
+)
+
+
+def emit_event(event: str, data: Dict):
+    sink = turn_events.get()
+    if sink is not None:
+        sink(event, data)
+
+
+# True inside speculative work whose result may be thrown away; side effects
+# such as early image generation wait until the work is confirmed.
+speculative_turn: ContextVar[bool] = ContextVar("speculative_turn", default=False)
+
+
 # --- CONFIG & CONSTANTS ---
 USE_DUMMY_IMAGE = True
 FREEPIK_URL = "https://api.freepik.com/v1/ai/gemini-2-5-flash-image-preview"
+freepik_client = FreepikClient(FREEPIK_URL, FREEPIK_API_KEY)  # pooled session, see freepik.py
+# start publish-decision + draft generation for the current tool while routing runs
+SPECULATIVE_EXECUTION = os.getenv("SPECULATIVE_EXECUTION", "false").lower() == "true"
+# image generations running at once per process (each holds a worker thread while polling)
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", "3"))
+# generate draft images in the background job queue (image_jobs.py) when the app runs it.
+# off by default: the chat page doesn't poll /images/jobs yet and would keep the placeholders
+IMAGE_JOBS = os.getenv("IMAGE_JOBS", "false").lower() == "true"
+# publishing waits this long for draft images still in the queue, then asks to retry
+IMAGE_PUBLISH_WAIT_SECONDS = float(os.getenv("IMAGE_PUBLISH_WAIT_SECONDS", "60"))
+# documents per collection a first-turn prompt gets (BM25 over the turn), tools override
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
 
 # --- Global Data Stores ---
+storage = open_storage()  # STORAGE_BACKEND=json|sqlite, see storage.py
+# IndexedCollections: get(pk) / upsert(doc) / by("product_id", ...) without scans
 products_db, chats_db, ads_db, posts_db = [], [], [], []
+_loaded_versions = {}  # collection -> storage version the list was loaded at
+
+
+def _load(name):
+    try:
+        _loaded_versions[name] = storage.version(name)
+        docs = storage.load(name)
+    except Exception as e:
+        print("error", e)
+        docs = []
+    return IndexedCollection(docs, key=COLLECTION_KEYS[name])
 
 
 def load_all_data():
     global products_db, chats_db, ads_db, posts_db
 
-    def _load(filename):
-        try:
-            with open(os.path.join("data", filename), "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            print("error", e)
-            return []
+    products_db = _load("products")
+    chats_db = _load("chats")
+    ads_db = _load("ads")
+    posts_db = _load("posts")
+
+
+def refresh_collections():
+    """
+    Reload collections another process wrote since we loaded them. In place,
+    the tools hold references to these lists.
+    """
+    for name, db in (
+        ("products", products_db),
+        ("chats", chats_db),
+        ("ads", ads_db),
+        ("posts", posts_db),
+    ):
+        if storage.version(name) != _loaded_versions.get(name):
+            db[:] = _load(name)
+
+
+def save_documents(name: str, docs: List[Dict]):
+    """per-document upsert of docs already updated in the in-memory list"""
+    storage.upsert(name, docs)
+
+
+def _own_write(name: str):
+    # our own writes (queued or flushed in the background) need no reload
+    if name in _loaded_versions:
+        _loaded_versions[name] = storage.version(name)
 
-    products_db = _load("products.json")
-    chats_db = _load("chats.json")
-    ads_db = _load("ads.json")
-    posts_db = _load("posts.json")
+
+storage.listeners.append(_own_write)
+storage.listeners.append(context_cache.invalidate)  # e.g. saved by _finalize_and_save
 
 
 load_all_data()
@@ -224,41 +321,127 @@ class FinalizedEntry:
     created_at: Optional[str] = ""
 
 
-def generate_structured_content(
+async def generate_structured_content(
     prompt: str,
-    schema: Dict = None,
+    schema: Union[Dict, "CompiledSchema"] = None,
     previous_ai_response: Dict = None,
     image_data: Dict = None,
+    call_site: str = "default",
+    stream_field: Optional[str] = None,
+    on_item: Optional[Callable[[str, int, Any], None]] = None,
+    prefix: Optional[str] = None,
+    prefix_key: Optional[str] = None,
+    prefix_collections: Tuple[str, ...] = (),
 ) -> Dict:
+    """
+    call_site picks the response cache TTL (see llm_cache.CACHE_TTLS);
+    identical model + prompt + schema + image calls are served from the cache.
+    stream_field: top-level string field (e.g. assistant_message) to emit as
+    "token" events while the model is still generating, if a turn_events sink is set.
+    on_item(key, index, value): called as soon as an element of a top-level list
+    (a draft, a chart, a selection prompt...) has fully arrived and matches the schema.
+    prefix: stable text sent before prompt, followed by the schema. With prefix_key
+    it is registered as Gemini cached content (context_cache.py) and only prompt is
+    sent; prefix_collections are the collections it was built from.
+    """
     try:
-        full_prompt = prompt
-        if schema:
-            full_prompt += (
-                "\n\nReturn ONLY valid JSON strictly matching this schema. "
-                "No explanations, no extra text. No trailing commas.\n"
-                f"{json.dumps(schema, indent=2)}"
-            )
-
-        content_parts = [full_prompt]
-        if image_data and image_data.get("data"):
-            content_parts.append(Image.open(io.BytesIO(image_data["data"])))
-
-        json_config = {"response_mime_type": "application/json"}
-        response = client.models.generate_content(
-            model=MODEL_ID, contents=content_parts, config=json_config
+        if isinstance(schema, CompiledSchema):
+            schema_text = schema.text  # pre-rendered once at startup
+        else:
+            schema_text = json.dumps(schema, indent=2) if schema else ""
+        schema_block = (
+            "\n\nReturn ONLY valid JSON strictly matching this schema. "
+            "No explanations, no extra text. No trailing commas.\n"
+            f"{schema_text}"
+            if schema
+            else ""
         )
+        if prefix is not None:
+            stable = prefix + schema_block
+            full_prompt = stable + "\n\n" + prompt
+        else:
+            stable = None
+            full_prompt = prompt + schema_block
+
+        # image_data: the stored upload (backend.UploadedImage), opened lazily from disk
+        image_parts = [Image.open(image_data.path)] if image_data else []
+        content_parts = [full_prompt] + image_parts
+
+        stream = bool(stream_field) and turn_events.get() is not None
+        streamed = {"text": ""}  # how much of stream_field was already emitted
+        parser = IncrementalJSONParser(schema.schema if isinstance(schema, CompiledSchema) else schema)
+
+        def _handle(events):
+            for event in events:
+                kind, key = event[0], event[1]
+                if kind in ("partial", "field") and stream and key == stream_field:
+                    text = event[2] if isinstance(event[2], str) else ""
+                    if len(text) > len(streamed["text"]):
+                        emit_event("token", {"text": text[len(streamed["text"]) :]})
+                        streamed["text"] = text
+                elif kind == "item" and on_item is not None:
+                    _, _, index, value, ok = event
+                    if ok:
+                        on_item(key, index, value)
+                    else:
+                        print(f"[generate_structured_content] {key}[{index}] doesn't match schema")
 
-        cleaned_response = (
-            response.text.strip().replace("```json", "").replace("```", "")
-        )
+        async def _generate(contents, config) -> str:
+            if stream or on_item is not None:
+                async for chunk in await client.aio.models.generate_content_stream(
+                    model=MODEL_ID, contents=contents, config=config
+                ):
+                    _handle(parser.feed(chunk.text or ""))
+                return parser.buffer
+            response = await client.aio.models.generate_content(
+                model=MODEL_ID, contents=contents, config=config
+            )
+            return response.text
+
+        async def _call_model() -> str:
+            json_config = {"response_mime_type": "application/json"}
+            cache_name = None
+            if stable is not None and prefix_key:
+                cache_name = await context_cache.get(
+                    client, MODEL_ID, prefix_key, stable, prefix_collections
+                )
+            if cache_name:
+                try:
+                    raw = await _generate(
+                        [prompt] + image_parts, {**json_config, "cached_content": cache_name}
+                    )
+                except Exception as e:
+                    if parser.buffer:
+                        raise  # already streamed part of the answer
+                    print(f"[generate_structured_content] cached content failed, sending inline: {e}")
+                    context_cache.discard(prefix_key)
+                    raw = await _generate(content_parts, json_config)
+            else:
+                raw = await _generate(content_parts, json_config)
+            cleaned = raw.strip().replace("```json", "").replace("```", "")
+            json.loads(cleaned)  # only valid JSON gets cached
+            return cleaned
 
         try:
+            cleaned_response = await response_cache.get_or_compute(
+                cache_key(
+                    MODEL_ID,
+                    (stable or "") + prompt,
+                    schema_text,
+                    image_data.sha256 if image_data else None,
+                ),
+                call_site,
+                _call_model,
+            )
+            if not parser.buffer:
+                # cache hit or shared call: replay it so callers see the same events
+                _handle(parser.feed(cleaned_response))
             return json.loads(cleaned_response)
         except json.JSONDecodeError as e:
             print("\n[generate_structured_content] JSON parsing failed ❌")
             print("Error:", e)
             print("Raw model response:")
-            print(cleaned_response)
+            print(e.doc)
             print("-" * 80)
             raise  # re-raise so outer except also catches
 
@@ -270,86 +453,31 @@ def generate_structured_content(
         }
 
 
-def file_to_base64(path):
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
-
-
 def generate_image(prompt: str, reference_images: List[str] = None) -> List[str]:
     """
     Returns a list of local file paths (relative URLs) for images generated by Freepik or Gemini.
+    Identical requests are served from the image cache (image_cache.py).
     """
     os.makedirs("data/uploads", exist_ok=True)
 
     if USE_DUMMY_IMAGE or not (FREEPIK_API_KEY or GEMINI_API_KEY):
         return [fallback_image_url]
 
+    if IMAGE_CACHE and IMAGE_PROVIDER in ("freepik", "gemini"):
+        model = FREEPIK_URL if IMAGE_PROVIDER == "freepik" else GEMINI_IMAGE_MODEL
+        return image_cache.get_or_generate(
+            IMAGE_PROVIDER,
+            model,
+            prompt,
+            reference_images,
+            lambda: _generate_image_uncached(prompt, reference_images),
+        )
+    return _generate_image_uncached(prompt, reference_images)
+
+
+def _generate_image_uncached(prompt: str, reference_images: List[str] = None) -> List[str]:
     if IMAGE_PROVIDER == "freepik":
-        start_headers = {
-            "Content-Type": "application/json",
-            "x-freepik-api-key": FREEPIK_API_KEY,
-        }
-        start_data = {"prompt": prompt}
-        if reference_images:
-            images = []
-            for img_path in reference_images:
-                try:
-                    img = file_to_base64(img_path)
-                    images.append(img)
-                except Exception as e:
-                    print(f"Failed to load reference image {img_path}: {e}")
-            start_data["reference_images"] = images
-        try:
-            start_resp = requests.post(
-                FREEPIK_URL, headers=start_headers, json=start_data, timeout=30
-            )
-            start_resp.raise_for_status()
-            task_id = (start_resp.json().get("data", {}) or {}).get("task_id")
-            if not task_id:
-                print("Freepik API did not return a task ID.")
-                return []
-            status_url = FREEPIK_URL + f"/{task_id}"
-            status_headers = {"x-freepik-api-key": FREEPIK_API_KEY}
-            time.sleep(10)  # Initial wait before polling
-            for _ in range(24):
-                status_resp = requests.get(
-                    status_url, headers=status_headers, timeout=30
-                )
-                status_resp.raise_for_status()
-                status_json = status_resp.json()
-                job_status = (status_json.get("data", {}) or {}).get("status")
-                if (
-                    job_status == "COMPLETED"
-                    and (status_json.get("data") or {}).get("generated") != []
-                ):
-                    images_data = status_json["data"].get("generated") or []
-                    paths = []
-                    for img_info in images_data[:1]:  # Limit to first image
-                        url = img_info
-                        if url:
-                            try:
-                                img_resp = requests.get(url)
-                                img_resp.raise_for_status()
-                                filename = f"freepik_{uuid.uuid4().hex}.png"
-                                rel_path = os.path.join("data", "uploads", filename)
-                                with open(rel_path, "wb") as f:
-                                    f.write(img_resp.content)
-                                paths.append(rel_path)
-                            except Exception as e:
-                                print(f"Failed to download Freepik image: {e}")
-                    if paths:
-                        return paths
-                    print("Job completed but no image URL found.")
-                    return []
-                elif job_status == "FAILED":
-                    print(f"Freepik job failed. Reason: {status_json.get('error')}")
-                    return []
-                time.sleep(5)
-            print("Freepik job timed out after 2 minutes.")
-            return []
-        except requests.RequestException as e:
-            print(f"Freepik API request failed: {e}")
-            return []
+        return freepik_client.generate(prompt, reference_images)
     elif IMAGE_PROVIDER == "gemini":
         max_retries = 3
         for attempt in range(1, max_retries + 1):
@@ -364,7 +492,7 @@ def generate_image(prompt: str, reference_images: List[str] = None) -> List[str]
                             print(f"Failed to load reference image {img_path}: {e}")
                 contents = [prompt] + images
                 response = client.models.generate_content(
-                    model="gemini-2.5-flash-image-preview",
+                    model=GEMINI_IMAGE_MODEL,
                     contents=contents,
                 )
                 paths = []
@@ -389,6 +517,14 @@ def generate_image(prompt: str, reference_images: List[str] = None) -> List[str]
         return []
 
 
+# started by the app (backend.py) when IMAGE_JOBS is on; until then turns generate
+# their images themselves
+image_queue = ImageJobQueue(
+    lambda prompt, reference_images: generate_image(prompt, reference_images=reference_images),
+    concurrency=IMAGE_CONCURRENCY,
+)
+
+
 def dataclass_to_schema(typ):
     """
     Recursively convert a dataclass or type hint to a simple AI-friendly schema.
@@ -460,58 +596,197 @@ def dataclass_to_schema(typ):
     return val
 
 
+@dataclass(frozen=True)
+class CompiledSchema:
+    schema: Any  # read-only view (mappingproxy / tuples), don't mutate
+    text: str  # json.dumps(schema, indent=2), what goes into the prompt
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+PUBLISH_SCHEMA = {
+    "publish": "boolean",
+    "cancel": "boolean(optional)",
+    "reason": "string",
+}
+ROUTING_SCHEMA = {"tool_name": "string", "reasoning": "string"}
+
+
+class SchemaRegistry:
+    """
+    Every schema sent to the model, built once at startup.
+    keys: "publish", "routing" and "<kind>:<tool_name>" from each tool's response_schemas()
+    (schemas don't vary with task state, so one per tool and kind is enough)
+    """
+
+    def __init__(self, tool_registry):
+        self._schemas = {}
+        self.register("publish", PUBLISH_SCHEMA)
+        self.register("routing", ROUTING_SCHEMA)
+        for tool in tool_registry.tools.values():
+            for kind, schema in tool.response_schemas().items():
+                self.register(f"{kind}:{tool.name}", schema)
+
+    def register(self, key: str, schema: Dict):
+        self._schemas[key] = CompiledSchema(
+            schema=_freeze(schema), text=json.dumps(schema, indent=2)
+        )
+
+    def get(self, key: str) -> CompiledSchema:
+        return self._schemas[key]
+
+
 # --- Abstract Base Class for Tools ---
 
 
+# Encoders/decoders are compiled once per dataclass on first use: field types are
+# resolved up front, so each object is converted in a single pass without the
+# deep copy dataclasses.asdict makes.
+_SCALARS = (str, int, float, bool, type(None))
+_ENCODERS = {}
+_DECODERS = {}
+
+
 def _serialize_obj(obj):
     """Recursively serialize dataclasses and enums to dicts/values.(obj to dict)"""
+    cls = obj.__class__
+    encode = _ENCODERS.get(cls)
+    if encode is not None:
+        return encode(obj)
+    if cls in _SCALARS:
+        return obj
+    if cls is list:
+        return [_serialize_obj(i) for i in obj]
+    if cls is dict:
+        return {k: _serialize_obj(v) for k, v in obj.items()}
     if hasattr(obj, "__dataclass_fields__"):
-        return {k: _serialize_obj(v) for k, v in asdict(obj).items()}
+        return _compile_encoder(cls)(obj)
     if isinstance(obj, Enum):
         return obj.value
-    if isinstance(obj, dict):
-        return {k: _serialize_obj(v) for k, v in obj.items()}
     if isinstance(obj, list):
         return [_serialize_obj(i) for i in obj]
+    if isinstance(obj, dict):
+        return {k: _serialize_obj(v) for k, v in obj.items()}
     return obj
 
 
 def _deserialize_obj(data, cls):
     """Recursively deserialize dicts to dataclasses and enums.(dict to obj) only needs to know what to convert to"""
-    if hasattr(cls, "__dataclass_fields__") and isinstance(data, dict):
-        field_types = {f.name: f.type for f in fields(cls)}
+    decode = _DECODERS.get(cls)
+    if decode is None:
+        decode = _compile_decoder(cls)
+    return decode(data)
+
+
+def _unwrap_optional(typ):
+    origin, args = get_origin(typ), get_args(typ)
+    if origin is Union and type(None) in args:
+        return [a for a in args if a is not type(None)][0]
+    return typ
+
+
+def _field_encoder_expr(name, typ):
+    """python expression encoding obj.<name>, specialised on the declared type"""
+    typ = _unwrap_optional(typ)
+    origin, args = get_origin(typ), get_args(typ)
+    if typ in _SCALARS or origin is Literal:
+        return f"(v if (v := obj.{name}).__class__ in _SCALARS else _serialize_obj(v))"
+    if isinstance(typ, type) and issubclass(typ, Enum):
+        return f"(v.value if isinstance(v := obj.{name}, Enum) else _serialize_obj(v))"
+    if origin is list and args and _unwrap_optional(args[0]) in _SCALARS:
+        return (
+            f"([i if i.__class__ in _SCALARS else _serialize_obj(i) for i in v]"
+            f" if (v := obj.{name}).__class__ is list else _serialize_obj(v))"
+        )
+    if origin is list:
+        return (
+            f"([_serialize_obj(i) for i in v]"
+            f" if (v := obj.{name}).__class__ is list else _serialize_obj(v))"
+        )
+    return f"_serialize_obj(obj.{name})"
+
+
+def _compile_encoder(cls):
+    body = ", ".join(
+        f"{f.name!r}: {_field_encoder_expr(f.name, f.type)}" for f in fields(cls)
+    )
+    namespace = {"_SCALARS": _SCALARS, "_serialize_obj": _serialize_obj, "Enum": Enum}
+    exec(f"def encode(obj):\n    return {{{body}}}", namespace)
+    encode = namespace["encode"]
+    _ENCODERS[cls] = encode
+    return encode
+
+
+def _value_decoder(typ):
+    """converter for one value of type typ, mirroring the old _deserialize_obj rules"""
+    if hasattr(typ, "__dataclass_fields__"):
+        return lambda v: _deserialize_obj(v, typ)
+    if isinstance(typ, type) and issubclass(typ, Enum):
+        return typ
+    return None  # kept as is (scalars, nested generics)
+
+
+def _field_decoder(typ):
+    typ = _unwrap_optional(typ)
+    origin, args = get_origin(typ), get_args(typ)
+    if origin is list:
+        inner = _value_decoder(args[0]) if args else None
+        if inner is None:
+            return None
+        return lambda v: [inner(i) for i in v] if isinstance(v, list) else v
+    if origin is dict:
+        inner = _value_decoder(args[1]) if len(args) > 1 else None
+        if inner is None:
+            return None
+        return lambda v: (
+            {ik: inner(iv) for ik, iv in v.items()} if isinstance(v, dict) else v
+        )
+    if isinstance(typ, type) and issubclass(typ, Enum):
+        return typ
+    if hasattr(typ, "__dataclass_fields__"):
+        return lambda v: _deserialize_obj(v, typ)
+    return None
+
+
+def _compile_decoder(cls):
+    if not hasattr(cls, "__dataclass_fields__"):
+        if isinstance(cls, type) and issubclass(cls, Enum):
+            decode = cls
+        else:
+            decode = _identity
+        _DECODERS[cls] = decode
+        return decode
+
+    converters = {f.name: _field_decoder(f.type) for f in fields(cls)}
+
+    def decode(data):
+        if not isinstance(data, dict):
+            return data
         kwargs = {}
         for k, v in data.items():
-            typ = field_types.get(k)
-            if typ is None:
+            if k not in converters:
                 continue
-            origin = get_origin(typ)
-            args = get_args(typ)
-            # Handle Optional
-            if origin is Union and type(None) in args:
-                typ = [a for a in args if a is not type(None)][0]
-                origin = get_origin(typ)
-                args = get_args(typ)
-            if origin is list and isinstance(v, list):
-                inner = args[0]
-                kwargs[k] = [_deserialize_obj(i, inner) for i in v]
-            elif origin is dict and isinstance(v, dict):
-                kwargs[k] = {ik: _deserialize_obj(iv, args[1]) for ik, iv in v.items()}
-            elif isinstance(typ, type) and issubclass(typ, Enum):
-                kwargs[k] = typ(v)
-            elif hasattr(typ, "__dataclass_fields__"):
-                kwargs[k] = _deserialize_obj(v, typ)
-            else:
-                kwargs[k] = v
+            convert = converters[k]
+            kwargs[k] = v if convert is None else convert(v)
         return cls(**kwargs)
-    elif isinstance(cls, type) and issubclass(cls, Enum):
-        return cls(data)
-    else:
-        return data
+
+    _DECODERS[cls] = decode
+    return decode
+
+
+def _identity(data):
+    return data
 
 
 class BaseTool(ABC):
     db_name = ""
+    context_top_k = RETRIEVAL_TOP_K
 
     def __init__(self, name: str, description: str):
         self.name = name
@@ -520,8 +795,45 @@ class BaseTool(ABC):
     def gen_uid(self):
         return self.db_name[:-1] + "_" + str(uuid.uuid4())
 
+    @staticmethod
+    def retrieval_query(current_user_turn, prev_ai_response) -> str:
+        """what the turn is about: user message, selections and drafts, previous reply"""
+        parts = [current_user_turn.get("message") or ""]
+        selections = current_user_turn.get("selections") or {}
+        if isinstance(selections, dict):
+            parts += selections.get("selected_option_ids") or []
+        if prev_ai_response:
+            parts.append(prev_ai_response.get("assistant_message") or "")
+            for prompt in prev_ai_response.get("selections") or []:
+                if isinstance(prompt, dict):
+                    parts += [o.get("label", "") for o in prompt.get("options") or [] if isinstance(o, dict)]
+        for draft in (current_user_turn.get("drafts") or []) + (
+            (prev_ai_response or {}).get("drafts") or []
+        ):
+            parts.append(json.dumps(_serialize_obj(draft), ensure_ascii=False))
+        return " ".join(p for p in parts if isinstance(p, str))
+
+    def relevant(self, collection: str, db: List[Dict], query: str) -> List[Dict]:
+        return retriever.search(
+            collection, db, query, self.context_top_k, version=storage.version(collection)
+        )
+
+    def relevant_products(self, query: str, docs: List[Dict] = ()) -> List[Dict]:
+        """top products for the query, plus the products the given docs belong to"""
+        products = []
+        for product in [products_db.get(d.get("product_id")) for d in docs] + self.relevant(
+            "products", products_db, query
+        ):
+            if product and not any(product is p for p in products):
+                products.append(product)
+        return products
+
+    def response_schemas(self) -> Dict[str, Dict]:
+        """schemas this tool sends to the model, compiled once by SchemaRegistry"""
+        return {}
+
     @abstractmethod
-    def execute(
+    async def execute(
         self, current_user_turn, prev_ai_response, image_data, image_url
     ) -> AssistantResponse:
         pass
@@ -532,6 +844,27 @@ class GenericDraftTool(BaseTool):
     draft_cls = Draft  # Override in subclasses
     db = []  # Override in subclasses
     db_name = ""  # Override in subclasses
+    # prompt section -> (policy, priority) when the draft prompt is over
+    # PROMPT_TOKEN_BUDGET, lowest priority shrunk first (see prompt_budget.py).
+    # Sections not listed (tool context) are truncated at priority 3.
+    prompt_policies = {
+        "User uploaded image URL": ("keep", 9),
+        "User native language": ("keep", 9),
+        "User message": ("keep", 9),
+        "User drafts (current turn)": ("keep", 9),
+        "User selections (current turn)": ("keep", 9),
+        "Previous charts": ("drop", 0),
+        "Previous stats": ("drop", 0),
+        "Previous sources": ("keep_latest", 1),
+        "Previous insights": ("keep_latest", 1),
+        "Previous assistant message": ("summarize", 2),
+        "Previous selections": ("truncate", 2),
+        "Relevant products": ("summarize", 3),
+        "Relevant posts": ("summarize", 3),
+        "Relevant ads": ("summarize", 3),
+        "Relevant chats": ("keep_latest", 3),
+        "Previous drafts": ("truncate", 4),
+    }
 
     @abstractmethod
     def get_ai_prompt(self, current_user_turn, prev_ai_response, image_data, image_url):
@@ -544,7 +877,37 @@ class GenericDraftTool(BaseTool):
         """Override in subclass to provide extra context for the AI prompt."""
         return {}
 
+    def prompt_prefix(self, state_prompt: str, instructions: str) -> Tuple[str, Tuple[str, ...]]:
+        """
+        The part of the draft prompt that is the same for every turn of this tool in
+        this state, and the collections it was built from. With context caching on it
+        also carries a catalogue snapshot (the cache makes those tokens cheap).
+        """
+        parts = [state_prompt, instructions]
+        collections = ()
+        if context_cache.enabled:
+            collections = tuple(dict.fromkeys(("products", self.db_name)))
+            for name in collections:
+                docs = self.db if name == self.db_name else products_db
+                parts.append(
+                    f"Catalogue snapshot, all {name} (summaries): "
+                    + json.dumps(summarize_records(docs), ensure_ascii=False)
+                )
+        return "\n".join(parts), collections
+
     # overwrite in subclass if needed
+    def response_schemas(self):
+        schema = dataclass_to_schema(AssistantResponse)
+        # remove irrelavnt keys
+        for key in ["role", "turn_id", "timestamp", "drafts", "selections_text"]:
+            schema.pop(key, None)
+        # make drafts a list of draft_cls
+        schema["drafts"] = [dataclass_to_schema(self.draft_cls)]
+        schema["image_prompts"] = [
+            {"draft_id": "string", "prompt": "string", "reference_images": ["string"]}
+        ]
+        return {"draft": schema, "finalize": self._finalized_entry_schema()}
+
     def task_state(self, prev_ai_response):
         if prev_ai_response.get("tool_name") != self.name:
             return "first_turn"
@@ -556,29 +919,34 @@ class GenericDraftTool(BaseTool):
             return "optimize"
         return "new"
 
-    def execute(
+    async def execute(
         self, current_user_turn, prev_ai_response, image_data, image_url
     ) -> AssistantResponse:
-        user_message = current_user_turn.get("message") or ""
-        user_drafts = current_user_turn.get("drafts") or []
+        publish_decision = await self.decide_publish(
+            current_user_turn, prev_ai_response, image_url
+        )
+        return await self.complete_turn(
+            current_user_turn, prev_ai_response, image_data, image_url, publish_decision
+        )
 
+    async def decide_publish(self, current_user_turn, prev_ai_response, image_url):
+        """AI decides if user wants to publish/post or cancel. returns the raw decision dict"""
+        # clear-cut turns (buttons, keywords, plain edits) don't need the LLM.
+        # A speculative decision may be thrown away: its detector result rides along
+        # under "_detector" and is only counted if ai_task_router uses the decision
+        speculative = speculative_turn.get()
+        local_decision = publish_detector.detect(
+            current_user_turn, prev_ai_response, record=not speculative
+        )
+        if local_decision is not None:
+            print("publish decided locally:", local_decision)
+            return {**local_decision, "_detector": local_decision} if speculative else local_decision
+        user_message = current_user_turn.get("message") or ""
         selections = current_user_turn.get("selections") or []
-        schema = dataclass_to_schema(AssistantResponse)
-        # remove irrelavnt keys
-        for key in ["role", "turn_id", "timestamp", "drafts", "selections_text"]:
-            schema.pop(key, None)
-        # make drafts a list of draft_cls
-        # to do
-        schema["drafts"] = [dataclass_to_schema(self.draft_cls)]
-        schema["image_prompts"] = [
-            {"draft_id": "string", "prompt": "string", "reference_images": ["string"]}
-        ]
-        print("schema sent to ai", schema)
         prev_drafts = prev_ai_response.get("drafts") or [] if prev_ai_response else []
         ai_selections = (
             prev_ai_response.get("selections") or [] if prev_ai_response else []
         )
-        # --- AI decides if user wants to publish/post ---
         publish_prompt = f"""
         Decide if the user wants to publish/post/launch/confirm the current {self.db_name[:-1]}.
         User message: "{user_message}"
@@ -593,33 +961,23 @@ class GenericDraftTool(BaseTool):
         if there are pending questions, but the values are draft are sensible enough, assume it means user accepts those values and wants to publish
         """
         print("pubslish prompt:", publish_prompt)
-        publish_schema = {
-            "publish": "boolean",
-            "cancel": "boolean(optional)",
-            "reason": "string",
-        }
-        publish_decision = generate_structured_content(
-            publish_prompt, publish_schema, prev_ai_response
+        decision = await generate_structured_content(
+            publish_prompt,
+            schema_registry.get("publish"),
+            prev_ai_response,
+            call_site="publish",
         )
-        wants_publish = publish_decision.get("publish", False)
-        wants_cancel = publish_decision.get("cancel", False)
-
-        print("wants to publish?", wants_publish, " wants cancel?", wants_cancel)
-        print("reason", publish_decision.get("reason", ""))
-        if wants_publish and not wants_cancel:
-            response = {
-                "assistant_message": f"{self.db_name[:-1].title()} published successfully.",
-                "editing_enabled": False,
-                "drafts": prev_drafts,
-            }
-            self.finalize_and_save(prev_drafts, prev_ai_response.get("product_id"))
-            return dict_to_assistant_response(
-                response, tool_name=self.name, draft_cls=self.draft_cls
-            )
+        return {**decision, "_detector": None} if speculative else decision
 
+    async def generate_draft_response(
+        self, current_user_turn, prev_ai_response, image_data, image_url
+    ) -> Dict:
+        """Builds the draft prompt and returns the raw AI response (image_prompts not yet processed)"""
+        user_message = current_user_turn.get("message") or ""
+        user_drafts = current_user_turn.get("drafts") or []
+        selections = current_user_turn.get("selections") or []
+        schema = schema_registry.get(f"draft:{self.name}")
         # --- AI prompt for drafts with image handling instructions ---
-        if wants_cancel:
-            prev_ai_response = {}
         context = self.get_context_data(
             current_user_turn, prev_ai_response, image_data, image_url
         )
@@ -680,39 +1038,232 @@ class GenericDraftTool(BaseTool):
             ),
         }
 
-        prompt += (
-            "\nHere is the info you have:\n"
-            + "\n".join(f"{k}: {v}" for k, v in common_context.items())
-            + "\n"
+        # stable prefix (cacheable per tool + state) first, then what changes every turn
+        prefix, prefix_collections = self.prompt_prefix(prompt, instructions)
+        assembler = PromptAssembler()
+        for name, value in list(common_context.items()) + list((context or {}).items()):
+            policy, priority = self.prompt_policies.get(name, ("truncate", 3))
+            assembler.add(name, "" if value is None else value, policy, priority)
+        prompt = assembler.render(
+            "Here is the info you have:\n",
+            label=f"draft:{self.name}",
+            reserved=estimate_tokens(prefix + schema.text),
         )
-        if context:
-            prompt += "\n".join(f"{k}: {v}" for k, v in context.items())
-        prompt += instructions
+        image_tasks = {}  # image_prompts index -> generation started while streaming
+
+        def _on_item(key, index, value):
+            if key == "drafts":
+                emit_event("draft", {"index": index, "draft": value})
+            elif key == "image_prompts" and not speculative_turn.get():
+                image_tasks[index] = self._start_image(value, user_message)
+
         # --- Get AI response ---
         print("prompt sent to ai: ", prompt)
-        response = generate_structured_content(
-            prompt, schema, prev_ai_response, image_data
-        )
+        try:
+            response = await generate_structured_content(
+                prompt,
+                schema,
+                prev_ai_response,
+                image_data,
+                call_site="draft",
+                stream_field="assistant_message",
+                on_item=_on_item,
+                prefix=prefix,
+                prefix_key=f"draft:{self.name}:{self.task_state(prev_ai_response)}",
+                prefix_collections=prefix_collections,
+            )
+        except BaseException:
+            for job in image_tasks.values():
+                _discard_image(job)
+            raise
         print("response from ai", response)
+        if image_tasks:
+            response["_image_tasks"] = image_tasks  # picked up by complete_turn
+        return response
+
+    def _start_image(self, img_req: Dict, user_message: str):
+        """a queued job (dict) when the image queue runs, else a task generating it in this turn"""
+        if image_queue.running:
+            return image_queue.submit(
+                img_req.get("prompt", user_message) or user_message,
+                img_req.get("reference_images", []) or [],
+                draft_id=img_req.get("draft_id"),
+            )
+        return asyncio.create_task(self._generate_draft_image(img_req, user_message))
+
+    async def _generate_draft_image(self, img_req: Dict, user_message: str) -> List[str]:
+        """one image job, at most IMAGE_CONCURRENCY at a time; [] if it fails"""
+        img_prompt = img_req.get("prompt", user_message) or user_message
+        ref_imgs = img_req.get("reference_images", []) or []
+        async with _image_slots():
+            try:
+                # generate_image is blocking (sleeps while polling), keep it off the event loop
+                return await asyncio.to_thread(
+                    generate_image, img_prompt, reference_images=ref_imgs
+                )
+            except Exception as e:
+                print(f"image generation failed for {img_req.get('draft_id')}: {e}")
+                return []
+
+    async def complete_turn(
+        self,
+        current_user_turn,
+        prev_ai_response,
+        image_data,
+        image_url,
+        publish_decision,
+        draft_response=None,
+    ) -> AssistantResponse:
+        """
+        Acts on a publish decision: publishes, or builds the drafts (and their images).
+        draft_response can be passed in when it was already generated for the same
+        prev_ai_response (speculative execution); it is only valid if the user
+        neither published nor cancelled.
+        """
+        user_message = current_user_turn.get("message") or ""
+        prev_drafts = prev_ai_response.get("drafts") or [] if prev_ai_response else []
+        wants_publish = publish_decision.get("publish", False)
+        wants_cancel = publish_decision.get("cancel", False)
+
+        print("wants to publish?", wants_publish, " wants cancel?", wants_cancel)
+        print("reason", publish_decision.get("reason", ""))
+        emit_event(
+            "publish",
+            {
+                "publish": bool(wants_publish),
+                "cancel": bool(wants_cancel),
+                "reason": publish_decision.get("reason", ""),
+            },
+        )
+        if wants_publish and not wants_cancel:
+            # images still being generated in the background: wait for them rather
+            # than publish the placeholder's fallback image
+            pending = [
+                job_id
+                for draft in prev_drafts
+                if isinstance(draft, dict)
+                for job_id in map(job_id_from_url, draft.get("images") or [])
+                if job_id
+            ]
+            if pending and not await image_queue.wait(
+                pending, IMAGE_PUBLISH_WAIT_SECONDS if image_queue.running else 0
+            ):
+                response = {
+                    "assistant_message": "The images for your drafts are still being generated. "
+                    "Please publish again in a moment.",
+                    "editing_enabled": True,
+                    "drafts": prev_drafts,
+                }
+                return dict_to_assistant_response(
+                    response, tool_name=self.name, draft_cls=self.draft_cls
+                )
+            # new dicts: prev_drafts are shared with the chat log's in-memory turns
+            published_drafts = [
+                {
+                    **draft,
+                    "images": [
+                        image_queue.resolve(url, fallback=fallback_image_url)
+                        for url in draft["images"]
+                    ],
+                }
+                if isinstance(draft, dict) and draft.get("images")
+                else draft
+                for draft in prev_drafts
+            ]
+            response = {
+                "assistant_message": f"{self.db_name[:-1].title()} published successfully.",
+                "editing_enabled": False,
+                "drafts": published_drafts,
+            }
+            await self.finalize_and_save(
+                published_drafts, prev_ai_response.get("product_id")
+            )
+            return dict_to_assistant_response(
+                response, tool_name=self.name, draft_cls=self.draft_cls
+            )
+
+        if wants_cancel:
+            prev_ai_response = {}
+            draft_response = None  # generated against the old task, start over
+        response = draft_response
+        if response is None:
+            response = await self.generate_draft_response(
+                current_user_turn, prev_ai_response, image_data, image_url
+            )
+        emit_event(
+            "drafts",
+            {
+                "assistant_message": response.get("assistant_message", ""),
+                "drafts": response.get("drafts") or [],
+            },
+        )
         # --- Handle image_prompt if present ---
         image_prompts = response.get("image_prompts", []) or []
+        started_images = response.pop("_image_tasks", {})
+        try:
+            await self._attach_images(response, image_prompts, started_images, user_message)
+        except BaseException:
+            # the turn failed or was cancelled: nobody will show the queued images
+            for draft in response.get("drafts", []) or []:
+                for job_id in map(job_id_from_url, draft.get("images") or []):
+                    if job_id:
+                        image_queue.cancel(job_id)
+            raise
+        finally:
+            for job in started_images.values():
+                _discard_image(job)  # no draft takes these images
+        response.pop("image_prompts", None)
+        response["editing_enabled"] = True
+        return dict_to_assistant_response(
+            response, tool_name=self.name, draft_cls=self.draft_cls
+        )
 
+    async def _attach_images(self, response, image_prompts, started_images, user_message):
+        """put each draft's image (or its queued job's placeholder) into response["drafts"]"""
         # check if drafts has images field
         if any("images" in draft for draft in response.get("drafts", [])) or []:
             global fallback_image_url
             local_fallback_image = fallback_image_url
-            if image_prompts:
-                for img_req in image_prompts:
-                    draft_id = img_req.get("draft_id")
-                    img_prompt = img_req.get("prompt", user_message) or user_message
-                    ref_imgs = img_req.get("reference_images", []) or []
-                    gen_img = generate_image(img_prompt, reference_images=ref_imgs)
-                    img_url = gen_img[0] if gen_img and len(gen_img) > 0 else None
-                    # Find and update the draft's images field
-                    for draft in response.get("drafts", []) or []:
-                        if draft.get("draft_id") == draft_id and img_url:
-                            local_fallback_image = img_url
-                            draft["images"] = [img_url]
+            if image_prompts and image_queue.running:
+                # queued in the background: placeholders now, backend.py patches the
+                # saved turn as each job finishes
+                for idx, img_req in enumerate(image_prompts):
+                    targets = [
+                        draft
+                        for draft in response.get("drafts", []) or []
+                        if draft.get("draft_id") == img_req.get("draft_id")
+                    ]
+                    if not targets:
+                        continue  # no such draft; a job started while streaming is dropped
+                    job = started_images.pop(idx, None) or self._start_image(img_req, user_message)
+                    for draft in targets:
+                        draft["images"] = [placeholder_url(fallback_image_url, job["job_id"])]
+            elif image_prompts:
+                # all jobs run concurrently (bounded by IMAGE_CONCURRENCY), reusing the
+                # ones started while the drafts streamed; each is attached as it finishes
+                jobs = {
+                    idx: started_images.pop(idx, None)
+                    or asyncio.create_task(self._generate_draft_image(img_req, user_message))
+                    for idx, img_req in enumerate(image_prompts)
+                }
+
+                async def _job(idx):
+                    return idx, await jobs[idx]
+
+                try:
+                    for next_done in asyncio.as_completed([_job(idx) for idx in jobs]):
+                        idx, gen_img = await next_done
+                        draft_id = image_prompts[idx].get("draft_id")
+                        img_url = gen_img[0] if gen_img and len(gen_img) > 0 else None
+                        # Find and update the draft's images field
+                        for draft in response.get("drafts", []) or []:
+                            if draft.get("draft_id") == draft_id and img_url:
+                                local_fallback_image = img_url
+                                draft["images"] = [img_url]
+                                emit_event("image", {"draft_id": draft_id, "images": [img_url]})
+                finally:
+                    for task in jobs.values():
+                        _discard_task(task)  # only still running if the turn was cancelled
                 # Remove image_prompts key after processing
             for draft in response.get("drafts", []) or []:
                 if "images" in draft and (
@@ -721,11 +1272,15 @@ class GenericDraftTool(BaseTool):
                     draft["images"] = [
                         local_fallback_image
                     ]  # use a default fallback image if none generated
-        response.pop("image_prompts", None)
-        response["editing_enabled"] = True
-        return dict_to_assistant_response(
-            response, tool_name=self.name, draft_cls=self.draft_cls
-        )
+            emit_event(
+                "images",
+                {
+                    "drafts": [
+                        {"draft_id": d.get("draft_id"), "images": d.get("images")}
+                        for d in response.get("drafts", []) or []
+                    ]
+                },
+            )
 
     @abstractmethod
     def add_fields_and_format_drafts(self, finalized_entry, product_id):
@@ -760,18 +1315,15 @@ class GenericDraftTool(BaseTool):
         # Recursively serialize dataclasses and enums to dicts/values
         return [_serialize_obj(d) for d in drafts]
 
-    def _get_finalized_entry_with_ai_fields(
+    async def _get_finalized_entry_with_ai_fields(
         self, drafts, product_id
     ):  # need to overwrite in subclasses if needed
         """Uses AI to fill in missing analytical fields for finalized entry."""
         # Use the schema for FinalizedEntry, but with the correct draft_cls
-        entry_schema = self._finalized_entry_schema()
-        print("finalized schema for saving", entry_schema)
+        entry_schema = schema_registry.get(f"finalize:{self.name}")
         # Attach a reference entry (first in db) if available
         reference_entry = self.db[0] if self.db and len(self.db) > 0 else None
-        product = next(
-            (item for item in products_db if item.get("product_id") == product_id), None
-        )
+        product = products_db.get(product_id)
         prompt = f"""
             You are an expert assistant that analyzes and enhances {self.db_name[:-1]} content.
 
@@ -793,16 +1345,20 @@ class GenericDraftTool(BaseTool):
             Return only valid JSON strictly matching this schema. No explanations, no extra text.
             """
 
-        result = generate_structured_content(prompt, entry_schema)
+        result = await generate_structured_content(
+            prompt, entry_schema, call_site="finalize"
+        )
         return result
 
-    def finalize_and_save(self, drafts, product_id):
+    async def finalize_and_save(self, drafts, product_id):
         # uses ai to make drafts into proper draft obejct ready to save
         if not drafts or len(drafts) == 0:
             return None
         drafts_edited = self._deserialize_drafts(drafts)
         print("drafts feed for finalize", drafts_edited)
-        ai_filled = self._get_finalized_entry_with_ai_fields(drafts_edited, product_id)
+        ai_filled = await self._get_finalized_entry_with_ai_fields(
+            drafts_edited, product_id
+        )
         print("finalized entry for saving", ai_filled)
         finalized_entry = FinalizedEntry(
             drafts=drafts_edited,
@@ -865,32 +1421,14 @@ class GenericDraftTool(BaseTool):
                         draft[key] = None
         print("db after", self.db)
         # --- DATABASE UPDATE LOGIC ---
-        draft_id_key = f"{self.db_name[:-1]}_id"
-        draft_id_value = draft.get(draft_id_key)
-
-        found_and_updated = False
-        if draft_id_value:
-            for idx, entry_dict in enumerate(self.db):
-                # THE FIX: Use .get() for dictionary access, not getattr().
-                if entry_dict.get(draft_id_key) == draft_id_value:
-                    print("found match", draft_id_key)
-                    # THE FIX: Store the 'draft' dictionary directly. No deserialization needed.
-                    self.db[idx] = draft
-                    found_and_updated = True
-                    break
-
-        if not found_and_updated:
-            # THE FIX: Append the 'draft' dictionary directly.
+        # replaces the entry with the same <db>_id, or appends (index lookup, no scan)
+        if self.db.upsert(draft):
             print("appending")
-            self.db.append(draft)
+        else:
+            print("found match", self.db.key)
         print("db after all", self.db)
-        # --- SAVING TO FILE ---
-        with open(
-            os.path.join("data", f"{self.db_name}.json"), "w", encoding="utf-8"
-        ) as f:
-            # THE FIX: Dump self.db directly. It is already a list of dictionaries.
-            # No _serialize_obj is needed.
-            json.dump(self.db, f, indent=2, ensure_ascii=False)
+        # --- SAVING: only this document is written ---
+        save_documents(self.db_name, [draft])
 
 
 class PostCreationTool(GenericDraftTool):
@@ -950,9 +1488,13 @@ class PostCreationTool(GenericDraftTool):
             prev_ai_response.get("drafts", []) or [] if prev_ai_response else []
         )
         if state == "first_turn":
+            query = self.retrieval_query(current_user_turn, prev_ai_response)
+            posts = self.relevant("posts", posts_db, query)
             return {
-                "All products": json.dumps(products_db, ensure_ascii=False),
-                "All posts": json.dumps(posts_db, ensure_ascii=False),
+                "Relevant products": json.dumps(
+                    self.relevant_products(query, posts), ensure_ascii=False
+                ),
+                "Relevant posts": json.dumps(posts, ensure_ascii=False),
             }
         if state == "optimize":
             post_id = (
@@ -960,20 +1502,11 @@ class PostCreationTool(GenericDraftTool):
                 if prev_drafts and len(prev_drafts) > 0
                 else None
             )
-            post = next(
-                (item for item in posts_db if item.get("post_id") == post_id), None
-            )
+            post = posts_db.get(post_id)
             return {
                 "Post being optimized": json.dumps(post, ensure_ascii=False),
                 "Product this post is for": json.dumps(
-                    next(
-                        (
-                            item
-                            for item in products_db
-                            if item.get("product_id") == post.get("product_id")
-                        ),
-                        None,
-                    ),
+                    products_db.get(post.get("product_id")),
                     ensure_ascii=False,
                 )
                 if post
@@ -982,14 +1515,7 @@ class PostCreationTool(GenericDraftTool):
         if state == "new":
             return {
                 "Product this post is for": json.dumps(
-                    next(
-                        (
-                            item
-                            for item in products_db
-                            if item.get("product_id") == post.get("product_id")
-                        ),
-                        None,
-                    ),
+                    products_db.get(post.get("product_id")),
                     ensure_ascii=False,
                 )
                 if post
@@ -1095,9 +1621,13 @@ class AdCreationTool(GenericDraftTool):
             prev_ai_response.get("drafts", []) or [] if prev_ai_response else []
         )
         if state == "first_turn":
+            query = self.retrieval_query(current_user_turn, prev_ai_response)
+            ads = self.relevant("ads", ads_db, query)
             return {
-                "All products": json.dumps(products_db, ensure_ascii=False),
-                "All ads": json.dumps(ads_db, ensure_ascii=False),
+                "Relevant products": json.dumps(
+                    self.relevant_products(query, ads), ensure_ascii=False
+                ),
+                "Relevant ads": json.dumps(ads, ensure_ascii=False),
             }
         if state == "optimize":
             ad_id = (
@@ -1105,18 +1635,11 @@ class AdCreationTool(GenericDraftTool):
                 if prev_drafts and len(prev_drafts) > 0
                 else None
             )
-            ad = next((item for item in ads_db if item.get("ad_id") == ad_id), None)
+            ad = ads_db.get(ad_id)
             return {
                 "Ad being optimized": json.dumps(ad, ensure_ascii=False),
                 "Product this ad is for": json.dumps(
-                    next(
-                        (
-                            item
-                            for item in products_db
-                            if item.get("product_id") == ad.get("product_id")
-                        ),
-                        None,
-                    ),
+                    products_db.get(ad.get("product_id")),
                     ensure_ascii=False,
                 )
                 if ad
@@ -1128,17 +1651,10 @@ class AdCreationTool(GenericDraftTool):
                 if prev_drafts and len(prev_drafts) > 0
                 else None
             )
-            ad = next((item for item in ads_db if item.get("ad_id") == ad_id), None)
+            ad = ads_db.get(ad_id)
             return {
                 "Product this ad is for": json.dumps(
-                    next(
-                        (
-                            item
-                            for item in products_db
-                            if item.get("product_id") == ad.get("product_id")
-                        ),
-                        None,
-                    ),
+                    products_db.get(ad.get("product_id")),
                     ensure_ascii=False,
                 )
                 if ad
@@ -1194,6 +1710,7 @@ class ChatInteractionTool(GenericDraftTool):
     db = chats_db
     db_name = "chats"
     remove_from_entry = ["graphs", "status"]
+    context_top_k = max(RETRIEVAL_TOP_K, 10)  # "summarize my chats" matches nothing
 
     def __init__(self):
         super().__init__(
@@ -1213,9 +1730,8 @@ class ChatInteractionTool(GenericDraftTool):
         entry_schema["recommendations"] = [["string"]]
         return entry_schema
 
-    def _get_finalized_entry_with_ai_fields(self, drafts, product_id=None):
-        entry_schema = self._finalized_entry_schema()
-        print("savign schema for chats", entry_schema)
+    async def _get_finalized_entry_with_ai_fields(self, drafts, product_id=None):
+        entry_schema = schema_registry.get(f"finalize:{self.name}")
         all_chats = self.db  # all chat entries
         prompt = f"""
             You are an expert assistant for chat interactions.
@@ -1235,17 +1751,21 @@ class ChatInteractionTool(GenericDraftTool):
 
             Return only valid JSON strictly matching this schema. No explanations, no extra text.
             """
-        result = generate_structured_content(prompt, entry_schema)
+        result = await generate_structured_content(
+            prompt, entry_schema, call_site="finalize"
+        )
         return result
 
     def add_fields_and_format_drafts(self, finalized_entry, product_id):
         pass
 
-    def finalize_and_save(self, drafts, product_id=None):
+    async def finalize_and_save(self, drafts, product_id=None):
         if not drafts or len(drafts) == 0:
             return None
         drafts_edited = self._deserialize_drafts(drafts)
-        ai_filled = self._get_finalized_entry_with_ai_fields(drafts_edited, product_id)
+        ai_filled = await self._get_finalized_entry_with_ai_fields(
+            drafts_edited, product_id
+        )
         print("chats ai filled", ai_filled)
         insights = ai_filled.get("insights", []) or []
         recommendations = ai_filled.get("recommendations", []) or []
@@ -1263,54 +1783,53 @@ class ChatInteractionTool(GenericDraftTool):
         self._finalize_and_save(chats)
 
     def _finalize_and_save(self, chats):
+        updated = []
         for chat_dict in chats:
             chat_id = chat_dict.get("chat_id")
             if not chat_id:
                 continue
-            for idx, entry in enumerate(self.db):
-                if entry.get("chat_id") == chat_id:
-                    self.db[idx]["insights"] = chat_dict.get("insights", []) or []
-                    self.db[idx]["recommendations"] = (
-                        chat_dict.get("recommendations", []) or []
-                    )
-                    self.db[idx]["graphs"] = []  # always empty for chat
-                    self.db[idx]["stats"] = chat_dict.get("stats", []) or []
-                    self.db[idx]["conversation_history"].append(
-                        {
-                            "role": "artisan",
-                            "message": chat_dict.get("message", "") or "",
-                            "timestamp": datetime.now().isoformat() + "Z",
-                            "translation": chat_dict.get("translation", "") or "",
-                        }
-                    )
-                    break
-        # Save all chats to file
-        with open(
-            os.path.join("data", f"{self.db_name}.json"), "w", encoding="utf-8"
-        ) as f:
-            json.dump(self.db, f, indent=2, ensure_ascii=False)
+            entry = self.db.get(chat_id)
+            if entry is None:
+                continue
+            entry["insights"] = chat_dict.get("insights", []) or []
+            entry["recommendations"] = chat_dict.get("recommendations", []) or []
+            entry["graphs"] = []  # always empty for chat
+            entry["stats"] = chat_dict.get("stats", []) or []
+            entry["conversation_history"].append(
+                {
+                    "role": "artisan",
+                    "message": chat_dict.get("message", "") or "",
+                    "timestamp": datetime.now().isoformat() + "Z",
+                    "translation": chat_dict.get("translation", "") or "",
+                }
+            )
+            updated.append(entry)
+        # Save only the chats that changed
+        if updated:
+            save_documents(self.db_name, updated)
 
     def get_context_data(
         self, current_user_turn, prev_ai_response, image_data, image_url
     ):
         state = self.task_state(prev_ai_response)
+        query = self.retrieval_query(current_user_turn, prev_ai_response)
+        relevant_products = json.dumps(self.relevant_products(query), ensure_ascii=False)
         if state == "first_turn":
             return {
-                "All products": json.dumps(products_db, ensure_ascii=False),
-                "All chats": json.dumps(chats_db, ensure_ascii=False),
+                "Relevant products": relevant_products,
+                "Relevant chats": json.dumps(
+                    self.relevant("chats", chats_db, query), ensure_ascii=False
+                ),
             }
         # For other states, only include chats referenced by current drafts
         drafts = current_user_turn.get("drafts", []) or []
         chat_ids = set(d.get("chat_id") for d in drafts if d.get("chat_id"))
-        relevant_chats = [chat for chat in chats_db if chat.get("chat_id") in chat_ids]
+        relevant_chats = [chats_db.get(cid) for cid in chat_ids if chats_db.get(cid)]
         if not relevant_chats:
-            return {
-                "All products": json.dumps(products_db, ensure_ascii=False),
-                "All chats": json.dumps(chats_db, ensure_ascii=False),
-            }
+            relevant_chats = self.relevant("chats", chats_db, query)
         return {
             "Relevant chats": json.dumps(relevant_chats, ensure_ascii=False),
-            "all products": json.dumps(products_db, ensure_ascii=False),
+            "Relevant products": relevant_products,
         }
 
     def get_ai_prompt(self, current_user_turn, prev_ai_response, image_data, image_url):
@@ -1392,17 +1911,19 @@ class ProductHelperTool(GenericDraftTool):
             prev_ai_response.get("drafts", []) or [] if prev_ai_response else []
         )
         if state == "first_turn":
-            return {"All products": json.dumps(products_db, ensure_ascii=False)}
+            query = self.retrieval_query(current_user_turn, prev_ai_response)
+            return {
+                "Relevant products": json.dumps(
+                    self.relevant("products", products_db, query), ensure_ascii=False
+                )
+            }
         if state == "optimize":
             product_id = (
                 prev_drafts[0].get("replacement_of", "") or ""
                 if prev_drafts and len(prev_drafts) > 0
                 else None
             )
-            product = next(
-                (item for item in products_db if item.get("product_id") == product_id),
-                None,
-            )
+            product = products_db.get(product_id)
             return {"Product being optimized": json.dumps(product, ensure_ascii=False)}
         if state == "new":
             return {}
@@ -1490,23 +2011,16 @@ def dict_to_assistant_response(
 
 
 class MarketResearchTool(BaseTool):
+    context_top_k = min(RETRIEVAL_TOP_K, 5)
+
     def __init__(self):
         super().__init__(
             name="handle_market_research",
             description="Use for market analysis, finding trends, or checking what's popular.",
         )
 
-    def execute(
-        self, current_user_turn, prev_ai_response, image_data, image_url
-    ) -> AssistantResponse:
-        # If user asks a follow-up (e.g. clarifies, asks about a previous trend), don't call full research again
-        is_follow_up = (
-            prev_ai_response.get("tool_name", "") in self.name
-            if prev_ai_response
-            else False
-        )
+    def response_schemas(self):
         schema = dataclass_to_schema(AssistantResponse)
-        print("generated scehma", schema)
         for key in [
             "role",
             "turn_id",
@@ -1516,6 +2030,18 @@ class MarketResearchTool(BaseTool):
             "selections_text",
         ]:
             schema.pop(key, None)
+        return {"research": schema}
+
+    async def execute(
+        self, current_user_turn, prev_ai_response, image_data, image_url
+    ) -> AssistantResponse:
+        # If user asks a follow-up (e.g. clarifies, asks about a previous trend), don't call full research again
+        is_follow_up = (
+            prev_ai_response.get("tool_name", "") in self.name
+            if prev_ai_response
+            else False
+        )
+        schema = schema_registry.get(f"research:{self.name}")
         print("is follow up research:", is_follow_up)
         if is_follow_up:
             prev_message = prev_ai_response.get("assistant_message") or ""
@@ -1544,8 +2070,13 @@ class MarketResearchTool(BaseTool):
             """
             # Dynamically generate schema from AssistantResponse dataclass
 
-            followup_gen = generate_structured_content(
-                followup_prompt, schema, prev_ai_response, image_data
+            followup_gen = await generate_structured_content(
+                followup_prompt,
+                schema,
+                prev_ai_response,
+                image_data,
+                call_site="research_followup",
+                stream_field="assistant_message",
             )
             return dict_to_assistant_response(followup_gen, tool_name=self.name)
 
@@ -1567,11 +2098,11 @@ class MarketResearchTool(BaseTool):
             content_parts = [
                 f"As a business analyst, provide a concise summary of the market for '{current_user_turn.get('message', '')}'. Include key trends and major competitors."
             ]
-            if image_data and image_data.get("data"):
-                content_parts.append(Image.open(io.BytesIO(image_data["data"])))
+            if image_data:
+                content_parts.append(Image.open(image_data.path))
 
             # 2. Pass the tool in a list to the 'tools' parameter
-            grounded_response = client.models.generate_content(
+            grounded_response = await client.aio.models.generate_content(
                 model=MODEL_ID,
                 contents=content_parts,
                 config=config,  # This is the correct parameter name
@@ -1610,12 +2141,16 @@ class MarketResearchTool(BaseTool):
             f"ScrapeGraph data: {json.dumps(scraped_data, ensure_ascii=False)}\n"
             f"Gemini summary: {gemini_summary}\n"
             f"Reference URLs: {json.dumps(reference_urls + [c['url'] for c in citations], ensure_ascii=False)}\n"
-            f"Products DB: {json.dumps(products_db, ensure_ascii=False)}\n"
+            f"Relevant products: {json.dumps(self.relevant_products(current_user_turn.get('message') or ''), ensure_ascii=False)}\n"
             "Return a structured response with insights, recommendations, charts, and sources. "
             "If possible, include a chart of key trends. Use the schema provided. if needed make them up"
         )
-        synthesis_gen = generate_structured_content(
-            synthesis_prompt, schema, prev_ai_response
+        synthesis_gen = await generate_structured_content(
+            synthesis_prompt,
+            schema,
+            prev_ai_response,
+            call_site="research",
+            stream_field="assistant_message",
         )
         # Prefer all sources (ScrapeGraph + Gemini citations)
         all_sources = [{"title": url, "url": url} for url in reference_urls]
@@ -1632,7 +2167,10 @@ class GeneralConversationTool(BaseTool):
             description="Use for greetings, farewells, or when the user's intent is unclear.",
         )
 
-    def execute(
+    def response_schemas(self):
+        return {"conversation": {"assistant_message": "string"}}
+
+    async def execute(
         self, current_user_turn, prev_ai_response, image_data, image_url
     ) -> AssistantResponse:
         user_message = current_user_turn.get("message", "")
@@ -1646,10 +2184,13 @@ class GeneralConversationTool(BaseTool):
         If it's a simple greeting, respond warmly. if its a request, guide them that you can help with posts, ads, products, market research, or chats.
         Place your final response in the 'reply_text' field.
         """
-        schema = {"assistant_message": "string"}
-
-        response_gen = generate_structured_content(
-            prompt, schema, prev_ai_response, image_data
+        response_gen = await generate_structured_content(
+            prompt,
+            schema_registry.get(f"conversation:{self.name}"),
+            prev_ai_response,
+            image_data,
+            call_site="conversation",
+            stream_field="assistant_message",
         )
 
         return dict_to_assistant_response(response_gen, tool_name=self.name)
@@ -1671,6 +2212,7 @@ class ToolRegistry:
             {"name": tool.name, "description": tool.description}
             for tool in self.tools.values()
         ]
+        self.definitions_text = json.dumps(self.tool_definitions, indent=2)
 
     def get_tool(self, name: str) -> BaseTool:
         return self.tools.get(name, self.tools["general_conversation"])
@@ -1679,21 +2221,73 @@ class ToolRegistry:
         return self.tool_definitions
 
 
-# Updated ai_task_router with AI-controlled state decisions
+tool_registry = ToolRegistry()
+schema_registry = SchemaRegistry(tool_registry)
+publish_detector = PublishDetector()
+intent_classifier = IntentClassifier(
+    [n for n, t in tool_registry.tools.items() if isinstance(t, GenericDraftTool)]
+)
 
 
-def ai_task_router(
-    current_user_turn: Dict,
-    prev_ai_response: Dict,
-    image_data: Optional[Dict] = None,
-    image_url: Optional[str] = None,
-) -> Dict:
-    """
-    Enhanced agentic router with AI-controlled state management
-    Accepts frontend input keys: selections (dict), user_message (str), edits (str), image_data, image_path, history (dict or list)
-    """
-    registry = ToolRegistry()
+class SpeculationStats:
+    """Counters for speculative execution, to judge whether it pays off"""
+
+    def __init__(self):
+        self.started = 0  # turns where speculation was launched
+        self.hits = 0  # routing + publish decision matched, speculative draft used
+        self.publish_hits = 0  # routing matched, only the publish decision was used
+        self.misses = 0  # routing picked another tool, everything discarded
+
+    def snapshot(self) -> Dict:
+        return {
+            "enabled": SPECULATIVE_EXECUTION,
+            "started": self.started,
+            "hits": self.hits,
+            "publish_hits": self.publish_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / self.started, 3) if self.started else None,
+        }
+
+
+speculation_stats = SpeculationStats()
+
+
+async def _without_events(coro):
+    """run coro (in its own task) without streaming events, its output may be thrown away"""
+    turn_events.set(None)  # only affects this task's context copy
+    speculative_turn.set(True)
+    return await coro
+
+
+_image_semaphores = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore
+
+
+def _image_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _image_semaphores.get(loop)
+    if slots is None:
+        slots = _image_semaphores[loop] = asyncio.Semaphore(IMAGE_CONCURRENCY)
+    return slots
+
+
+def _discard_image(job):
+    """drop an image started for a turn that won't show it: a task or a queued job"""
+    if isinstance(job, asyncio.Task):
+        _discard_task(job)
+    else:
+        image_queue.cancel(job["job_id"])
+
+
+def _discard_task(task: asyncio.Task):
+    """Cancel a speculative task, or swallow its result/exception if already done"""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()  # mark retrieved so asyncio doesn't log it
 
+
+async def _llm_route(current_user_turn, prev_ai_response, image_data, registry):
+    """LLM routing call, returns {"tool_name", "reasoning"}"""
     # AI decides tool and handles state transitions
     routing_prompt = f"""
     Analyze the user's intent and current context:
@@ -1703,7 +2297,7 @@ def ai_task_router(
     User uploaded image: {"Yes" if image_data else "No"}
     Previous assistant response: {json.dumps(prev_ai_response.get("assistant_message", ""), indent=2) if prev_ai_response else "None"}
     Current tool: {prev_ai_response.get("tool_name", "None") if prev_ai_response else "None"}
-    Available tools: {json.dumps(registry.get_definitions(), indent=2)}
+    Available tools: {registry.definitions_text}
 
     Determine: Which tool to use (consider context switching)
 
@@ -1713,22 +2307,146 @@ def ai_task_router(
     - If continuing conversation, use same tool
     """
 
-    routing_schema = {"tool_name": "string", "reasoning": "string"}
+    return await generate_structured_content(
+        routing_prompt,
+        schema_registry.get("routing"),
+        prev_ai_response,
+        call_site="routing",
+    )
+
+
+_shadow_tasks = set()  # keep references so background comparisons aren't GC'd
+
+
+def _shadow_route(guess, current_user_turn, prev_ai_response, image_data, registry):
+    """Run the LLM router in the background only to score a fast-path guess"""
 
-    routing_decision = generate_structured_content(
-        routing_prompt, routing_schema, prev_ai_response
+    async def _compare():
+        decision = await _llm_route(
+            current_user_turn, prev_ai_response, image_data, registry
+        )
+        chosen = decision.get("tool_name", "general_conversation")
+        intent_classifier.stats.record_comparison(guess, chosen)
+        if chosen != guess["tool_name"]:
+            print(f"AGENT: fast path '{guess['rule']}' disagreed with LLM ({chosen})")
+
+    task = asyncio.create_task(_compare())
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+
+# Updated ai_task_router with AI-controlled state decisions
+
+
+async def ai_task_router(
+    current_user_turn: Dict,
+    prev_ai_response: Dict,
+    image_data: Optional[Dict] = None,
+    image_url: Optional[str] = None,
+) -> Dict:
+    """
+    Enhanced agentic router with AI-controlled state management
+    Accepts frontend input keys: selections (dict), user_message (str), edits (str), image_data, image_path, history (dict or list)
+    """
+    registry = tool_registry
+    refresh_collections()  # pick up writes from other processes sharing the store
+
+    # Cheap local guess first; only confident guesses skip the LLM router
+    guess = intent_classifier.classify(
+        current_user_turn, prev_ai_response, image_data is not None
+    )
+    if guess and guess["confidence"] >= FAST_PATH_MIN_CONFIDENCE:
+        intent_classifier.stats.record_guess(guess, taken=True)
+        print(f"AGENT: fast path '{guess['rule']}' -> {guess['tool_name']}")
+        emit_event("routing", {"tool_name": guess["tool_name"], "source": "fast_path"})
+        if guess["tool_name"] == EMPTY_TURN:
+            return dict(prev_ai_response or {})  # nothing to act on, no LLM calls
+        if random.random() < FAST_PATH_SHADOW_RATE:
+            _shadow_route(
+                guess, current_user_turn, prev_ai_response, image_data, registry
+            )
+        tool = registry.get_tool(guess["tool_name"])
+        assistant_response = await tool.execute(
+            current_user_turn, prev_ai_response, image_data, image_url
+        )
+        return _serialize_obj(assistant_response)
+    if guess:
+        intent_classifier.stats.record_guess(guess, taken=False)
+
+    routing = _llm_route(current_user_turn, prev_ai_response, image_data, registry)
+
+    # Most turns stay on the current tool, so its publish decision and drafts can
+    # be generated while routing is still running, then kept or thrown away.
+    current_tool = (
+        registry.tools.get(prev_ai_response.get("tool_name"))
+        if prev_ai_response
+        else None
     )
+    publish_task = draft_task = None
+    if SPECULATIVE_EXECUTION and isinstance(current_tool, GenericDraftTool):
+        speculation_stats.started += 1
+        publish_task = asyncio.create_task(
+            _without_events(
+                current_tool.decide_publish(
+                    current_user_turn, prev_ai_response, image_url
+                )
+            )
+        )
+        draft_task = asyncio.create_task(
+            _without_events(
+                current_tool.generate_draft_response(
+                    current_user_turn, prev_ai_response, image_data, image_url
+                )
+            )
+        )
+
+    try:
+        routing_decision = await routing
+    except BaseException:
+        for task in (publish_task, draft_task):
+            if task:
+                _discard_task(task)
+        raise
     chosen_tool_name = routing_decision.get("tool_name", "general_conversation")
 
     print(
         f"AGENT: Chose tool '{chosen_tool_name}' - {routing_decision.get('reasoning', '')}"
     )
+    if guess:
+        intent_classifier.stats.record_comparison(guess, chosen_tool_name)
+    emit_event("routing", {"tool_name": chosen_tool_name, "source": "llm"})
 
     # Execute tool
     tool = registry.get_tool(chosen_tool_name)
-    assistant_response = tool.execute(
-        current_user_turn, prev_ai_response, image_data, image_url
-    )
+    if publish_task and tool is current_tool:
+        publish_decision = dict(await publish_task)
+        publish_detector.record(publish_decision.pop("_detector", None))  # used, count it
+        if publish_decision.get("publish") or publish_decision.get("cancel"):
+            # drafts were generated for a task that is being published/cancelled
+            speculation_stats.publish_hits += 1
+            _discard_task(draft_task)
+            draft_response = None
+        else:
+            speculation_stats.hits += 1
+            draft_response = await draft_task
+        print("AGENT: speculation hit, draft reused:", draft_response is not None)
+        assistant_response = await tool.complete_turn(
+            current_user_turn,
+            prev_ai_response,
+            image_data,
+            image_url,
+            publish_decision,
+            draft_response,
+        )
+    else:
+        if publish_task:
+            speculation_stats.misses += 1
+            print("AGENT: speculation miss, discarding")
+            _discard_task(publish_task)
+            _discard_task(draft_task)
+        assistant_response = await tool.execute(
+            current_user_turn, prev_ai_response, image_data, image_url
+        )
 
     # Convert to dict format using AssistantResponse's to_dict method
     response_dict = _serialize_obj(assistant_response)
@@ -1763,6 +2481,9 @@ class UserTurnSummarizer:
         # Add message if present
         if message:
             parts.append(message)
+        action = user_turn_for_ai.get("action") if user_turn_for_ai else None
+        if action:
+            parts.append(f"Clicked: {action}")
 
         # Handle selections (array of dicts)
         if selections:
@@ -1,19 +1,40 @@
 import json
 import os
+import hashlib
 import uuid
+import asyncio
 from typing import List, Dict, Any, Optional
 
 from fastapi import (
     FastAPI,
     File,
     Form,
+    Request,
     UploadFile
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from time import time
-from ai_new import ai_task_router, UserTurnSummarizer
+from time import time, monotonic
+from ai_new import (
+    ai_task_router,
+    UserTurnSummarizer,
+    speculation_stats,
+    intent_classifier,
+    publish_detector,
+    response_cache,
+    turn_events,
+    storage,
+    image_queue,
+    IMAGE_JOBS,
+    freepik_client,
+)
+from chat_log import ChatSessions, DEFAULT_SESSION
+from storage import COLLECTION_KEYS
+from retrieval import retriever
+from context_cache import context_cache
+from image_jobs import job_id_from_url, public_view
+from image_cache import image_cache
 
 app = FastAPI(title="AI Artisan Assistant API", version="1.0.0")
 
@@ -24,17 +45,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-History-Cursor"],
 )
 
 # --- Directory and File Setup ---
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
-CHAT_HISTORY_FILE = os.path.join(DATA_DIR, "chat_history.json")
+SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")  # one <session_id>.jsonl per conversation
+# single shared conversation from before sessions, imported into "default" once
+LEGACY_HISTORY_FILES = [
+    os.path.join(DATA_DIR, "chat_history.jsonl"),
+    os.path.join(DATA_DIR, "chat_history.json"),
+]
+HISTORY_PAGE_SIZE = 50  # default /assistant/history page
+HISTORY_PAGE_MAX = 500
+IMAGE_JOBS_BATCH_MAX = 100
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "20")) * 1024 * 1024
+UPLOAD_CHUNK = 1024 * 1024
+# dashboard cache entries are re-checked against storage at most this often
+DASHBOARD_REVALIDATE_SECONDS = float(os.getenv("DASHBOARD_REVALIDATE_SECONDS", "1.0"))
+DASHBOARD_PAGE_SIZE = 50  # default /dashboard/{collection} page
+DASHBOARD_PAGE_MAX = 500
+DASHBOARD_QUERY_CACHE = 32  # encoded query results kept per collection entry
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # --- Serve Uploaded Images Statically ---
-app.mount("/static", StaticFiles(directory=DATA_DIR), name="static")
+# only uploads: the rest of DATA_DIR (session logs, store, caches) is private
+app.mount("/static/uploads", StaticFiles(directory=UPLOAD_DIR), name="static")
 
 # --- Response Models ---
 class APIResponse:
@@ -58,134 +96,535 @@ class APIResponse:
         }
 
 # --- Chat History Management ---
+chat_sessions = ChatSessions(SESSIONS_DIR, legacy_paths=LEGACY_HISTORY_FILES)
+
 class ChatHistoryManager:
-    """Handles chat history persistence and retrieval"""
+    """Handles chat history persistence and retrieval (one append-only log per session)"""
     
     @staticmethod
-    def load() -> List[Dict]:
-        if not os.path.exists(CHAT_HISTORY_FILE):
-            return []
+    def load(session_id: str) -> List[Dict]:
         try:
-            with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
-                content = f.read()
-                return json.loads(content) if content else []
+            return chat_sessions.log(session_id).read()
         except (json.JSONDecodeError, IOError) as e:
             print(f"Error loading chat history: {e}")
             return []
 
     @staticmethod
-    def save(history: List[Dict]) -> bool:
+    def count(session_id: str) -> int:
+        return chat_sessions.log(session_id).count()
+
+    @staticmethod
+    def last_turn(session_id: str) -> Dict:
+        return chat_sessions.log(session_id).last_turn() or {}
+
+    @staticmethod
+    def page(session_id: str, before: Optional[int], after: Optional[int], limit: int) -> Dict:
+        """
+        after: turns with seq > after, oldest first (poll for new turns)
+        before: the `limit` turns just before seq `before` (scroll back)
+        neither: the newest `limit` turns
+        """
+        chat_log = chat_sessions.log(session_id)
+        total = chat_log.count()
+        if after is not None:
+            start = max(after + 1, 0)
+            stop = min(start + limit, total)
+        else:
+            stop = total if before is None else max(min(before, total), 0)
+            start = max(stop - limit, 0)
+        turns = chat_log.read(start, stop)
+        return {
+            "turns": turns,
+            "total": total,
+            "has_more_before": bool(turns) and start > 0,
+            "has_more_after": stop < total,
+            "cursor": total - 1,  # seq of the newest turn, pass as `after` to poll
+        }
+
+    @staticmethod
+    def etag(session_id: str, *params) -> str:
+        key = "|".join([session_id, chat_sessions.log(session_id).version(), *map(str, params)])
+        return '"%s"' % hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    async def append(session_id: str, turns: List[Dict]) -> Optional[List[Dict]]:
+        """returns the stored turns (with seq), None if saving failed"""
         try:
-            with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-                json.dump(history, f, indent=2)
-            return True
+            # fsync off the event loop
+            return await asyncio.to_thread(chat_sessions.log(session_id).append, turns)
         except IOError as e:
             print(f"Error saving chat history: {e}")
+            return None
+
+    @staticmethod
+    def clear(session_id: str) -> bool:
+        try:
+            chat_sessions.log(session_id).clear()
+            return True
+        except IOError as e:
+            print(f"Error clearing chat history: {e}")
             return False
+
+    @staticmethod
+    def apply_image_job(session_id: str, turn_id: str, job: Dict) -> bool:
+        """replace a finished job's placeholder in a turn showing it (a patch record)"""
+        chat_log = chat_sessions.log(session_id)
+        turn = chat_log.find(turn_id)
+        if turn is None:
+            return False  # history cleared meanwhile
+        changed = False
+        drafts = turn.get("drafts") or []
+        for draft in drafts:
+            images = draft.get("images") or []
+            for i, url in enumerate(images):
+                if job_id_from_url(url) == job["job_id"]:
+                    # failed: the placeholder without its fragment is the fallback image
+                    images[i] = job["images"][0] if job["images"] else url.split("#", 1)[0]
+                    changed = True
+        if changed:
+            image_jobs = [
+                {**j, "status": job["status"]} if j.get("job_id") == job["job_id"] else j
+                for j in turn.get("image_jobs") or []
+            ]
+            chat_log.patch(turn_id, {"drafts": drafts, "image_jobs": image_jobs})
+        return changed
+
+
+async def patch_image_job_turn(job: Dict, session_id: str, turn_id: str):
+    """image queue listener: a job finished, show its image in a saved turn"""
+    async with chat_sessions.lock(session_id):  # not while a turn reads history
+        await asyncio.to_thread(ChatHistoryManager.apply_image_job, session_id, turn_id, job)
+
+
+image_queue.listeners.append(patch_image_job_turn)
+
+
+def referenced_images(filenames: List[str]) -> set:
+    """image cache reference check: the hand-outs a stored item or chat log still shows"""
+    logs = list(LEGACY_HISTORY_FILES)
+    if os.path.isdir(SESSIONS_DIR):
+        logs += [os.path.join(SESSIONS_DIR, f) for f in os.listdir(SESSIONS_DIR) if f.endswith(".jsonl")]
+    found = set()
+    for name in COLLECTION_KEYS:
+        text = json.dumps(storage.load(name), ensure_ascii=False)
+        found.update(f for f in filenames if f in text)
+    for path in logs:
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except FileNotFoundError:
+            continue
+        found.update(f for f in filenames if f in text)
+    return found
+
+
+image_cache.reference_check = referenced_images
+
 # --- File Upload Handler ---
+class UploadedImage:
+    """
+    A stored upload: content-addressed file under UPLOAD_DIR. The bytes stay on
+    disk, read() loads them when a consumer really needs them.
+    """
+
+    def __init__(self, path: str, sha256: str, size: int, mime_type: Optional[str]):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.mime_type = mime_type
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
 class FileUploadHandler:
     """Handles file uploads and generates URLs"""
-    
+
     @staticmethod
-    async def process_upload(image: UploadFile) -> tuple[Dict, str, str]:
+    async def process_upload(image: UploadFile) -> tuple[UploadedImage, str, str]:
         """
-        Process uploaded file and return (image_data, image_url, filename)
+        Process uploaded file and return (image_data, image_url, filename).
+        The upload is streamed to disk in UPLOAD_CHUNK pieces, hashed on the way
+        and named by its sha256, so the same photo uploaded twice is stored once.
         """
         if not image or not image.filename:
             return None, None, None
-            
-        # Generate unique filename
-        unique_filename = f"{uuid.uuid4()}{os.path.splitext(image.filename)[1]}"
-        file_location = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Save file
-        contents = await image.read()
-        with open(file_location, "wb") as f:
-            f.write(contents)
-        
-        # Return processed data
-        image_data = {"mime_type": image.content_type, "data": contents}
-        image_url = f"/static/uploads/{unique_filename}"
-        
+
+        tmp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            while True:
+                chunk = await image.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise ChatTurnError(
+                        f"Image is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB",
+                        "FILE_TOO_LARGE",
+                    )
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+            await asyncio.to_thread(f.close)
+        except BaseException:
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.remove, tmp_path)
+            raise
+
+        sha256 = digest.hexdigest()
+        stored_filename = f"{sha256}{os.path.splitext(image.filename)[1].lower()}"
+        file_location = os.path.join(UPLOAD_DIR, stored_filename)
+        if os.path.exists(file_location):
+            await asyncio.to_thread(os.remove, tmp_path)  # already have it
+        else:
+            await asyncio.to_thread(os.replace, tmp_path, file_location)
+
+        image_data = UploadedImage(file_location, sha256, size, image.content_type)
+        image_url = f"/static/uploads/{stored_filename}"
+
         return image_data, image_url, image.filename
 # --- Dashboard Endpoints ---
+class DashboardCache:
+    """
+    Per collection: the parsed documents, the encoded success response and a
+    strong ETag of those bytes. An entry is re-validated against
+    storage.version() (file mtime + size for JSON, the meta version for SQLite)
+    at most every DASHBOARD_REVALIDATE_SECONDS; writes from this process drop
+    it right away.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._entries: Dict[str, Dict] = {}
+        self._generations: Dict[str, int] = {}  # bumped by invalidate
+        self.stats = {"hits": 0, "revalidated": 0, "loads": 0, "not_modified": 0}
+        store.listeners.append(self.invalidate)
+
+    def invalidate(self, collection: str):
+        self._generations[collection] = self._generations.get(collection, 0) + 1
+        self._entries.pop(collection, None)
+
+    async def get(self, collection: str) -> Dict:
+        entry = self._entries.get(collection)
+        now = monotonic()
+        if entry and now - entry["checked_at"] < DASHBOARD_REVALIDATE_SECONDS:
+            self.stats["hits"] += 1
+            return entry
+        version = await asyncio.to_thread(self.store.version, collection)
+        if entry and entry["version"] == version:
+            entry["checked_at"] = now
+            self.stats["revalidated"] += 1
+            return entry
+        generation = self._generations.get(collection, 0)
+        entry = await asyncio.to_thread(self._build, collection, version)
+        if self._generations.get(collection, 0) == generation:
+            self._entries[collection] = entry  # else a write landed meanwhile, don't keep it
+        self.stats["loads"] += 1
+        return entry
+
+    def snapshot(self) -> Dict:
+        return {**self.stats, "entries": len(self._entries)}
+
+    def _build(self, collection: str, version) -> Dict:
+        # version was read before loading: a write in between is caught next check
+        data = self.store.load(collection)
+        body = json.dumps(
+            APIResponse.success(data), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        return {
+            "version": version,
+            "checked_at": monotonic(),
+            "data": data,
+            "body": body,
+            "etag": '"%s"' % hashlib.sha256(body).hexdigest()[:32],
+            "index": None,  # pk -> document, built on the first detail request
+            "queries": {},  # query key -> (etag, body)
+        }
+
+
+dashboard_cache = DashboardCache(storage)
+
+
+@app.on_event("shutdown")
+def flush_storage():
+    """write out buffered dashboard writes before the process exits"""
+    if hasattr(storage, "close"):
+        storage.close()
+
+
+@app.on_event("startup")
+async def start_image_jobs():
+    if IMAGE_JOBS:
+        image_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_image_jobs():
+    await image_queue.stop()  # unfinished jobs run again on the next start
+
 class DashboardHandler:
     @staticmethod
-    def return_json(word: str):
-        """Unified dashboard data loader for all endpoints"""
+    async def return_json(word: str, request: Request):
+        """
+        Unified dashboard data loader for all endpoints (cached, conditional GET).
+        Without query parameters the whole collection is returned as a list;
+        with any of product_id, status, fields, sort, limit, cursor a page is
+        returned instead, see DashboardHandler.query.
+        """
         try:
-            data = DashboardHandler.read_json_file(f"{word}.json")
-            return APIResponse.success(data)
+            entry = await dashboard_cache.get(word)
+            params = DashboardHandler.query_params(request)
+            if not params:
+                etag, body = entry["etag"], entry["body"]
+            else:
+                query_key = json.dumps(params, sort_keys=True)
+                cached = entry["queries"].get(query_key)
+                if cached is None:
+                    page = DashboardHandler.query(word, entry["data"], params)
+                    body = json.dumps(
+                        APIResponse.success(page), ensure_ascii=False, separators=(",", ":")
+                    ).encode("utf-8")
+                    cached = ('"%s"' % hashlib.sha256(body).hexdigest()[:32], body)
+                    if len(entry["queries"]) >= DASHBOARD_QUERY_CACHE:
+                        entry["queries"].pop(next(iter(entry["queries"])))
+                    entry["queries"][query_key] = cached
+                etag, body = cached
+            return DashboardHandler.cached_response(request, etag, body)
+        except ValueError as e:
+            return JSONResponse(
+                status_code=400,
+                content=APIResponse.error(str(e), error_code="VALIDATION_ERROR")
+            )
         except Exception as e:
             return JSONResponse(
                 status_code=500,
                 content=APIResponse.error(f"Failed to fetch {word}", details=str(e))
             )
-        
-    
+
     @staticmethod
-    def read_json_file(filename: str) -> Dict:
-        path = os.path.join(DATA_DIR, filename)
-        if not os.path.exists(path):
-            return {}
+    async def return_item(word: str, item_id: str, request: Request):
+        """one document by primary key, from an index built once per cache entry"""
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Error reading {filename}: {e}")
-            return {}
+            entry = await dashboard_cache.get(word)
+            key = COLLECTION_KEYS[word]
+            if key is None:
+                raise KeyError(f"{word} has no ids")
+            if entry["index"] is None:
+                entry["index"] = {doc.get(key): doc for doc in reversed(entry["data"])}
+            doc = entry["index"].get(item_id)
+            if doc is None:
+                raise KeyError(f"{word} has no {item_id}")
+            body = json.dumps(
+                APIResponse.success(doc), ensure_ascii=False, separators=(",", ":")
+            ).encode("utf-8")
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+            return DashboardHandler.cached_response(request, etag, body)
+        except KeyError as e:
+            return JSONResponse(
+                status_code=404,
+                content=APIResponse.error(str(e).strip("'"), error_code="NOT_FOUND")
+            )
+        except Exception as e:
+            return JSONResponse(
+                status_code=500,
+                content=APIResponse.error(f"Failed to fetch {word}", details=str(e))
+            )
+
+    @staticmethod
+    def cached_response(request: Request, etag: str, body: bytes) -> Response:
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, etag):
+            dashboard_cache.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    @staticmethod
+    def query_params(request: Request) -> Dict:
+        names = ("product_id", "status", "fields", "sort", "limit", "cursor")
+        return {n: request.query_params[n] for n in names if request.query_params.get(n)}
+
+    @staticmethod
+    def query(word: str, docs: List[Dict], params: Dict) -> Dict:
+        """
+        product_id, status: comma separated values to keep
+        fields: comma separated top-level fields to return (the id is always kept)
+        sort: comma separated fields, "-" prefix for descending (e.g. -created_at)
+        limit (default 50, max 500) and cursor (next_cursor of the previous page)
+        """
+        for field in ("product_id", "status"):
+            if field in params:
+                wanted = set(params[field].split(","))
+                docs = [d for d in docs if str(d.get(field)) in wanted]
+        for sort_field in reversed(params.get("sort", "").split(",")):
+            if sort_field.strip("-"):
+                name = sort_field.strip("-")
+                present = [d for d in docs if d.get(name) is not None]
+                missing = [d for d in docs if d.get(name) is None]  # always last
+                present.sort(key=lambda d: _sort_value(d[name]), reverse=sort_field.startswith("-"))
+                docs = present + missing
+        try:
+            limit = int(params.get("limit", DASHBOARD_PAGE_SIZE))
+            offset = int(params.get("cursor", 0))
+        except ValueError:
+            raise ValueError("limit and cursor must be integers")
+        limit = max(1, min(limit, DASHBOARD_PAGE_MAX))
+        offset = max(offset, 0)
+        page = docs[offset : offset + limit]
+        if "fields" in params:
+            fields = set(params["fields"].split(","))
+            if COLLECTION_KEYS.get(word):
+                fields.add(COLLECTION_KEYS[word])
+            page = [{k: v for k, v in d.items() if k in fields} for d in page]
+        return {
+            "items": page,
+            "total": len(docs),
+            "next_cursor": str(offset + limit) if offset + limit < len(docs) else None,
+        }
 
-@app.get("/dashboard/posts")
-async def posts_dashboard():
-    return DashboardHandler.return_json("posts")
 
-@app.get("/dashboard/chats")
-async def chats_dashboard():
-    return DashboardHandler.return_json("chats")
+def _sort_value(value):
+    """orders numbers, then strings, then anything else, without comparing across types"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value, "")
+    if isinstance(value, str):
+        return (1, 0, value)
+    return (2, 0, json.dumps(value, sort_keys=True))
 
-@app.get("/dashboard/products")
-async def products_dashboard():
-    return DashboardHandler.return_json("products")
 
-@app.get("/dashboard/ads")
-async def ads_dashboard():
-    return DashboardHandler.return_json("ads")
+@app.get("/dashboard/{collection}")
+async def collection_dashboard(collection: str, request: Request):
+    """posts, chats, products, ads or research"""
+    if collection not in COLLECTION_KEYS:
+        return JSONResponse(
+            status_code=404,
+            content=APIResponse.error(f"Unknown collection {collection}", error_code="NOT_FOUND")
+        )
+    return await DashboardHandler.return_json(collection, request)
 
-@app.get("/dashboard/research")
-async def research_dashboard():
-    return DashboardHandler.return_json("research")
+@app.get("/dashboard/{collection}/{item_id}")
+async def collection_item_dashboard(collection: str, item_id: str, request: Request):
+    if collection not in COLLECTION_KEYS:
+        return JSONResponse(
+            status_code=404,
+            content=APIResponse.error(f"Unknown collection {collection}", error_code="NOT_FOUND")
+        )
+    return await DashboardHandler.return_item(collection, item_id, request)
+
+# --- Image Jobs ---
+@app.get("/images/jobs")
+async def get_image_jobs(ids: str = ""):
+    """status of several image jobs, ids comma separated"""
+    job_ids = [i for i in ids.split(",") if i][:IMAGE_JOBS_BATCH_MAX]
+    jobs = {job_id: image_queue.get(job_id) for job_id in job_ids}
+    return APIResponse.success(
+        {
+            "jobs": [public_view(job) for job in jobs.values() if job],
+            "missing": [job_id for job_id, job in jobs.items() if not job],
+        }
+    )
+
+@app.get("/images/jobs/{job_id}")
+async def get_image_job(job_id: str):
+    job = image_queue.get(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content=APIResponse.error(f"Unknown image job {job_id}", error_code="NOT_FOUND")
+        )
+    return APIResponse.success(public_view(job))
 
 # --- Additional Utility Endpoints ---
 
 @app.get("/assistant/history")
-async def get_chat_history():
-    """Get the current chat history"""
+async def get_chat_history(
+    request: Request,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+    session_id: Optional[str] = None,
+):
+    """Get a page of the caller's chat history, see ChatHistoryManager.page"""
     try:
-        history = ChatHistoryManager.load()
-        return APIResponse.success(history)
+        session_id = resolve_session_id(request, session_id)
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        etag = ChatHistoryManager.etag(session_id, before, after, limit)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        page = ChatHistoryManager.page(session_id, before, after, limit)
+        return JSONResponse(
+            content=APIResponse.success(page),
+            headers={"ETag": etag, "X-History-Cursor": str(page["cursor"])},
+        )
+    except ChatTurnError as e:
+        return chat_error_response(e)
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content=APIResponse.error("Failed to fetch chat history", details=str(e))
         )
 
+@app.get("/assistant/stats")
+async def get_assistant_stats():
+    """Runtime counters for the chat pipeline"""
+    return APIResponse.success(
+        {
+            "speculation": speculation_stats.snapshot(),
+            "fast_path": intent_classifier.stats.snapshot(),
+            "publish_detector": publish_detector.stats,
+            "llm_cache": response_cache.snapshot(),
+            "dashboard_cache": dashboard_cache.snapshot(),
+            "retrieval": retriever.stats,
+            "context_cache": context_cache.snapshot(),
+            "storage": storage.snapshot() if hasattr(storage, "snapshot") else {},
+            "image_jobs": image_queue.stats,
+            "freepik": freepik_client.snapshot(),
+            "image_cache": image_cache.snapshot(),
+        }
+    )
+
 @app.delete("/assistant/history")
-async def clear_chat_history():
-    """Clear the chat history"""
+async def clear_chat_history(request: Request, session_id: Optional[str] = None):
+    """Clear the caller's chat history, other sessions are untouched"""
     try:
-        if ChatHistoryManager.save([]):
+        session_id = resolve_session_id(request, session_id)
+        async with chat_sessions.lock(session_id):  # not in the middle of a turn
+            cleared = ChatHistoryManager.clear(session_id)
+        if cleared:
             return APIResponse.success({}, "Chat history cleared successfully")
         else:
             return JSONResponse(
                 status_code=500,
                 content=APIResponse.error("Failed to clear chat history")
             )
+    except ChatTurnError as e:
+        return chat_error_response(e)
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content=APIResponse.error("Failed to clear chat history", details=str(e))
         )
 
+def resolve_session_id(request: Request, session_id: Optional[str] = None) -> str:
+    """session from the session_id field/param, else the X-Session-Id header, else default"""
+    session_id = session_id or request.headers.get("x-session-id") or DEFAULT_SESSION
+    if not ChatSessions.valid_id(session_id):
+        raise ChatTurnError(
+            "Invalid session id (1-64 letters, digits, '-' or '_')", "INVALID_SESSION"
+        )
+    return session_id
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check (weak comparison, lists and * allowed)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip().removeprefix("W/") for c in header.split(",")]
+    return "*" in candidates or etag in candidates
+
 # --- Error Handlers ---
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
@@ -210,12 +649,167 @@ async def method_not_allowed_handler(request, exc):
 
 
 
+class ChatTurnError(Exception):
+    """A request problem found before the AI runs, returned as a 400"""
+
+    def __init__(self, message: str, error_code: str):
+        super().__init__(message)
+        self.error_code = error_code
+
+
+async def prepare_user_turn(message, selections, image, drafts, action):
+    """
+    Parse the form fields and store the upload.
+    Returns (user_turn_for_ai, image_data, image_url, image_filename)
+    """
+    parsed_selections = None
+    # Parse user selections
+    try:
+        parsed_selections = json.loads(selections)
+    except json.JSONDecodeError:
+        raise ChatTurnError("Invalid selections JSON format", "INVALID_JSON")
+
+    # Process file upload if present
+    image_data, image_url, image_filename = await FileUploadHandler.process_upload(image)
+
+    parsed_drafts = json.loads(drafts) if drafts else None
+
+    # Prepare context for AI router
+    user_turn_for_ai = {
+        "message": message,
+        "selections": parsed_selections,
+        "image_url": image_url,
+        "drafts": parsed_drafts,
+        "action": action,
+    }
+    return user_turn_for_ai, image_data, image_url, image_filename
+
+
+async def run_chat_turn(session_id, user_turn_for_ai, image_data, image_url, image_filename):
+    """
+    Runs the AI for one user turn and saves both turns. Turns of the same
+    session run one at a time; different sessions run in parallel.
+    Returns the response content: the new [user_turn, assistant_turn] (with
+    their seq), or the previous assistant turn if the user sent nothing meaningful.
+    """
+    async with chat_sessions.lock(session_id):
+        return await _run_chat_turn(
+            session_id, user_turn_for_ai, image_data, image_url, image_filename
+        )
+
+
+async def _run_chat_turn(session_id, user_turn_for_ai, image_data, image_url, image_filename):
+    # Load current chat prev_ai_response
+    length_chat = ChatHistoryManager.count(session_id)
+    prev_ai_response = ChatHistoryManager.last_turn(session_id) if length_chat > 1 else {}  #get last ai turn only
+    print(prev_ai_response)
+
+    # Execute AI router
+    #image data not in turn 
+    print("prev_ai_response",prev_ai_response)
+    assistant_turn = await ai_task_router(current_user_turn=user_turn_for_ai,
+                                    prev_ai_response=prev_ai_response, 
+                                    image_data=image_data,
+                                    image_url=  image_url
+                                    )
+    print("assistant response",assistant_turn)
+    # Create user turn summary
+    summary = UserTurnSummarizer.create_summary(user_turn_for_ai,prev_ai_response,image_filename)
+    print("chat summary",summary)
+    # images still generating in the background (placeholders in the drafts)
+    image_job_ids = [
+        job_id
+        for draft in assistant_turn.get("drafts") or []
+        for job_id in map(job_id_from_url, draft.get("images") or [])
+        if job_id
+    ]
+    # If no meaningful input, return current prev_ai_response
+    if not summary:
+        for job_id in image_job_ids:
+            image_queue.cancel(job_id)  # the assistant turn is dropped
+        return prev_ai_response
+    # Build user turn object
+    user_turn = {
+        "role": "user",
+        "content": summary,
+        "turn_id": f"user_{length_chat}",
+        "timestamp": int(time() * 1000),  # milliseconds
+        "image_url": image_url ,
+        "selections": user_turn_for_ai["selections"] ,
+        "drafts": user_turn_for_ai["drafts"]
+    }
+    
+    # Ensure assistant turn has required fields
+    assistant_turn["role"] = "assistant"
+    assistant_turn["turn_id"] = f"assistant_{length_chat+1}"
+    assistant_turn["timestamp"] = int(time() * 1000)  # milliseconds
+    assistant_turn["image_jobs"] = [
+        {"job_id": job_id, "draft_id": draft.get("draft_id"), "status": "queued"}
+        for draft in assistant_turn.get("drafts") or []
+        for job_id in map(job_id_from_url, draft.get("images") or [])
+        if job_id
+    ]
+
+    # Append both turns to the history log
+    try:
+        new_turns = await ChatHistoryManager.append(session_id, [user_turn, assistant_turn])
+    except BaseException:
+        for job_id in image_job_ids:
+            image_queue.cancel(job_id)  # cancelled before the turn was saved
+        raise
+    if image_job_ids:
+        # after the append: a job that already finished patches the saved turn
+        image_queue.attach(image_job_ids, session_id, assistant_turn["turn_id"])
+    if new_turns is None:
+        print("Warning: Failed to save chat history")
+        return [user_turn, assistant_turn]
+
+    return new_turns
+
+
+def history_cursor_headers(content) -> Optional[Dict]:
+    """X-History-Cursor: seq of the newest turn in a chat response"""
+    last = content[-1] if isinstance(content, list) and content else content
+    seq = last.get("seq") if isinstance(last, dict) else None
+    return {"X-History-Cursor": str(seq)} if seq is not None else None
+
+
+def chat_error_response(e: Exception) -> JSONResponse:
+    if isinstance(e, ChatTurnError):
+        return JSONResponse(
+            status_code=400,
+            content=APIResponse.error(str(e), error_code=e.error_code)
+        )
+    if isinstance(e, ValueError):
+        return JSONResponse(
+            status_code=400,
+            content=APIResponse.error(
+                "Invalid request data",
+                error_code="VALIDATION_ERROR",
+                details=str(e)
+            )
+        )
+    import traceback
+    traceback.print_exc()
+    return JSONResponse(
+        status_code=500,
+        content=APIResponse.error(
+            "Internal server error occurred",
+            error_code="INTERNAL_ERROR",
+            details=str(e) if app.debug else None
+        )
+    )
+
+
 @app.post("/assistant/chat")
 async def assistant_chat(
+    request: Request,
     message: Optional[str] = Form(None),
     selections: str = Form("[{}]"),
     image: Optional[UploadFile] = File(None),
-    drafts: Optional[str] = Form(None)
+    drafts: Optional[str] = Form(None),
+    action: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None)
 ):
     """
     Main unified chat endpoint for AI assistant interaction.
@@ -224,103 +818,71 @@ async def assistant_chat(
     The frontend sends user data and receives a complete response structure.
     """
     try:
-        # Load current chat prev_ai_response
-        history = ChatHistoryManager.load()
-        length_chat = len(history)
-        prev_ai_response = history[-1] if length_chat > 1 else {}  #get last ai turn only
-        print(prev_ai_response)
-        parsed_selections =None
-        # Parse user selections
-        try:
-            parsed_selections = json.loads(selections)
-        except json.JSONDecodeError:
-            return JSONResponse(
-                status_code=400,
-                content=APIResponse.error(
-                    "Invalid selections JSON format",
-                    error_code="INVALID_JSON"
-                )
-            )
-        
-        # Process file upload if present
-        image_data, image_url, image_filename = await FileUploadHandler.process_upload(image)
-        
-        
-        parsed_drafts = json.loads(drafts) if drafts else None
-        
-        
-        # Combine selections from previous turn and current turn
-        
-        # Prepare context for AI router
-        user_turn_for_ai = {
-            "message": message,
-            "selections": parsed_selections,
-            "image_url": image_url,
-            "drafts":parsed_drafts,
-        }
-        
-        # Execute AI router
-        #image data not in turn 
-        print("prev_ai_response",prev_ai_response)
-        assistant_turn = ai_task_router(current_user_turn=user_turn_for_ai,
-                                        prev_ai_response=prev_ai_response, 
-                                        image_data=image_data,
-                                        image_url=  image_url
-                                        )
-        print("assistant response",assistant_turn)
-        # Create user turn summary
-        summary = UserTurnSummarizer.create_summary(user_turn_for_ai,prev_ai_response,image_filename)
-        print("chat summary",summary)
-        # If no meaningful input, return current prev_ai_response
-        if not summary:
-            return JSONResponse(content=prev_ai_response)
-        # Build user turn object
-        user_turn = {
-            "role": "user",
-            "content": summary,
-            "turn_id": f"user_{length_chat}",
-            "timestamp": int(time() * 1000),  # milliseconds
-            "image_url": image_url ,
-            "selections": parsed_selections ,
-            "drafts": parsed_drafts
-        }
-        
-        # Add user turn to prev_ai_response
-        history.append(user_turn)
+        session_id = resolve_session_id(request, session_id)
+        prepared = await prepare_user_turn(message, selections, image, drafts, action)
+        content = await run_chat_turn(session_id, *prepared)
+        return JSONResponse(content=content, headers=history_cursor_headers(content))
+    except Exception as e:
+        return chat_error_response(e)
 
-        # Ensure assistant turn has required fields
-        assistant_turn["role"] = "assistant"
-        assistant_turn["turn_id"] = f"assistant_{length_chat+1}"
-        assistant_turn["timestamp"] = int(time() * 1000)  # milliseconds
-        # Add assistant turn to history
-        history.append(assistant_turn)
 
-        # Save updated history
-        if not ChatHistoryManager.save(history):
-            print("Warning: Failed to save chat history")
+_stream_turns = set()  # SSE chat turns still running
 
-        return JSONResponse(content=history)
 
-    except ValueError as e:
-        return JSONResponse(
-            status_code=400,
-            content=APIResponse.error(
-                "Invalid request data",
-                error_code="VALIDATION_ERROR",
-                details=str(e)
-            )
-        )
+@app.post("/assistant/chat/stream")
+async def assistant_chat_stream(
+    request: Request,
+    message: Optional[str] = Form(None),
+    selections: str = Form("[{}]"),
+    image: Optional[UploadFile] = File(None),
+    drafts: Optional[str] = Form(None),
+    action: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None)
+):
+    """
+    Same as /assistant/chat, but answers with Server-Sent Events as the turn runs:
+    start, routing, publish, token (assistant_message pieces), drafts, images,
+    then done (same content /assistant/chat returns) or error.
+    """
+    try:
+        session_id = resolve_session_id(request, session_id)
+        # the upload must be read before the request body goes away
+        prepared = await prepare_user_turn(message, selections, image, drafts, action)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return JSONResponse(
-            status_code=500,
-            content=APIResponse.error(
-                "Internal server error occurred",
-                error_code="INTERNAL_ERROR",
-                details=str(e) if app.debug else None
-            )
-        )
+        return chat_error_response(e)
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run():
+        turn_events.set(lambda event, data: queue.put_nowait((event, data)))
+        try:
+            queue.put_nowait(("done", await run_chat_turn(session_id, *prepared)))
+        except Exception as e:
+            error = chat_error_response(e)
+            queue.put_nowait(("error", json.loads(error.body)))
+        finally:
+            queue.put_nowait(None)
+
+    async def event_stream():
+        # the turn finishes (and is saved) even if the client leaves: the generator is
+        # closed then, so the task is referenced from the module until it is done
+        task = asyncio.create_task(run())
+        _stream_turns.add(task)
+        task.add_done_callback(_stream_turns.discard)
+        yield sse_event("start", {"accepted": True})
+        while (item := await queue.get()) is not None:
+            yield sse_event(*item)
+        await task
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 if __name__ == "__main__":
     import uvicorn
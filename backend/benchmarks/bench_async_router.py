@@ -0,0 +1,125 @@
+"""
+Concurrent throughput of ai_task_router against a local fake Gemini client.
+
+"blocking" mode makes every model call sleep on the event loop, which is what the
+old synchronous client.models.generate_content path did. "async" mode awaits the
+call the way the aio client does. No network or API quota is used. The LLM
+response cache is switched off and every turn asks something different (and
+not a greeting, which the intent fast path would answer without the router), so
+each turn really makes its model calls.
+
+    cd backend && python benchmarks/bench_async_router.py --turns 20 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)  # ai_new loads data/*.json relative to cwd
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+import ai_new  # noqa: E402
+import llm_cache  # noqa: E402
+
+for _site in llm_cache.CACHE_TTLS:
+    llm_cache.CACHE_TTLS[_site] = 0  # measure model calls, not cache hits
+
+FAKE_REPLY = json.dumps(
+    {
+        "tool_name": "general_conversation",
+        "reasoning": "benchmark",
+        "assistant_message": "Hello from the fake model!",
+    }
+)
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = []
+
+
+class _FakeModels:
+    def __init__(self, latency, blocking):
+        self.latency = latency
+        self.blocking = blocking
+        self.calls = 0
+
+    async def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        if self.blocking:
+            time.sleep(self.latency)  # what the sync client did to the event loop
+        else:
+            await asyncio.sleep(self.latency)
+        return _FakeResponse(FAKE_REPLY)
+
+
+class _FakeAio:
+    def __init__(self, models):
+        self.models = models
+
+
+class FakeClient:
+    def __init__(self, latency, blocking):
+        self.aio = _FakeAio(_FakeModels(latency, blocking))
+
+
+async def _route_once(i):
+    user_turn = {
+        "message": f"what price should I ask for handmade basket #{i}?",
+        "selections": [],
+        "image_url": None,
+        "drafts": None,
+    }
+    return await ai_new.ai_task_router(
+        current_user_turn=user_turn, prev_ai_response={}, image_data=None, image_url=None
+    )
+
+
+async def _run_turns(turns):
+    await asyncio.gather(*(_route_once(i) for i in range(turns)))
+
+
+def bench(mode, turns, latency):
+    fake = FakeClient(latency, blocking=(mode == "blocking"))
+    ai_new.client = fake
+    start = time.perf_counter()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")  # the router prints every prompt
+    try:
+        asyncio.run(_run_turns(turns))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "turns": turns,
+        "model_calls": fake.aio.models.calls,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(turns / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake model call")
+    args = parser.parse_args()
+
+    results = [bench(mode, args.turns, args.latency) for mode in ("blocking", "async")]
+    for r in results:
+        print(
+            f"{r['mode']:>8}: {r['turns']} turns, {r['model_calls']} model calls "
+            f"in {r['seconds']}s -> {r['turns_per_second']} turns/s"
+        )
+    print(f"speedup: {results[0]['seconds'] / results[1]['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Micro-benchmark: compiled dataclass encoders/decoders vs the old asdict-based
+_serialize_obj/_deserialize_obj, on a large AssistantResponse.
+
+    cd backend && python benchmarks/bench_serializers.py --drafts 40 --points 200
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from dataclasses import asdict, fields
+from enum import Enum
+from typing import Union, get_args, get_origin
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)  # ai_new loads data/*.json relative to cwd
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+import ai_new  # noqa: E402
+
+
+# --- the implementations being replaced, kept here for comparison ---
+def legacy_serialize(obj):
+    if hasattr(obj, "__dataclass_fields__"):
+        return {k: legacy_serialize(v) for k, v in asdict(obj).items()}
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, dict):
+        return {k: legacy_serialize(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [legacy_serialize(i) for i in obj]
+    return obj
+
+
+def legacy_deserialize(data, cls):
+    if hasattr(cls, "__dataclass_fields__") and isinstance(data, dict):
+        field_types = {f.name: f.type for f in fields(cls)}
+        kwargs = {}
+        for k, v in data.items():
+            typ = field_types.get(k)
+            if typ is None:
+                continue
+            origin = get_origin(typ)
+            args = get_args(typ)
+            if origin is Union and type(None) in args:
+                typ = [a for a in args if a is not type(None)][0]
+                origin = get_origin(typ)
+                args = get_args(typ)
+            if origin is list and isinstance(v, list):
+                inner = args[0]
+                kwargs[k] = [legacy_deserialize(i, inner) for i in v]
+            elif origin is dict and isinstance(v, dict):
+                kwargs[k] = {ik: legacy_deserialize(iv, args[1]) for ik, iv in v.items()}
+            elif isinstance(typ, type) and issubclass(typ, Enum):
+                kwargs[k] = typ(v)
+            elif hasattr(typ, "__dataclass_fields__"):
+                kwargs[k] = legacy_deserialize(v, typ)
+            else:
+                kwargs[k] = v
+        return cls(**kwargs)
+    elif isinstance(cls, type) and issubclass(cls, Enum):
+        return cls(data)
+    else:
+        return data
+
+
+def build_response(n_drafts, n_points):
+    return {
+        "assistant_message": "Here are your drafts",
+        "drafts": [
+            {
+                "draft_id": f"d{i}",
+                "language": "en",
+                "caption": "Handwoven silk saree " * 5,
+                "hashtags": ["#handloom", "#saree", "#artisan"],
+                "images": ["/static/uploads/x.png"],
+                "platforms": ["instagram", "facebook"],
+                "region": "IN",
+            }
+            for i in range(n_drafts)
+        ],
+        "charts": [
+            {
+                "title": f"trend {c}",
+                "type": "line",
+                "x_type": "datetime",
+                "data": [
+                    {"x": f"2025-01-{p % 28 + 1:02d}", "y": p * 1.5, "series": "s"}
+                    for p in range(n_points)
+                ],
+            }
+            for c in range(4)
+        ],
+        "insights": [
+            {"text": f"insight {i}", "metric": {"name": "reach", "value": i, "unit": ""}}
+            for i in range(n_drafts)
+        ],
+        "stats": [{"name": "likes", "value": i, "unit": ""} for i in range(n_drafts)],
+        "selections": [
+            {
+                "prompt_id": f"p{i}",
+                "prompt": "Which platform?",
+                "options": [{"label": "Instagram", "id": "ig"}, {"label": "Facebook", "id": "fb"}],
+                "selection_type": "multi",
+            }
+            for i in range(5)
+        ],
+        "sources": [{"title": "x", "url": "https://example.com"}],
+        "editing_enabled": True,
+        "product_id": "product_1",
+    }
+
+
+def decode_with(deserialize, data):
+    """same shape of work dict_to_assistant_response does"""
+    return ai_new.AssistantResponse(
+        assistant_message=data["assistant_message"],
+        drafts=[deserialize(d, ai_new.PostDraft) for d in data["drafts"]],
+        charts=[deserialize(c, ai_new.Graph) for c in data["charts"]],
+        insights=[deserialize(i, ai_new.Insight) for i in data["insights"]],
+        stats=[deserialize(s, ai_new.Metric) for s in data["stats"]],
+        selections=[deserialize(s, ai_new.SelectionPrompt) for s in data["selections"]],
+        sources=data["sources"],
+        product_id=data["product_id"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--drafts", type=int, default=40)
+    parser.add_argument("--points", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    data = build_response(args.drafts, args.points)
+    obj_new = decode_with(ai_new._deserialize_obj, data)
+    obj_old = decode_with(legacy_deserialize, data)
+    assert obj_new == obj_old, "decoders disagree"
+    assert ai_new._serialize_obj(obj_new) == legacy_serialize(obj_old), "encoders disagree"
+
+    rows = [
+        ("decode", lambda: decode_with(legacy_deserialize, data), lambda: decode_with(ai_new._deserialize_obj, data)),
+        ("encode", lambda: legacy_serialize(obj_old), lambda: ai_new._serialize_obj(obj_new)),
+    ]
+    for name, old, new in rows:
+        t_old = min(timeit.repeat(old, number=args.repeat, repeat=3)) / args.repeat
+        t_new = min(timeit.repeat(new, number=args.repeat, repeat=3)) / args.repeat
+        print(
+            f"{name}: legacy {t_old * 1000:.2f} ms, compiled {t_new * 1000:.2f} ms "
+            f"-> {t_old / t_new:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
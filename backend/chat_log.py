@@ -0,0 +1,313 @@
+"""
+Append-only JSON-lines chat history, one log per chat session.
+
+Every line is one record:
+    {"op": "turn", "turn": {...}}                      a new turn
+    {"op": "patch", "turn_id": "...", "fields": {...}}  later update to a turn
+
+Every turn carries "seq", its 0-based position in the log. Appends are
+fsync'd, so a crash loses at most the line being written: a last line without
+its newline is torn and cut off on load, an unreadable line elsewhere is
+skipped. The last CHAT_LOG_TAIL turns stay in memory; older ones are read back
+through their byte offsets. Compact with
+
+    cd backend && python chat_log.py compact [path ...]   (default: every session)
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import asyncio
+import weakref
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+# --- CONFIG ---
+CHAT_LOG_TAIL = int(os.getenv("CHAT_LOG_TAIL", "200"))
+CHAT_SESSIONS_OPEN = int(os.getenv("CHAT_SESSIONS_OPEN", "256"))  # logs kept loaded
+DEFAULT_SESSION = "default"
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")  # also a safe file name
+
+
+class ChatLog:
+    def __init__(self, path: str, legacy_path: Optional[str] = None):
+        self.path = path
+        self.legacy_path = legacy_path  # old chat_history.json, imported once
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._offsets: List[int] = []  # byte offset of each turn's line, by seq
+        self._tail = deque(maxlen=CHAT_LOG_TAIL)  # (seq, turn) of the newest turns
+        self._patches: Dict[str, Dict] = {}  # turn_id -> fields not folded in yet
+        self._size = 0
+        self._epoch = 0  # changes whenever the file is replaced or reloaded
+
+    # --- reads ---
+    def count(self) -> int:
+        self._ensure_loaded()
+        return len(self._offsets)
+
+    def last_turn(self) -> Optional[Dict]:
+        self._ensure_loaded()
+        return dict(self._tail[-1][1]) if self._tail else None
+
+    def find(self, turn_id: str) -> Optional[Dict]:
+        """newest turn with this turn_id, patches applied"""
+        with self._lock:
+            self._ensure_loaded()
+            for _, turn in reversed(self._tail):
+                if turn.get("turn_id") == turn_id:
+                    return dict(turn)
+            tail_start = self._tail[0][0] if self._tail else len(self._offsets)
+            for turn in reversed(self.read(0, tail_start)):
+                if turn.get("turn_id") == turn_id:
+                    return turn
+            return None
+
+    def version(self) -> str:
+        """changes on every append, patch and clear (for ETags)"""
+        self._ensure_loaded()
+        return f"{self._epoch:x}-{len(self._offsets)}-{self._size}"
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> List[Dict]:
+        """turns with start <= seq < stop, patches applied"""
+        with self._lock:
+            self._ensure_loaded()
+            stop = len(self._offsets) if stop is None else min(stop, len(self._offsets))
+            start = max(start, 0)
+            if start >= stop:
+                return []
+            tail_start = self._tail[0][0] if self._tail else len(self._offsets)
+            turns = []
+            if start < tail_start:
+                with open(self.path, "rb") as f:
+                    f.seek(self._offsets[start])
+                    for seq in range(start, min(stop, tail_start)):
+                        turn = self._apply_patch(self._decode_turn(f))
+                        turn.setdefault("seq", seq)
+                        turns.append(turn)
+            for seq, turn in self._tail:
+                if start <= seq < stop:
+                    turns.append(dict(turn))
+            return turns
+
+    # --- writes ---
+    def append(self, turns: List[Dict]) -> List[Dict]:
+        """append turns in one fsync'd write, returns them with their seq set"""
+        with self._lock:
+            self._ensure_loaded()
+            first_seq = len(self._offsets)
+            turns = [{**t, "seq": first_seq + i} for i, t in enumerate(turns)]
+            lines = [self._encode({"op": "turn", "turn": t}) for t in turns]
+            offset = self._size
+            self._write(b"".join(lines))
+            appended = []
+            for turn, line in zip(turns, lines):
+                self._offsets.append(offset)
+                turn = self._apply_patch(turn)
+                self._tail.append((turn["seq"], turn))
+                appended.append(dict(turn))
+                offset += len(line)
+            return appended
+
+    def patch(self, turn_id: str, fields: Dict):
+        """
+        Update fields of a turn without rewriting the log. The turn doesn't have to
+        exist yet (e.g. a background job finishing before the turn is appended).
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self._write(self._encode({"op": "patch", "turn_id": turn_id, "fields": fields}))
+            self._patches.setdefault(turn_id, {}).update(fields)
+            for _, turn in self._tail:
+                if turn.get("turn_id") == turn_id:
+                    turn.update(fields)
+
+    def clear(self):
+        with self._lock:
+            self._replace([])
+            self._loaded = True
+
+    def compact(self) -> Dict:
+        """rewrite the log as plain turn records with patches folded in"""
+        with self._lock:
+            self._ensure_loaded()
+            before = self._size
+            turns = self.read()
+            self._replace(turns)
+            return {"turns": len(turns), "bytes_before": before, "bytes_after": self._size}
+
+    # --- internals ---
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if not os.path.exists(self.path):
+                self._replace(self._legacy_turns())
+            else:
+                self._load()
+            self._loaded = True
+
+    def _load(self):
+        self._offsets, self._patches = [], {}
+        self._tail.clear()
+        good_size = 0
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # torn write from a crash (even if it parses): cut it off, or the
+                    # next append would land on the same line
+                    print(f"[chat_log] dropping torn record at byte {offset} of {self.path}")
+                    break
+                try:
+                    record = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    print(f"[chat_log] skipping unreadable record at byte {offset} of {self.path}")
+                    offset += len(line)
+                    good_size = offset
+                    continue
+                if record.get("op") == "turn":
+                    self._offsets.append(offset)
+                    record["turn"].setdefault("seq", len(self._offsets) - 1)
+                    self._tail.append((len(self._offsets) - 1, record["turn"]))
+                elif record.get("op") == "patch":
+                    self._patches.setdefault(record["turn_id"], {}).update(record["fields"])
+                offset += len(line)
+                good_size = offset
+        if good_size != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good_size)  # torn write from a crash
+        self._size = good_size
+        self._epoch = time.time_ns()
+        self._tail = deque(
+            ((seq, self._apply_patch(turn)) for seq, turn in self._tail), maxlen=CHAT_LOG_TAIL
+        )
+
+    def _legacy_turns(self) -> List[Dict]:
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return []
+        try:
+            if self.legacy_path.endswith(".jsonl"):
+                turns = ChatLog(self.legacy_path).read()
+            else:
+                with open(self.legacy_path, "r", encoding="utf-8") as f:
+                    content = f.read()
+                turns = json.loads(content) if content else []
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"[chat_log] could not migrate {self.legacy_path}: {e}")
+            return []
+        print(f"[chat_log] migrated {len(turns)} turns from {self.legacy_path}")
+        return turns
+
+    def _replace(self, turns: List[Dict]):
+        """atomically swap in a log holding exactly these turns"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        turns = [{**t, "seq": seq} for seq, t in enumerate(turns)]
+        lines = [self._encode({"op": "turn", "turn": t}) for t in turns]
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._offsets, self._patches = [], {}
+        self._tail.clear()
+        offset = 0
+        for seq, (turn, line) in enumerate(zip(turns, lines)):
+            self._offsets.append(offset)
+            self._tail.append((seq, dict(turn)))
+            offset += len(line)
+        self._size = offset
+        self._epoch = time.time_ns()
+
+    def _write(self, data: bytes):
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._size += len(data)
+
+    def _apply_patch(self, turn: Dict) -> Dict:
+        fields = self._patches.get(turn.get("turn_id"))
+        if fields:
+            turn.update(fields)
+        return turn
+
+    @staticmethod
+    def _decode_turn(f) -> Dict:
+        while True:
+            try:
+                record = json.loads(f.readline())
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue  # skipped on load too
+            if record.get("op") == "turn":
+                return record["turn"]
+
+    @staticmethod
+    def _encode(record: Dict) -> bytes:
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class ChatSessions:
+    """
+    One ChatLog per session id under sessions_dir, plus a per-session asyncio.Lock
+    so turns of one session run one at a time while sessions run in parallel.
+    """
+
+    def __init__(self, sessions_dir: str, legacy_paths: Optional[List[str]] = None):
+        self.sessions_dir = sessions_dir
+        self.legacy_paths = legacy_paths or []  # imported into DEFAULT_SESSION once
+        self._logs = OrderedDict()  # session_id -> ChatLog, least recently used first
+        self._locks = weakref.WeakValueDictionary()  # session_id -> asyncio.Lock
+
+    @staticmethod
+    def valid_id(session_id: str) -> bool:
+        return bool(session_id) and SESSION_ID_RE.match(session_id) is not None
+
+    def log(self, session_id: str) -> ChatLog:
+        if not self.valid_id(session_id):
+            raise ValueError(f"invalid session id: {session_id!r}")
+        chat_log = self._logs.get(session_id)
+        if chat_log is None:
+            legacy = None
+            if session_id == DEFAULT_SESSION:
+                legacy = next((p for p in self.legacy_paths if os.path.exists(p)), None)
+            path = os.path.join(self.sessions_dir, f"{session_id}.jsonl")
+            chat_log = self._logs[session_id] = ChatLog(path, legacy_path=legacy)
+            self._evict()
+        self._logs.move_to_end(session_id)
+        return chat_log
+
+    def _evict(self):
+        """forget idle logs beyond CHAT_SESSIONS_OPEN, they reload from disk when needed"""
+        for session_id in list(self._logs):
+            if len(self._logs) <= CHAT_SESSIONS_OPEN:
+                break
+            lock = self._locks.get(session_id)
+            if lock is None or not lock.locked():
+                del self._logs[session_id]
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        print("usage: python chat_log.py compact [path ...]")
+        sys.exit(1)
+    log_paths = sys.argv[2:] or sorted(
+        glob.glob(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sessions", "*.jsonl")
+        )
+    )
+    for log_path in log_paths:
+        print(log_path, ChatLog(log_path).compact())
@@ -0,0 +1,127 @@
+"""
+Explicit Gemini context caching for the stable part of a prompt.
+
+The draft prompt is laid out as a stable prefix (tool instructions for the
+task state, the schema, a catalogue snapshot) plus a per-turn suffix. The
+prefix is registered once with client.aio.caches.create and later calls send
+only the suffix with config["cached_content"] = <cache name>.
+
+    name = await context_cache.get(client, model, "draft:handle_post_creation:new",
+                                   prefix, collections=("products", "posts"))
+
+An entry is replaced when its prefix text changes, and dropped as soon as one
+of its collections is written (invalidate, a storage listener). The remote
+cache is deleted on the next call. Any caching error falls back to sending the
+whole prompt inline; a failing key is not retried for CONTEXT_CACHE_RETRY_SECONDS.
+
+Only the client's aio.caches.create / delete are used, a stub with the same two
+coroutines works for tests.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+# --- CONFIG ---
+CONTEXT_CACHING = os.getenv("GEMINI_CONTEXT_CACHING", "false").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# the API rejects smaller caches (1024 tokens for 2.5 Flash, ~4 chars per token)
+CONTEXT_CACHE_MIN_CHARS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_CHARS", "4096"))
+CONTEXT_CACHE_RETRY_SECONDS = 300
+
+
+class ContextCache:
+    def __init__(self, enabled: bool = CONTEXT_CACHING, ttl: int = CONTEXT_CACHE_TTL_SECONDS):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._lock = threading.Lock()  # invalidate runs on the storage flush thread
+        self._entries: Dict[str, Dict] = {}  # key -> name, digest, collections, expires_at
+        self._stale: List[str] = []  # remote caches to delete
+        self._failed: Dict[str, float] = {}  # key -> monotonic time of the last error
+        self.stats = {"hits": 0, "created": 0, "invalidated": 0, "errors": 0, "skipped": 0}
+
+    async def get(
+        self,
+        client,
+        model: str,
+        key: str,
+        prefix: str,
+        collections: Iterable[str] = (),
+    ) -> Optional[str]:
+        """name of a cached-content object holding exactly prefix, or None to send it inline"""
+        if not self.enabled or len(prefix) < CONTEXT_CACHE_MIN_CHARS:
+            return None
+        await self._delete_stale(client)
+        digest = hashlib.sha256(f"{model}\n{prefix}".encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry["digest"] == digest and entry["expires_at"] > now:
+                self.stats["hits"] += 1
+                return entry["name"]
+            if now - self._failed.get(key, -CONTEXT_CACHE_RETRY_SECONDS) < CONTEXT_CACHE_RETRY_SECONDS:
+                self.stats["skipped"] += 1
+                return None
+            if entry:
+                self._forget(key)
+        try:
+            cached = await client.aio.caches.create(
+                model=model,
+                config={
+                    "contents": [prefix],
+                    "display_name": key[:128],
+                    "ttl": f"{self.ttl}s",
+                },
+            )
+        except Exception as e:
+            print(f"[context_cache] could not cache {key}, sending it inline: {e}")
+            with self._lock:
+                self._failed[key] = time.monotonic()
+                self.stats["errors"] += 1
+            return None
+        with self._lock:
+            if key in self._entries:  # a concurrent call created one too, keep the newest
+                self._forget(key)
+            self._entries[key] = {
+                "name": cached.name,
+                "digest": digest,
+                "collections": set(collections),
+                # renew a bit early so a call never races the server-side expiry
+                "expires_at": now + self.ttl * 0.9,
+            }
+            self.stats["created"] += 1
+        print(f"[context_cache] cached {key} as {cached.name} ({len(prefix)} chars)")
+        return cached.name
+
+    def invalidate(self, collection: str):
+        """drop entries built from this collection (storage listener)"""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if collection in e["collections"]]:
+                self._forget(key)
+                self.stats["invalidated"] += 1
+
+    def discard(self, key: str):
+        """the server no longer knows this cache (e.g. expired), make a new one next time"""
+        with self._lock:
+            if key in self._entries:
+                self._forget(key)
+
+    def snapshot(self) -> Dict:
+        return {**self.stats, "enabled": self.enabled, "entries": len(self._entries)}
+
+    def _forget(self, key: str):
+        self._stale.append(self._entries.pop(key)["name"])
+
+    async def _delete_stale(self, client):
+        with self._lock:
+            stale, self._stale = self._stale, []
+        for name in stale:
+            try:
+                await client.aio.caches.delete(name=name)
+            except Exception as e:
+                print(f"[context_cache] could not delete {name}, it expires by itself: {e}")
+
+
+context_cache = ContextCache()
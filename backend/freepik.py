@@ -0,0 +1,198 @@
+"""
+Freepik image generation client.
+
+One pooled keep-alive requests.Session shared by all image jobs (workers run in
+threads, the connection pool is thread safe). A job is:
+
+    POST <url>                start the task
+    GET  <url>/<task_id>      poll, first after FREEPIK_FIRST_POLL seconds, then
+                              backing off x1.5 with jitter up to FREEPIK_POLL_MAX,
+                              or as long as the server's Retry-After asks
+    GET  <image url>          streamed to data/uploads in chunks
+
+Each job logs and records its latency, poll count and downloaded bytes
+(FreepikClient.recent, FreepikClient.stats).
+"""
+
+import os
+import time
+import uuid
+import base64
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- CONFIG ---
+FREEPIK_FIRST_POLL = float(os.getenv("FREEPIK_FIRST_POLL", "3"))  # seconds after the start
+FREEPIK_POLL_MAX = float(os.getenv("FREEPIK_POLL_MAX", "8"))
+FREEPIK_POLL_BACKOFF = 1.5
+FREEPIK_POLL_JITTER = 0.2  # +-20%
+FREEPIK_JOB_TIMEOUT = float(os.getenv("FREEPIK_JOB_TIMEOUT", "130"))  # whole job
+FREEPIK_POOL_SIZE = int(os.getenv("FREEPIK_POOL_SIZE", "10"))
+FREEPIK_MAX_IMAGE_BYTES = int(os.getenv("FREEPIK_MAX_IMAGE_BYTES", str(25 * 1024 * 1024)))
+CONNECT_TIMEOUT, READ_TIMEOUT = 5, 30
+DOWNLOAD_CHUNK = 64 * 1024
+
+
+def file_to_base64(path):
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Retry-After as seconds (delta or HTTP date), None if absent or unreadable"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class FreepikClient:
+    def __init__(self, url: str, api_key: Optional[str], upload_dir: str = os.path.join("data", "uploads")):
+        self.url = url
+        self.api_key = api_key
+        self.upload_dir = upload_dir
+        self.session = requests.Session()
+        # connection errors and 5xx on GETs (polls, downloads) are retried by urllib3;
+        # the POST that starts a task is not, it could start a second task
+        retries = Retry(
+            total=2,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=False,  # read by the poll loop, a bad one would raise here
+        )
+        adapter = HTTPAdapter(
+            pool_connections=2, pool_maxsize=FREEPIK_POOL_SIZE, max_retries=retries
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=50)  # metrics of the last jobs
+        self.stats = {"jobs": 0, "succeeded": 0, "polls": 0, "bytes": 0, "seconds": 0.0}
+
+    def generate(self, prompt: str, reference_images: Optional[List[str]] = None) -> List[str]:
+        """local paths of the generated image ([] on failure), like generate_image"""
+        metrics = {"task_id": None, "status": "error", "polls": 0, "bytes": 0}
+        started = time.monotonic()
+        try:
+            return self._run(prompt, reference_images or [], metrics, started)
+        except requests.RequestException as e:
+            print(f"Freepik API request failed: {e}")
+            return []
+        finally:
+            metrics["seconds"] = round(time.monotonic() - started, 2)
+            self._record(metrics)
+
+    def _run(self, prompt: str, reference_images: List[str], metrics: Dict, started: float) -> List[str]:
+        start_data = {"prompt": prompt}
+        if reference_images:
+            images = []
+            for img_path in reference_images:
+                try:
+                    images.append(file_to_base64(img_path))
+                except Exception as e:
+                    print(f"Failed to load reference image {img_path}: {e}")
+            start_data["reference_images"] = images
+        start_resp = self.session.post(
+            self.url,
+            headers={"Content-Type": "application/json", "x-freepik-api-key": self.api_key},
+            json=start_data,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        )
+        start_resp.raise_for_status()
+        task_id = (start_resp.json().get("data", {}) or {}).get("task_id")
+        if not task_id:
+            print("Freepik API did not return a task ID.")
+            return []
+        metrics["task_id"] = task_id
+
+        status_url = f"{self.url}/{task_id}"
+        delay = retry_after_seconds(start_resp) or FREEPIK_FIRST_POLL
+        deadline = started + FREEPIK_JOB_TIMEOUT
+        while True:
+            wait = delay * random.uniform(1 - FREEPIK_POLL_JITTER, 1 + FREEPIK_POLL_JITTER)
+            if time.monotonic() + wait > deadline:
+                print(f"Freepik job {task_id} timed out after {FREEPIK_JOB_TIMEOUT:.0f}s.")
+                metrics["status"] = "timeout"
+                return []
+            time.sleep(wait)
+            status_resp = self.session.get(
+                status_url,
+                headers={"x-freepik-api-key": self.api_key},
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            )
+            metrics["polls"] += 1
+            hint = retry_after_seconds(status_resp)
+            if status_resp.status_code == 429:
+                delay = hint if hint is not None else min(delay * 2, FREEPIK_POLL_MAX * 2)
+                continue
+            status_resp.raise_for_status()
+            data = status_resp.json().get("data", {}) or {}
+            job_status = data.get("status")
+            if job_status == "COMPLETED" and data.get("generated"):
+                paths = []
+                for url in data["generated"][:1]:  # Limit to first image
+                    path = self._download(url, metrics) if url else None
+                    if path:
+                        paths.append(path)
+                if not paths:
+                    print("Job completed but no image URL found.")
+                metrics["status"] = "done" if paths else "no_image"
+                return paths
+            if job_status == "FAILED":
+                print(f"Freepik job failed. Reason: {status_resp.json().get('error')}")
+                metrics["status"] = "failed"
+                return []
+            delay = hint if hint is not None else min(delay * FREEPIK_POLL_BACKOFF, FREEPIK_POLL_MAX)
+
+    def _download(self, url: str, metrics: Dict) -> Optional[str]:
+        os.makedirs(self.upload_dir, exist_ok=True)
+        rel_path = os.path.join(self.upload_dir, f"freepik_{uuid.uuid4().hex}.png")
+        tmp_path = rel_path + ".part"
+        try:
+            with self.session.get(url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as resp:
+                resp.raise_for_status()
+                with open(tmp_path, "wb") as f:
+                    for chunk in resp.iter_content(DOWNLOAD_CHUNK):
+                        metrics["bytes"] += len(chunk)
+                        if metrics["bytes"] > FREEPIK_MAX_IMAGE_BYTES:
+                            raise ValueError(f"image larger than {FREEPIK_MAX_IMAGE_BYTES} bytes")
+                        f.write(chunk)
+            os.replace(tmp_path, rel_path)
+            return rel_path
+        except Exception as e:
+            print(f"Failed to download Freepik image: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+    def _record(self, metrics: Dict):
+        print(
+            f"[freepik] task {metrics['task_id']} {metrics['status']} in {metrics['seconds']}s, "
+            f"{metrics['polls']} polls, {metrics['bytes']} bytes"
+        )
+        with self._lock:
+            self.recent.append(metrics)
+            self.stats["jobs"] += 1
+            self.stats["succeeded"] += metrics["status"] == "done"
+            self.stats["polls"] += metrics["polls"]
+            self.stats["bytes"] += metrics["bytes"]
+            self.stats["seconds"] = round(self.stats["seconds"] + metrics["seconds"], 2)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "recent": list(self.recent)[-10:]}
@@ -0,0 +1,311 @@
+"""
+Content-addressed cache of generated images.
+
+The key is sha256(provider, model, normalized prompt, content hashes of the
+reference images). A generated file is moved to data/image_cache/<key>.png
+(private, outside the /static/uploads mount) and recorded in manifest.json
+there with its size and last use. Concurrent requests for the same key wait for
+one provider call (image jobs run in threads).
+
+Callers never get the cached file itself: drafts, chat turns and published
+entries keep pointing at the images they were given, so each one is handed out
+as data/uploads/generated_<image sha256>.png, a hard link to the cached file (a
+copy where links aren't possible). The manifest tracks the hand-outs too.
+
+IMAGE_CACHE_MAX_BYTES bounds what both take on disk (a linked hand-out costs
+nothing while its cached file exists). Past it, hand-outs older than
+IMAGE_CACHE_GC_GRACE that reference_check reports unused are deleted (drafts
+dropped, turns never saved, cancelled jobs), then the least recently used
+cached images whose bytes no hand-out still shares. Without a reference_check
+every hand-out is kept.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import unicodedata
+from typing import Callable, Dict, List, Optional, Set
+
+# --- CONFIG ---
+IMAGE_CACHE = os.getenv("IMAGE_CACHE", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.path.join("data", "image_cache")
+LEGACY_IMAGE_CACHE_DIR = os.path.join("data", "uploads", "generated")  # moved on first load
+IMAGE_OUTPUT_DIR = os.path.join("data", "uploads")  # where handed out images live
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "500")) * 1024 * 1024
+# a new hand-out may not be saved anywhere yet (turn in progress, job not attached)
+IMAGE_CACHE_GC_GRACE = float(os.getenv("IMAGE_CACHE_GC_GRACE_SECONDS", "3600"))
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", prompt or "").casefold().split())
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ImageCache:
+    def __init__(
+        self,
+        directory: str = IMAGE_CACHE_DIR,
+        max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+        output_dir: str = IMAGE_OUTPUT_DIR,
+        legacy_dir: Optional[str] = None,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.output_dir = output_dir
+        self.legacy_dir = legacy_dir
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        # filenames -> the subset still referenced (set by the app), None keeps every hand-out
+        self.reference_check: Optional[Callable[[List[str]], Set[str]]] = None
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, List] = {}  # single flight: key -> [lock, callers using it]
+        self._ref_hashes: Dict[tuple, str] = {}  # (path, mtime_ns, size) -> sha256
+        self._manifest: Optional[Dict[str, Dict]] = None  # key -> file, size, last_used...
+        self._handouts: Dict[str, Dict] = {}  # filename -> key, size, linked, handed_out_at
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "handouts_removed": 0}
+
+    def key(self, provider: str, model: str, prompt: str, reference_images: List[str]) -> str:
+        h = hashlib.sha256()
+        for part in [provider, model, normalize_prompt(prompt)] + [
+            self._reference_hash(ref) for ref in reference_images or []
+        ]:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get_or_generate(
+        self,
+        provider: str,
+        model: str,
+        prompt: str,
+        reference_images: Optional[List[str]],
+        generate: Callable[[], List[str]],
+    ) -> List[str]:
+        """the cached image for these inputs, else generate() and keep its first image"""
+        key = self.key(provider, model, prompt, reference_images or [])
+        with self._lock:
+            slot = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
+                path = self.get(key)
+                if path:
+                    return [path]
+                paths = generate()
+                if paths and os.path.isfile(paths[0]):
+                    return [self.put(key, paths[0], provider, model, prompt)] + paths[1:]
+                return paths
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:  # nobody else waits on this lock
+                    del self._key_locks[key]
+
+    def get(self, key: str) -> Optional[str]:
+        """path of a handed out copy of the cached image, None on a miss"""
+        with self._lock:
+            manifest = self._load()
+            entry = manifest.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            path = os.path.join(self.directory, entry["file"])
+            if not os.path.isfile(path):  # deleted by hand
+                del manifest[key]
+                self._save()
+                self.stats["misses"] += 1
+                return None
+            entry["last_used"] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            output = self._hand_out(key, entry)
+            self._save()
+            self.stats["hits"] += 1
+            return output
+
+    def put(self, key: str, source_path: str, provider: str, model: str, prompt: str) -> str:
+        """move a freshly generated file into the cache, returns a handed out copy"""
+        ext = os.path.splitext(source_path)[1] or ".png"
+        filename = f"{key}{ext}"
+        path = os.path.join(self.directory, filename)
+        with self._lock:
+            manifest = self._load()
+            os.makedirs(self.directory, exist_ok=True)
+            shutil.move(source_path, path)
+            now = time.time()
+            manifest[key] = {
+                "file": filename,
+                "sha256": file_sha256(path),
+                "size": os.path.getsize(path),
+                "provider": provider,
+                "model": model,
+                "prompt": normalize_prompt(prompt)[:200],
+                "created_at": now,
+                "last_used": now,
+                "hits": 0,
+            }
+            self.stats["stores"] += 1
+            output = self._hand_out(key, manifest[key])
+            self._evict(keep=key)
+            self._save()
+        return output
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            manifest = self._load()
+            return {
+                **self.stats,
+                "entries": len(manifest),
+                "handouts": len(self._handouts),
+                "bytes": self._disk_bytes(),
+                "max_bytes": self.max_bytes,
+            }
+
+    # --- internals (called with self._lock held) ---
+    def _reference_hash(self, ref: str) -> str:
+        try:
+            st = os.stat(ref)
+        except (OSError, TypeError, ValueError):
+            return f"ref:{ref}"  # a URL or a missing file, the name is all we have
+        stat_key = (ref, st.st_mtime_ns, st.st_size)
+        digest = self._ref_hashes.get(stat_key)
+        if digest is None:
+            digest = self._ref_hashes[stat_key] = file_sha256(ref)
+        return digest
+
+    def _hand_out(self, key: str, entry: Dict) -> str:
+        """the image under output_dir, named by its content so reuse shares one file"""
+        source = os.path.join(self.directory, entry["file"])
+        if "sha256" not in entry:
+            entry["sha256"] = file_sha256(source)
+        ext = os.path.splitext(entry["file"])[1]
+        filename = f"generated_{entry['sha256']}{ext}"
+        path = os.path.join(self.output_dir, filename)
+        if not os.path.exists(path):
+            os.makedirs(self.output_dir, exist_ok=True)
+            try:
+                os.link(source, path)  # same bytes on disk, survives eviction of source
+            except FileExistsError:
+                pass
+            except OSError:
+                tmp_path = f"{path}.tmp"
+                shutil.copyfile(source, tmp_path)
+                os.replace(tmp_path, path)
+        self._track(filename, key, source, time.time())
+        return path
+
+    def _track(self, filename: str, key: str, source: str, handed_out_at: float):
+        path = os.path.join(self.output_dir, filename)
+        try:
+            linked = os.path.samefile(source, path)
+        except OSError:
+            linked = False
+        handout = self._handouts.setdefault(filename, {"handed_out_at": 0})
+        handout.update(key=key, size=os.path.getsize(path), linked=linked)
+        handout["handed_out_at"] = max(handout["handed_out_at"], handed_out_at)
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._manifest is None:
+            if self.legacy_dir and not os.path.exists(self.manifest_path):
+                self._migrate()
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                data = {}
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"[image_cache] unreadable manifest, starting empty: {e}")
+                data = {}
+            if "entries" in data:
+                self._manifest = data["entries"]
+                self._handouts = data.get("handouts", {})
+            else:  # a bare key -> entry map, written before hand-outs were tracked
+                self._manifest = data
+                self._adopt_handouts()
+        return self._manifest
+
+    def _migrate(self):
+        """the cache used to live under the public uploads dir, move it here"""
+        if not os.path.isfile(os.path.join(self.legacy_dir, "manifest.json")):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.legacy_dir):
+            shutil.move(os.path.join(self.legacy_dir, name), os.path.join(self.directory, name))
+        shutil.rmtree(self.legacy_dir, ignore_errors=True)
+        print(f"[image_cache] moved cache from {self.legacy_dir} to {self.directory}")
+
+    def _adopt_handouts(self):
+        for key, entry in self._manifest.items():
+            if "sha256" not in entry:
+                continue
+            filename = f"generated_{entry['sha256']}{os.path.splitext(entry['file'])[1]}"
+            if os.path.isfile(os.path.join(self.output_dir, filename)):
+                source = os.path.join(self.directory, entry["file"])
+                self._track(filename, key, source, entry.get("last_used", 0))
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self._manifest, "handouts": self._handouts}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _disk_bytes(self) -> int:
+        total = sum(e["size"] for e in self._manifest.values())
+        for handout in self._handouts.values():
+            if not (handout["linked"] and handout["key"] in self._manifest):
+                total += handout["size"]  # a copy, or the only link left
+        return total
+
+    def _collect_handouts(self, keep: str):
+        """delete hand-outs past the grace period that nothing points to any more"""
+        cutoff = time.time() - IMAGE_CACHE_GC_GRACE
+        candidates = [
+            n for n, h in self._handouts.items() if h["handed_out_at"] <= cutoff and h["key"] != keep
+        ]
+        if self.reference_check is None or not candidates:
+            return
+        try:
+            referenced = set(self.reference_check(candidates))
+        except Exception as e:
+            print(f"[image_cache] reference check failed, keeping hand-outs: {e}")
+            return
+        for filename in candidates:
+            if filename in referenced:
+                continue
+            try:
+                os.remove(os.path.join(self.output_dir, filename))
+            except FileNotFoundError:
+                pass
+            del self._handouts[filename]
+            self.stats["handouts_removed"] += 1
+
+    def _evict(self, keep: str):
+        if self._disk_bytes() <= self.max_bytes:
+            return
+        self._collect_handouts(keep)
+        shared = {h["key"] for h in self._handouts.values() if h["linked"]}
+        total = self._disk_bytes()
+        for key, entry in sorted(self._manifest.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep or key in shared:  # a hand-out in use keeps the bytes anyway
+                continue
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except FileNotFoundError:
+                pass
+            del self._manifest[key]
+            total -= entry["size"]
+            self.stats["evictions"] += 1
+
+
+image_cache = ImageCache(legacy_dir=LEGACY_IMAGE_CACHE_DIR)
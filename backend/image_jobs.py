@@ -0,0 +1,265 @@
+"""
+Persistent background queue for image generation, so chat turns never wait on
+the image provider.
+
+A turn submits one job per image prompt and puts a placeholder in the draft:
+the fallback image URL with "#image-job=<id>" appended (renders as the
+fallback until the job is done). Workers (started with the app) run the
+blocking generate function in threads, at most `concurrency` at a time.
+Every change of a job is written to data/image_jobs/<id>.json (temp file +
+rename) by one writer thread, in order and off the event loop, so jobs queued
+or running when the process stopped run again on the next start. A job nobody
+will show (its turn failed, no draft takes it) is cancelled: it doesn't run,
+or its result is dropped if it already did.
+
+When a job finishes, the listeners (coroutines taking the job) run in their
+own tasks, once per turn showing the placeholder; backend.py patches that turn.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# --- CONFIG ---
+IMAGE_JOBS_DIR = os.path.join("data", "image_jobs")
+IMAGE_JOB_ATTEMPTS = int(os.getenv("IMAGE_JOB_ATTEMPTS", "2"))
+IMAGE_JOB_RETENTION_SECONDS = int(os.getenv("IMAGE_JOB_RETENTION_DAYS", "7")) * 86400
+FINISHED = ("done", "failed", "cancelled")
+PLACEHOLDER_RE = re.compile(r"#image-job=([0-9a-f]{32})$")
+
+PUBLIC_FIELDS = (
+    "job_id", "status", "draft_id", "images", "error", "attempts", "created_at", "updated_at",
+)
+
+
+def placeholder_url(base_url: str, job_id: str) -> str:
+    return f"{base_url}#image-job={job_id}"
+
+
+def job_id_from_url(url) -> Optional[str]:
+    match = PLACEHOLDER_RE.search(url) if isinstance(url, str) else None
+    return match.group(1) if match else None
+
+
+def public_view(job: Dict) -> Dict:
+    return {k: job.get(k) for k in PUBLIC_FIELDS}
+
+
+class ImageJobQueue:
+    def __init__(
+        self,
+        generate: Callable[[str, List[str]], List[str]],
+        directory: str = IMAGE_JOBS_DIR,
+        concurrency: int = 3,
+    ):
+        self.generate = generate  # blocking: (prompt, reference_images) -> [image url]
+        self.directory = directory
+        self.concurrency = concurrency
+        self.listeners: List[Callable[[Dict, str, str], Awaitable[None]]] = []  # job, session, turn
+        self._jobs: Dict[str, Dict] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-jobs")
+        self._finished: Dict[str, asyncio.Event] = {}  # job_id -> set once done/failed/cancelled
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop = None
+        self._workers: List[asyncio.Task] = []
+        self._callbacks = set()  # listener tasks, referenced until done
+        self.stats = {
+            "submitted": 0, "done": 0, "failed": 0, "cancelled": 0, "retried": 0, "recovered": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        """started, on the event loop of the caller"""
+        if not self._workers:
+            return False
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    # --- lifecycle ---
+    def start(self):
+        """start the workers on the running loop and re-queue unfinished jobs"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"[image_jobs] skipping unreadable {path}: {e}")
+                continue
+            job.setdefault("turns", [[job["session_id"], job["turn_id"]]] if job.get("turn_id") else [])
+            if job["status"] in FINISHED:
+                if now - job.get("updated_at", now) > IMAGE_JOB_RETENTION_SECONDS:
+                    os.remove(path)
+                    continue
+            else:
+                job["status"] = "queued"  # interrupted by a restart
+                self._queue.put_nowait(job["job_id"])
+                self.stats["recovered"] += 1
+            self._jobs[job["job_id"]] = job
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"image-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        print(f"[image_jobs] {self.concurrency} workers, {self._queue.qsize()} jobs queued")
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await asyncio.wrap_future(self._writer.submit(lambda: None))  # pending writes done
+
+    # --- jobs ---
+    def submit(self, prompt: str, reference_images: Optional[List[str]] = None, draft_id=None) -> Dict:
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "prompt": prompt,
+            "reference_images": reference_images or [],
+            "draft_id": draft_id,
+            "images": [],
+            "error": None,
+            "attempts": 0,
+            "turns": [],  # [session_id, turn_id] of the turns showing it, set by attach
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._jobs[job["job_id"]] = job
+        self._save(job)
+        self._queue.put_nowait(job["job_id"])
+        self.stats["submitted"] += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self._jobs.get(job_id)
+
+    def attach(self, job_ids: List[str], session_id: str, turn_id: str):
+        """record a turn showing these jobs' placeholders; finished ones notify it now"""
+        for job_id in job_ids:
+            job = self._jobs.get(job_id)
+            if job is None or [session_id, turn_id] in job["turns"]:
+                continue
+            job["turns"].append([session_id, turn_id])
+            self._save(job)
+            if job["status"] in ("done", "failed"):
+                self._notify(job, [[session_id, turn_id]])
+
+    def cancel(self, job_id: str):
+        """nobody will show this job: don't run it, or drop its result if it is running"""
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] in FINISHED or job["turns"]:
+            return  # a saved turn shows it
+        job["status"] = "cancelled"
+        self._save(job)
+        self.stats["cancelled"] += 1
+        self._finish(job_id)
+
+    async def wait(self, job_ids: List[str], timeout: float) -> bool:
+        """True once all these jobs are finished, False if some still run after timeout"""
+        pending = [
+            self._finished.setdefault(job_id, asyncio.Event()).wait()
+            for job_id in job_ids
+            if job_id in self._jobs and self._jobs[job_id]["status"] not in FINISHED
+        ]
+        if not pending:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.gather(*pending), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def resolve(self, url: str, fallback: Optional[str] = None) -> str:
+        """a placeholder becomes the job's image once done, else fallback (or itself)"""
+        job = self._jobs.get(job_id_from_url(url) or "")
+        if job is None:
+            return url
+        if job["status"] == "done" and job["images"]:
+            return job["images"][0]
+        return fallback if fallback is not None else url
+
+    # --- internals ---
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                continue
+            job["status"], job["attempts"] = "running", job["attempts"] + 1
+            self._save(job)
+            try:
+                images = await asyncio.to_thread(
+                    self.generate, job["prompt"], job["reference_images"]
+                )
+                error = None if images else "no image generated"
+            except asyncio.CancelledError:
+                raise  # shutting down, stays "running" on disk and re-runs on start
+            except Exception as e:
+                images, error = [], str(e)
+            if job["status"] == "cancelled":
+                continue  # cancelled while it ran, nobody shows the result
+            if error and job["attempts"] < IMAGE_JOB_ATTEMPTS:
+                print(f"[image_jobs] {job_id} failed ({error}), retrying")
+                job["status"], job["error"] = "queued", error
+                self._save(job)
+                self._queue.put_nowait(job_id)
+                self.stats["retried"] += 1
+                continue
+            job["status"] = "failed" if error else "done"
+            job["images"], job["error"] = images or [], error
+            self._save(job)
+            self.stats[job["status"]] += 1
+            self._finish(job_id)
+            self._notify(job, job["turns"])
+
+    def _finish(self, job_id: str):
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _notify(self, job: Dict, turns: List[List[str]]):
+        for session_id, turn_id in turns:
+            for listener in self.listeners:
+                task = asyncio.create_task(listener(job, session_id, turn_id))
+                self._callbacks.add(task)
+                task.add_done_callback(self._callback_done)
+
+    def _callback_done(self, task: asyncio.Task):
+        self._callbacks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"[image_jobs] listener failed: {task.exception()!r}")
+
+    def _save(self, job: Dict):
+        """snapshot the job now, the writer thread stores snapshots in order"""
+        job["updated_at"] = time.time()
+        path = os.path.join(self.directory, f"{job['job_id']}.json")
+        self._writer.submit(self._write, path, json.dumps(job, ensure_ascii=False))
+
+    @staticmethod
+    def _write(path: str, data: str):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[image_jobs] could not write {path}: {e}")
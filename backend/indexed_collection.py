@@ -0,0 +1,145 @@
+from bisect import insort
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class IndexedCollection(list):
+    """
+    A list of documents (dicts) with a primary-key index and secondary indexes
+    (product_id by default), kept in sync on every write through the list API.
+
+        products_db.get("prod_1")            O(1) lookup by primary key
+        posts_db.upsert(post)                replace by primary key, or append
+        posts_db.by("product_id", "prod_1")  every post of a product, in list order
+
+    Still a plain list to json.dumps, slicing and iteration. Changing an indexed
+    field of a stored document in place is not seen; write the document back with
+    upsert (other fields can be mutated freely). Duplicate keys (e.g. from old
+    JSON files) are tolerated: get/upsert use the first one. version increments
+    on every write.
+    """
+
+    def __init__(
+        self,
+        docs: Iterable[Dict] = (),
+        key: Optional[str] = None,
+        secondary: Iterable[str] = ("product_id",),
+    ):
+        super().__init__(docs)
+        self.key = key
+        self.secondary = tuple(f for f in secondary if f != key)
+        self.version = 0
+        self._indexes: Dict[str, Dict[Any, List[int]]] = {}  # field -> value -> positions
+        self._reindex()
+
+    # --- lookups ---
+    def get(self, pk: Any, default: Optional[Dict] = None) -> Optional[Dict]:
+        idx = self._first(pk)
+        return self[idx] if idx is not None else default
+
+    def by(self, field: str, value: Any) -> List[Dict]:
+        if field not in self._indexes:
+            raise KeyError(f"no index on {field}")
+        return [self[i] for i in self._indexes[field].get(value, ())]
+
+    # --- writes ---
+    def upsert(self, doc: Dict) -> bool:
+        """replace the document with the same primary key, else append. True if appended."""
+        idx = self._first(doc.get(self.key)) if self.key else None
+        if idx is None:
+            self.append(doc)
+            return True
+        self[idx] = doc
+        return False
+
+    def append(self, doc: Dict):
+        super().append(doc)
+        self._index_doc(len(self) - 1, doc)
+        self.version += 1
+
+    def extend(self, docs: Iterable[Dict]):
+        for doc in docs:
+            self.append(doc)
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            super().__setitem__(idx, value)
+            self._reindex()
+        else:
+            idx = range(len(self))[idx]  # normalise negatives, IndexError as list does
+            self._unindex_doc(idx, self[idx])
+            super().__setitem__(idx, value)
+            self._index_doc(idx, value)
+        self.version += 1
+
+    # positions shift on these, rebuild (rare in this app)
+    def __delitem__(self, idx):
+        super().__delitem__(idx)
+        self._reindex()
+        self.version += 1
+
+    def insert(self, idx, doc):
+        super().insert(idx, doc)
+        self._reindex()
+        self.version += 1
+
+    def pop(self, idx=-1):
+        doc = super().pop(idx)
+        self._reindex()
+        self.version += 1
+        return doc
+
+    def remove(self, doc):
+        super().remove(doc)
+        self._reindex()
+        self.version += 1
+
+    def clear(self):
+        super().clear()
+        self._reindex()
+        self.version += 1
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._reindex()
+        self.version += 1
+
+    def reverse(self):
+        super().reverse()
+        self._reindex()
+        self.version += 1
+
+    def __iadd__(self, docs):
+        self.extend(docs)
+        return self
+
+    # --- internals ---
+    def _first(self, pk: Any) -> Optional[int]:
+        if pk is None or not self.key:
+            return None
+        positions = self._indexes[self.key].get(pk)
+        return positions[0] if positions else None
+
+    def _reindex(self):
+        fields = ((self.key,) if self.key else ()) + self.secondary
+        self._indexes = {f: {} for f in fields}
+        for idx, doc in enumerate(self):
+            self._index_doc(idx, doc)
+
+    def _index_doc(self, idx: int, doc: Dict):
+        if not isinstance(doc, dict):
+            return
+        for field, index in self._indexes.items():
+            value = doc.get(field)
+            if value is None and field == self.key:
+                continue  # not saved yet, no id
+            insort(index.setdefault(value, []), idx)
+
+    def _unindex_doc(self, idx: int, doc: Dict):
+        if not isinstance(doc, dict):
+            return
+        for field, index in self._indexes.items():
+            positions = index.get(doc.get(field))
+            if positions and idx in positions:
+                positions.remove(idx)
+                if not positions:
+                    del index[doc.get(field)]
@@ -0,0 +1,274 @@
+import os
+import re
+from typing import List, Dict, Optional
+
+# --- CONFIG ---
+# guesses at or above this confidence skip the LLM router
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.85"))
+# fraction of fast-path turns that still run the LLM router in the background, for agreement stats
+FAST_PATH_SHADOW_RATE = float(os.getenv("FAST_PATH_SHADOW_RATE", "0.0"))
+
+EMPTY_TURN = "empty_turn"  # pseudo tool: nothing to do, keep the previous response
+GENERAL_TOOL = "general_conversation"
+
+# short messages that explicitly ask to publish the current draft (en + hi, roman and devanagari)
+PUBLISH_WORDS = {
+    "publish", "publish it", "publish now", "post it", "post now", "go live",
+    "publish karo", "post karo", "post kar do", "publish kar do",
+    "प्रकाशित करें", "प्रकाशित करो", "पोस्ट करो", "पोस्ट कर दो",
+}
+# generic "ok / go ahead" replies: they keep the turn on the draft tool, but could
+# just as well answer a clarifying question, so the LLM decides whether to publish
+AFFIRMATIVE_WORDS = {
+    "ok", "okay", "yes", "go ahead", "confirm", "looks good", "ship it", "submit",
+    "done", "approve", "save", "launch", "post", "daal do", "bhej do", "theek hai",
+    "haan", "भेज दो", "ठीक है", "हाँ",
+}
+CANCEL_WORDS = {
+    "cancel", "stop", "discard", "never mind", "nevermind", "forget it",
+    "start over", "abort", "cancel karo", "rehne do", "mat karo",
+    "रद्द करें", "रहने दो", "रद्द",
+}
+# option ids / form actions the UI sends for the explicit buttons
+PUBLISH_ACTIONS = {"publish", "publish_now", "post_now"}
+CANCEL_ACTIONS = {"cancel", "discard", "abort"}
+# any mention of these in an option label makes a selection ambiguous
+ACTION_MENTION_RE = re.compile(
+    r"\b(publish|post|launch|confirm|approve|submit|go ahead|cancel|discard|stop)\b"
+    r"|प्रकाशित|पोस्ट|रद्द"
+)
+GREETING_RE = re.compile(
+    r"^(hi+|hello|hey|hiya|namaste|namaskar|good (morning|afternoon|evening)|"
+    r"thanks|thank you|thx|bye|goodbye|नमस्ते|धन्यवाद)[\s!.,🙏]*$",
+    re.IGNORECASE,
+)
+
+
+def normalize_message(message: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", (message or "").strip().lower()).strip(" !.,")
+
+
+def answered_selections(selections) -> List[Dict]:
+    """selections the user actually picked something in (frontend sends [{}] by default)"""
+    if not isinstance(selections, list):
+        selections = [selections] if isinstance(selections, dict) else []
+    return [
+        s
+        for s in selections
+        if isinstance(s, dict) and s.get("prompt_id") and s.get("selected_option_ids")
+    ]
+
+
+def drafts_changed(user_drafts, prev_drafts) -> bool:
+    """same check UserTurnSummarizer uses to note an 'edited draft'"""
+    if not user_drafts:
+        return False
+    prev_map = {d.get("draft_id"): d for d in prev_drafts or [] if isinstance(d, dict)}
+    return any(
+        d != prev_map.get(d.get("draft_id")) for d in user_drafts if isinstance(d, dict)
+    )
+
+
+class FastPathStats:
+    """Per-rule confidence and agreement counters, to tune FAST_PATH_MIN_CONFIDENCE"""
+
+    def __init__(self):
+        self.turns = 0
+        self.rules = {}
+
+    def _rule(self, rule: str) -> Dict:
+        return self.rules.setdefault(
+            rule,
+            {
+                "guesses": 0,
+                "taken": 0,  # answered locally, LLM router skipped
+                "compared": 0,  # LLM router also ran (fallback or shadow)
+                "agreed": 0,
+                "confidence": {},  # histogram, 0.1 wide buckets
+            },
+        )
+
+    def record_guess(self, guess: Dict, taken: bool):
+        entry = self._rule(guess["rule"])
+        entry["guesses"] += 1
+        entry["taken"] += int(taken)
+        bucket = f"{min(int(guess['confidence'] * 10), 9) / 10:.1f}"
+        entry["confidence"][bucket] = entry["confidence"].get(bucket, 0) + 1
+
+    def record_comparison(self, guess: Dict, llm_tool_name: str):
+        entry = self._rule(guess["rule"])
+        entry["compared"] += 1
+        entry["agreed"] += int(guess["tool_name"] == llm_tool_name)
+
+    def snapshot(self) -> Dict:
+        rules = {}
+        for rule, entry in self.rules.items():
+            rules[rule] = dict(entry)
+            rules[rule]["agreement"] = (
+                round(entry["agreed"] / entry["compared"], 3) if entry["compared"] else None
+            )
+        return {
+            "min_confidence": FAST_PATH_MIN_CONFIDENCE,
+            "shadow_rate": FAST_PATH_SHADOW_RATE,
+            "turns": self.turns,
+            "rules": rules,
+        }
+
+
+class IntentClassifier:
+    """
+    Deterministic first routing stage. Returns a guess
+    {"tool_name", "confidence", "rule"} for the cases it recognises, or None.
+    The caller decides whether the confidence is enough to skip the LLM router.
+    """
+
+    def __init__(self, draft_tool_names: List[str]):
+        self.draft_tool_names = set(draft_tool_names)
+        self.stats = FastPathStats()
+
+    def classify(
+        self, current_user_turn: Dict, prev_ai_response: Dict, has_image: bool
+    ) -> Optional[Dict]:
+        self.stats.turns += 1
+        prev_ai_response = prev_ai_response or {}
+        message = normalize_message(current_user_turn.get("message"))
+        selections = answered_selections(current_user_turn.get("selections"))
+        edited = drafts_changed(
+            current_user_turn.get("drafts"), prev_ai_response.get("drafts")
+        )
+        current_tool = prev_ai_response.get("tool_name") or ""
+        in_draft_task = current_tool in self.draft_tool_names
+
+        action = normalize_message(current_user_turn.get("action"))
+        if action in PUBLISH_ACTIONS | CANCEL_ACTIONS and in_draft_task:
+            return self._guess(current_tool, 0.95, "ui_action")
+
+        # raw fields, the same test UserTurnSummarizer uses: "!" is not empty there,
+        # and an empty turn must be one it also drops
+        if (
+            not current_user_turn.get("message")
+            and not current_user_turn.get("action")
+            and not selections
+            and not edited
+            and not has_image
+        ):
+            return self._guess(EMPTY_TURN, 1.0, "empty_turn")
+
+        if has_image:
+            return None  # an upload can start anything, let the LLM look at it
+
+        if selections and current_tool:
+            asked = {
+                s.get("prompt_id")
+                for s in prev_ai_response.get("selections") or []
+                if isinstance(s, dict)
+            }
+            if all(s["prompt_id"] in asked for s in selections):
+                # answering our own question; a typed message may change topic
+                return self._guess(
+                    current_tool, 0.95 if not message else 0.7, "selection_answer"
+                )
+
+        if edited and in_draft_task and not message:
+            return self._guess(current_tool, 0.9, "draft_edit")
+
+        if (
+            message in PUBLISH_WORDS or message in AFFIRMATIVE_WORDS or message in CANCEL_WORDS
+        ) and in_draft_task:
+            return self._guess(current_tool, 0.9, "publish_keyword")
+
+        if GREETING_RE.match(message) and not selections and not edited:
+            # mid-task "thanks" is usually still small talk, but less certain
+            return self._guess(
+                GENERAL_TOOL, 0.75 if in_draft_task else 0.9, "greeting"
+            )
+
+        return None
+
+    def _guess(self, tool_name: str, confidence: float, rule: str) -> Dict:
+        return {"tool_name": tool_name, "confidence": confidence, "rule": rule}
+
+
+class PublishDetector:
+    """
+    Rule-based publish/cancel decision for draft tools. Returns
+    {"publish", "cancel", "reason"} when the turn is unambiguous, otherwise None
+    so the caller can ask the LLM.
+    """
+
+    def __init__(self):
+        self.stats = {"decided": {}, "ambiguous": 0}
+
+    def detect(
+        self, current_user_turn: Dict, prev_ai_response: Dict, record: bool = True
+    ) -> Optional[Dict]:
+        """record=False: the caller may throw the result away, it calls record() if used"""
+        decision = self._detect(current_user_turn, prev_ai_response or {})
+        if record:
+            self.record(decision)
+        return decision
+
+    def record(self, decision: Optional[Dict]):
+        if decision is None:
+            self.stats["ambiguous"] += 1
+        else:
+            rule = decision["reason"]
+            self.stats["decided"][rule] = self.stats["decided"].get(rule, 0) + 1
+
+    def _detect(self, current_user_turn: Dict, prev_ai_response: Dict) -> Optional[Dict]:
+        message = normalize_message(current_user_turn.get("message"))
+        action = normalize_message(current_user_turn.get("action"))
+        selections = answered_selections(current_user_turn.get("selections"))
+        prev_drafts = prev_ai_response.get("drafts") or []
+        edited = drafts_changed(current_user_turn.get("drafts"), prev_drafts)
+
+        # 1. dedicated button in the form data
+        if action in CANCEL_ACTIONS:
+            return self._decision(False, True, "ui_action")
+        if action in PUBLISH_ACTIONS:
+            return self._decision(bool(prev_drafts), False, "ui_action")
+
+        # 2. selection options that are publish/cancel buttons (by id or label)
+        picked = self._picked_options(selections, prev_ai_response)
+        if picked & (CANCEL_ACTIONS | CANCEL_WORDS):
+            return self._decision(False, True, "selection_option")
+        if picked & (PUBLISH_ACTIONS | PUBLISH_WORDS) and not edited:
+            return self._decision(bool(prev_drafts), False, "selection_option")
+        if picked & AFFIRMATIVE_WORDS or any(ACTION_MENTION_RE.search(p) for p in picked):
+            return None  # e.g. "yes, publish it" or "looks good" - let the LLM read it
+
+        # 3. keyword lexicon, only for short messages that are nothing but the keyword
+        if message in CANCEL_WORDS:
+            return self._decision(False, True, "keyword")
+        if message in PUBLISH_WORDS and not edited and prev_drafts:
+            return self._decision(True, False, "keyword")
+        if message in AFFIRMATIVE_WORDS and prev_drafts:
+            return None  # "theek hai" may answer a question, not approve the draft
+
+        # 4. plain editing turns
+        if not prev_drafts:
+            if not message:
+                return self._decision(False, False, "no_drafts")
+            return None  # could still be "cancel this" in free text
+        if edited and not message:
+            return self._decision(False, False, "edited_drafts")
+        if selections and not message:
+            return self._decision(False, False, "answered_selection")
+        return None
+
+    def _picked_options(self, selections: List[Dict], prev_ai_response: Dict) -> set:
+        labels = {}
+        for prompt in prev_ai_response.get("selections") or []:
+            for opt in (prompt or {}).get("options") or []:
+                if isinstance(opt, dict):
+                    labels[opt.get("id")] = opt.get("label")
+        picked = set()
+        for sel in selections:
+            for option_id in sel.get("selected_option_ids") or []:
+                picked.add(normalize_message(str(option_id)).replace("-", "_"))
+                if labels.get(option_id):
+                    picked.add(normalize_message(labels[option_id]))
+        return picked
+
+    def _decision(self, publish: bool, cancel: bool, rule: str) -> Dict:
+        return {"publish": publish, "cancel": cancel, "reason": rule}
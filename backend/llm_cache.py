@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Callable, Awaitable
+
+# --- CONFIG ---
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_DISK = os.getenv("LLM_CACHE_DISK", "false").lower() == "true"
+LLM_CACHE_DIR = os.path.join("data", "llm_cache")
+
+# seconds a response stays valid, per call site. 0 disables caching for that site.
+# override with e.g. LLM_CACHE_TTL_DRAFT=0
+DEFAULT_TTLS = {
+    "routing": 300,
+    "publish": 300,
+    "draft": 600,
+    "finalize": 3600,
+    "research": 3600,
+    "research_followup": 600,
+    "conversation": 300,
+    "default": 0,
+}
+CACHE_TTLS = {
+    site: int(os.getenv(f"LLM_CACHE_TTL_{site.upper()}", ttl))
+    for site, ttl in DEFAULT_TTLS.items()
+}
+
+
+def cache_key(model: str, prompt: str, schema_text: str, image_sha256: Optional[str]) -> str:
+    """content address of a structured call: model + prompt + schema + image hash"""
+    h = hashlib.sha256()
+    for part in (model, prompt, schema_text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    h.update(bytes.fromhex(image_sha256) if image_sha256 else b"-")
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for raw model output text: an in-memory LRU and an optional
+    directory of json files that survives restarts. Concurrent requests for the
+    same key share one upstream call (single flight).
+    """
+
+    def __init__(self, max_entries: int, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._memory = OrderedDict()  # key -> (expires_at, text)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "shared": 0,  # joined an identical in-flight call
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "bytes_saved": 0,
+            "by_site": {},
+        }
+
+    async def get_or_compute(
+        self, key: str, site: str, compute: Callable[[], Awaitable[str]]
+    ) -> str:
+        ttl = CACHE_TTLS.get(site, CACHE_TTLS["default"])
+        if ttl <= 0:
+            return await compute()
+
+        text = self._memory_get(key)
+        tier = "memory"
+        if text is None and self.disk_dir:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            tier = "disk"
+            if entry is not None:
+                expires_at, text = entry
+                self._memory_put(key, text, expires_at)
+        if text is not None:
+            self._count(site, tier, text)
+            return text
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                text = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise  # we were cancelled, not the shared call
+                # the first caller gave up (e.g. discarded speculation), call ourselves
+                return await self.get_or_compute(key, site, compute)
+            self._count(site, "shared", text)
+            return text
+
+        self._count(site, "miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            text = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved, waiters re-raise it themselves
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(text)
+        expires_at = time.time() + ttl
+        self._memory_put(key, text, expires_at)
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, key, text, expires_at)
+        self.stats["stores"] += 1
+        return text
+
+    def snapshot(self) -> Dict:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["shared"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._memory),
+            "disk": bool(self.disk_dir),
+            "hit_rate": round(hits / total, 3) if total else None,
+            "ttls": CACHE_TTLS,
+        }
+
+    def _count(self, site: str, tier: str, text: str = ""):
+        site_stats = self.stats["by_site"].setdefault(site, {"hits": 0, "misses": 0})
+        if tier == "miss":
+            self.stats["misses"] += 1
+            site_stats["misses"] += 1
+            return
+        self.stats[f"{tier}_hits" if tier != "shared" else "shared"] += 1
+        self.stats["bytes_saved"] += len(text.encode("utf-8"))
+        site_stats["hits"] += 1
+
+    # --- memory tier ---
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return text
+
+    def _memory_put(self, key: str, text: str, expires_at: float):
+        self._memory[key] = (expires_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # --- disk tier ---
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, str]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (IOError, json.JSONDecodeError):
+            return None
+        if entry.get("expires_at", 0) < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry.get("expires_at"), entry.get("text", "")
+
+    def _disk_put(self, key: str, text: str, expires_at: float):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "text": text}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except IOError as e:
+            print(f"[llm_cache] failed to write {path}: {e}")
+
+
+response_cache = ResponseCache(
+    LLM_CACHE_MAX_ENTRIES, LLM_CACHE_DIR if LLM_CACHE_DISK else None
+)
@@ -0,0 +1,182 @@
+"""
+Prompt assembly under a token budget.
+
+    prompt = PromptAssembler(budget=PROMPT_TOKEN_BUDGET)
+    prompt.add("Previous charts", charts_json, policy="drop", priority=0)
+    prompt.add("Relevant posts", posts_json, policy="summarize", priority=2)
+    text = prompt.render(header, footer, label="draft")
+
+Fixed text (header / footer) always stays. When the whole prompt is over
+budget, sections are shrunk lowest priority first until it fits, first gently
+(summaries, lists down to their newest item, "drop" sections), then by cutting
+to whatever budget is left:
+
+    keep         never touched
+    drop         left out
+    truncate     cut to what is left of the budget
+    keep_latest  JSON list: oldest items dropped first
+    summarize    JSON records reduced to their short scalar fields (ids, names,
+                 titles), text to its first sentences; then truncated
+
+Tokens are estimated (about 4 characters per token), there is no tokenizer
+round trip. Every render logs the per-section breakdown.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+# --- CONFIG ---
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "32000"))
+CHARS_PER_TOKEN = 4
+SUMMARY_FIELD_MAX_CHARS = 120  # longer scalar fields are left out of summaries
+POLICIES = ("keep", "drop", "truncate", "keep_latest", "summarize")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text or "") // CHARS_PER_TOKEN)
+
+
+@dataclass
+class Section:
+    name: str
+    text: str
+    policy: str = "truncate"
+    priority: int = 1  # lower is shrunk first
+    action: str = "kept"  # what the budget did to it, for the log
+    original_tokens: int = 0
+    min_items: int = 0  # keep_latest never goes below this many items
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.render()) if self.text else 0
+
+    def render(self) -> str:
+        return f"{self.name}: {self.text}" if self.text else ""
+
+
+@dataclass
+class PromptAssembler:
+    budget: int = PROMPT_TOKEN_BUDGET
+    sections: List[Section] = field(default_factory=list)
+
+    def add(
+        self,
+        name: str,
+        value: Any,
+        policy: str = "truncate",
+        priority: int = 1,
+        min_items: int = 0,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown prompt section policy: {policy}")
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        section = Section(name, text or "", policy, priority, min_items=min_items)
+        section.original_tokens = section.tokens
+        self.sections.append(section)
+
+    def render(self, header: str = "", footer: str = "", label: str = "", reserved: int = 0) -> str:
+        """reserved: tokens of text sent along with this one (e.g. a cached prefix)"""
+        fixed = estimate_tokens(header) + estimate_tokens(footer) + reserved
+        total = fixed + sum(s.tokens for s in self.sections)
+        for hard in (False, True):
+            for section in sorted(self.sections, key=lambda s: s.priority):
+                if total <= self.budget:
+                    break
+                if section.policy == "keep" or not section.text:
+                    continue
+                before = section.tokens
+                _shrink(section, max(before - (total - self.budget), 0), hard)
+                total -= before - section.tokens
+        body = "\n".join(s.render() for s in self.sections if s.text)
+        self._log(label, fixed, total)
+        return f"{header}{body}\n{footer}" if body else header + footer
+
+    def _log(self, label: str, fixed: int, total: int):
+        parts = [f"fixed={fixed}"]
+        for s in sorted(self.sections, key=lambda s: -s.original_tokens):
+            note = "" if s.action == "kept" else f"({s.action} from {s.original_tokens})"
+            parts.append(f"{s.name}={s.tokens}{note}")
+        over = " OVER BUDGET" if total > self.budget else ""
+        print(f"[prompt] {label} ~{total}/{self.budget} tokens{over}: " + ", ".join(parts))
+
+
+def _shrink(section: Section, target: int, hard: bool):
+    """
+    shrink section towards target tokens with its policy; not hard: only
+    the reductions that keep some of it (never below one list item)
+    """
+    if section.policy == "drop":
+        section.text, section.action = "", "dropped"
+    elif section.policy == "keep_latest":
+        _keep_latest(section, target, min_items=section.min_items if hard else max(section.min_items, 1))
+    elif hard and target <= estimate_tokens(section.name) + 1:
+        section.text, section.action = "", "dropped"
+    elif section.policy == "summarize" and section.action == "kept":
+        section.text = _summarize(section.text)
+        section.action = "summarized"
+        if hard and section.tokens > target:
+            _truncate(section, target)
+            section.action = "summarized+truncated"
+    elif hard:
+        _truncate(section, target)
+
+
+def _truncate(section: Section, target: int):
+    marker = " …[truncated]"
+    keep = max(target * CHARS_PER_TOKEN - len(section.name) - len(marker) - 2, 0)
+    section.text = section.text[:keep] + marker
+    section.action = "truncated"
+
+
+def _keep_latest(section: Section, target: int, min_items: int):
+    items = _json_list(section.text)
+    if items is None:
+        _truncate(section, target)
+        return
+    kept = len(items)
+    while kept > min_items and section.tokens > target:
+        kept -= 1
+        section.text = json.dumps(items[len(items) - kept :], ensure_ascii=False)
+    if kept == 0:
+        section.text, section.action = "", "dropped"
+    elif kept < len(items):
+        section.action = f"kept latest {kept}/{len(items)}"
+
+
+def _summarize(text: str) -> str:
+    items = _json_list(text)
+    if items is not None:
+        return json.dumps(summarize_records(items), ensure_ascii=False)
+    # plain text: the first sentence of every paragraph
+    paragraphs = [p.strip() for p in text.split("\n") if p.strip()]
+    return " ".join(re.split(r"(?<=[.!?])\s", p, maxsplit=1)[0] for p in paragraphs)
+
+
+def summarize_records(items: List[Any]) -> List[Any]:
+    """documents reduced to their short scalar fields (ids, names, prices...)"""
+    summaries = []
+    for value in items:
+        if isinstance(value, dict):
+            value = {
+                key: v
+                for key, v in value.items()
+                if (isinstance(v, (int, float)) and not isinstance(v, bool))
+                or (
+                    isinstance(v, str)
+                    and len(v) <= SUMMARY_FIELD_MAX_CHARS
+                    and not v.startswith("http")
+                )
+            }
+        summaries.append(value)
+    return summaries
+
+
+def _json_list(text: str) -> Optional[list]:
+    try:
+        value = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, list) else None
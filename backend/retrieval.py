@@ -0,0 +1,126 @@
+"""
+Local BM25 retrieval over the dashboard collections, so a prompt gets the few
+products / posts / ads / chats relevant to the turn instead of all of them.
+
+    retriever.search("posts", posts_db, "diwali saree caption", k=5)
+
+An index is built per collection on first use and rebuilt when the list's
+version (IndexedCollection.version, bumped on every write and reload) or the
+storage version passed in changes (documents edited in place, then saved).
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+
+# --- CONFIG ---
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# text that is searched, per collection; "a.b" walks into lists of dicts
+SEARCH_FIELDS = {
+    "products": ["name", "description", "category", "hashtags"],
+    "posts": ["localizations.caption", "localizations.hashtags", "localizations.language"],
+    "ads": [
+        "localizations.headline",
+        "localizations.translation",
+        "localizations.hashtags",
+        "localizations.platforms",
+        "localizations.region",
+    ],
+    "chats": [
+        "customer_name",
+        "language",
+        "conversation_history.message",
+        "conversation_history.translation",
+    ],
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from have i in is it me my of on or our "
+    "please the this to us we what with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        t for t in _TOKEN_RE.findall(text.lower())
+        if t not in STOPWORDS and (len(t) > 1 or not t.isascii())
+    ]
+
+
+def field_text(doc: Any, path: str) -> Iterable[str]:
+    """every string at path ("localizations.caption") in doc, lists flattened"""
+    head, _, rest = path.partition(".")
+    values = doc.get(head) if isinstance(doc, dict) else None
+    for value in values if isinstance(values, list) else [values]:
+        if rest:
+            yield from field_text(value, rest)
+        elif isinstance(value, str):
+            yield value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield str(value)
+
+
+class BM25Index:
+    def __init__(self, docs: List[Dict], fields: List[str]):
+        self.docs = list(docs)
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}  # term -> (doc, tf)
+        self.lengths: List[int] = []
+        for i, doc in enumerate(self.docs):
+            terms = tokenize(" ".join(t for f in fields for t in field_text(doc, f)))
+            self.lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((i, tf))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def scores(self, query: str) -> Dict[int, float]:
+        n = len(self.docs)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = 1 - BM25_B + BM25_B * self.lengths[i] / (self.avg_length or 1)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        return scores
+
+
+class Retriever:
+    def __init__(self):
+        self._indexes: Dict[str, Tuple[Any, BM25Index]] = {}  # collection -> (version, index)
+        self.stats = {"searches": 0, "builds": 0}
+
+    def index(self, collection: str, docs: List[Dict], version: Any = None) -> BM25Index:
+        version = (id(docs), getattr(docs, "version", None), len(docs), version)
+        cached = self._indexes.get(collection)
+        if cached and cached[0] == version and getattr(docs, "version", None) is not None:
+            return cached[1]
+        index = BM25Index(docs, SEARCH_FIELDS[collection])
+        self._indexes[collection] = (version, index)
+        self.stats["builds"] += 1
+        return index
+
+    def search(
+        self, collection: str, docs: List[Dict], query: str, k: int, version: Any = None
+    ) -> List[Dict]:
+        """
+        Top k documents for query, best first. The whole collection when it has
+        at most k documents; the newest k when nothing matches.
+        """
+        self.stats["searches"] += 1
+        if len(docs) <= k:
+            return list(docs)
+        index = self.index(collection, docs, version)
+        scores = index.scores(query)
+        if not scores:
+            return index.docs[-k:]
+        ranked = sorted(scores, key=lambda i: (-scores[i], -i))[:k]
+        return [index.docs[i] for i in ranked]
+
+
+retriever = Retriever()
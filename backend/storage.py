@@ -0,0 +1,415 @@
+"""
+Storage for the products / posts / ads / chats / research collections.
+
+STORAGE_BACKEND=json    data/<collection>.json files (the original format)
+STORAGE_BACKEND=sqlite  data/store.db, WAL mode, one row per document
+
+The JSON files stay the import/export format for the SQLite store:
+
+    cd backend && python storage.py export [dir]   # sqlite -> <dir>/<collection>.json
+    cd backend && python storage.py import [dir]   # <dir>/<collection>.json -> sqlite
+
+An empty SQLite store imports data/*.json automatically on first use.
+
+Writes are buffered (WriteBehindStorage) and flushed by a background thread
+every STORAGE_FLUSH_INTERVAL seconds, and on shutdown. 0 writes through.
+"""
+
+import os
+import sys
+import copy
+import json
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# --- CONFIG ---
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()  # "json" or "sqlite"
+STORAGE_DIR = "data"
+SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", os.path.join(STORAGE_DIR, "store.db"))
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "1.0"))  # seconds
+
+# collection -> primary key field (None: no key, upserts append and replace_all swaps it whole)
+COLLECTION_KEYS = {
+    "products": "product_id",
+    "posts": "post_id",
+    "ads": "ad_id",
+    "chats": "chat_id",
+    "research": None,
+}
+
+
+class StorageBackend:
+    """
+    load: every document of a collection, in insertion order
+    upsert: insert or replace documents by primary key
+    replace_all: swap the whole collection (imports, keyless collections)
+    version: opaque value that changes whenever the collection changes
+    listeners: callables(collection) run after every write from this process
+    """
+
+    def __init__(self):
+        self.listeners: List[Callable[[str], None]] = []
+
+    def _notify(self, collection: str):
+        for listener in self.listeners:
+            listener(collection)
+
+    def load(self, collection: str) -> List[Dict]:
+        raise NotImplementedError
+
+    def upsert(self, collection: str, docs: List[Dict]):
+        raise NotImplementedError
+
+    def replace_all(self, collection: str, docs: List[Dict]):
+        raise NotImplementedError
+
+    def version(self, collection: str):
+        raise NotImplementedError
+
+
+class JsonFileBackend(StorageBackend):
+    """One JSON array per collection. Every write rewrites that file (atomically)."""
+
+    def __init__(self, directory: str = STORAGE_DIR):
+        super().__init__()
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def path(self, collection: str) -> str:
+        return os.path.join(self.directory, f"{collection}.json")
+
+    def load(self, collection: str) -> List[Dict]:
+        try:
+            with open(self.path(collection), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"[storage] error reading {collection}: {e}")
+            return []
+
+    def upsert(self, collection: str, docs: List[Dict]):
+        key = COLLECTION_KEYS[collection]
+        with self._lock:
+            current = self.load(collection)
+            positions = {}
+            if key:
+                positions = {d.get(key): i for i, d in enumerate(current) if d.get(key) is not None}
+            for doc in docs:
+                doc_id = doc.get(key) if key else None
+                idx = positions.get(doc_id) if doc_id is not None else None
+                if idx is None:
+                    if doc_id is not None:
+                        positions[doc_id] = len(current)
+                    current.append(doc)
+                else:
+                    current[idx] = doc
+            self._write(collection, current)
+        self._notify(collection)
+
+    def replace_all(self, collection: str, docs: List[Dict]):
+        with self._lock:
+            self._write(collection, docs)
+        self._notify(collection)
+
+    def version(self, collection: str):
+        try:
+            st = os.stat(self.path(collection))
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, collection: str, docs: List[Dict]):
+        path = self.path(collection)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(docs, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())  # complete on disk before it replaces the old file
+        os.replace(tmp_path, path)
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    One table per collection: seq (insertion order), the primary key, product_id
+    and the document as JSON text (collections without a key are only ever
+    appended to, seq is their row id). Writes are per-row upserts in a transaction
+    that also bumps the collection's version in the meta table, so other
+    processes sharing the file can tell when to reload.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH, seed_dir: Optional[str] = STORAGE_DIR):
+        super().__init__()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._create_tables()
+        if seed_dir:
+            self._seed(seed_dir)
+
+    def _create_tables(self):
+        with self._transaction() as cur:
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS meta (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            for collection, key in COLLECTION_KEYS.items():
+                key_column = f"{key} TEXT UNIQUE," if key and key != "product_id" else ""
+                product_column = "product_id TEXT UNIQUE," if key == "product_id" else "product_id TEXT,"
+                cur.execute(
+                    f"CREATE TABLE IF NOT EXISTS {collection} ("
+                    "seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    f"{key_column}{product_column}"
+                    "body TEXT NOT NULL)"
+                )
+                if key != "product_id":
+                    cur.execute(
+                        f"CREATE INDEX IF NOT EXISTS idx_{collection}_product_id "
+                        f"ON {collection}(product_id)"
+                    )
+
+    def _seed(self, directory: str):
+        """first run: import the JSON files into collections that were never written"""
+        seeded = {r[0] for r in self._conn.execute("SELECT collection FROM meta")}
+        source = JsonFileBackend(directory)
+        for collection in COLLECTION_KEYS:
+            if collection not in seeded:
+                docs = source.load(collection)
+                self.replace_all(collection, docs)
+                print(f"[storage] imported {len(docs)} {collection} into {self.path}")
+
+    def load(self, collection: str) -> List[Dict]:
+        self._check(collection)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT body FROM {collection} ORDER BY seq").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def upsert(self, collection: str, docs: List[Dict]):
+        key = self._check(collection)
+        with self._transaction() as cur:
+            for doc in docs:
+                body = json.dumps(doc, ensure_ascii=False)
+                if key is None:  # no key to match on, appended like the JSON backend does
+                    cur.execute(
+                        f"INSERT INTO {collection} (product_id, body) VALUES (?, ?)",
+                        (doc.get("product_id") if isinstance(doc, dict) else None, body),
+                    )
+                elif key == "product_id":
+                    cur.execute(
+                        f"INSERT INTO {collection} (product_id, body) VALUES (?, ?) "
+                        "ON CONFLICT(product_id) DO UPDATE SET body = excluded.body",
+                        (doc.get(key), body),
+                    )
+                else:
+                    cur.execute(
+                        f"INSERT INTO {collection} ({key}, product_id, body) VALUES (?, ?, ?) "
+                        f"ON CONFLICT({key}) DO UPDATE SET "
+                        "product_id = excluded.product_id, body = excluded.body",
+                        (doc.get(key), doc.get("product_id"), body),
+                    )
+            self._bump(cur, collection)
+        self._notify(collection)
+
+    def replace_all(self, collection: str, docs: List[Dict]):
+        key = self._check(collection)
+        with self._transaction() as cur:
+            cur.execute(f"DELETE FROM {collection}")
+            for doc in docs:
+                body = json.dumps(doc, ensure_ascii=False)
+                if key is None:
+                    cur.execute(
+                        f"INSERT INTO {collection} (product_id, body) VALUES (?, ?)",
+                        (doc.get("product_id") if isinstance(doc, dict) else None, body),
+                    )
+                elif key == "product_id":
+                    cur.execute(
+                        f"INSERT OR REPLACE INTO {collection} (product_id, body) VALUES (?, ?)",
+                        (doc.get(key), body),
+                    )
+                else:
+                    cur.execute(
+                        f"INSERT OR REPLACE INTO {collection} ({key}, product_id, body) "
+                        "VALUES (?, ?, ?)",
+                        (doc.get(key), doc.get("product_id"), body),
+                    )
+            self._bump(cur, collection)
+        self._notify(collection)
+
+    def version(self, collection: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM meta WHERE collection = ?", (collection,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _bump(self, cur, collection: str):
+        cur.execute(
+            "INSERT INTO meta (collection, version) VALUES (?, 1) "
+            "ON CONFLICT(collection) DO UPDATE SET version = version + 1",
+            (collection,),
+        )
+
+    def _check(self, collection: str) -> Optional[str]:
+        if collection not in COLLECTION_KEYS:
+            raise KeyError(f"unknown collection: {collection}")
+        return COLLECTION_KEYS[collection]
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")  # take the write lock up front (other processes)
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+
+
+class WriteBehindStorage(StorageBackend):
+    """
+    Wraps a backend so upserts only mark documents dirty; a background thread
+    writes everything pending per collection in one batch (one atomic file
+    rewrite for JSON, one transaction for SQLite) every `interval` seconds.
+
+    Reads see pending documents (read-your-writes), and version() changes as
+    soon as something is queued. flush() / close() write out immediately,
+    close() is also registered with atexit.
+    """
+
+    def __init__(self, backend: StorageBackend, interval: float = STORAGE_FLUSH_INTERVAL):
+        super().__init__()
+        self.backend = backend
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._pending: Dict[str, Dict] = {}  # collection -> pk -> doc snapshot
+        self._queued: Dict[str, int] = {}  # collection -> documents queued so far
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self.stats = {"queued": 0, "flushes": 0, "docs_written": 0, "errors": 0}
+        backend.listeners.append(self._notify)
+        self._thread = threading.Thread(target=self._run, name="storage-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def load(self, collection: str) -> List[Dict]:
+        docs = self.backend.load(collection)
+        with self._lock:
+            pending = list(self._pending.get(collection, {}).values())
+        if not pending:
+            return docs
+        key = COLLECTION_KEYS[collection]
+        positions = {d.get(key): i for i, d in enumerate(docs) if key and d.get(key) is not None}
+        for doc in pending:
+            doc_id = doc.get(key) if key else None
+            idx = positions.get(doc_id) if doc_id is not None else None
+            if idx is None:
+                if doc_id is not None:
+                    positions[doc_id] = len(docs)
+                docs.append(copy.deepcopy(doc))
+            else:
+                docs[idx] = copy.deepcopy(doc)
+        return docs
+
+    def upsert(self, collection: str, docs: List[Dict]):
+        key = COLLECTION_KEYS[collection]
+        # snapshot now: the caller keeps mutating its in-memory documents
+        snapshots = [copy.deepcopy(doc) for doc in docs]
+        with self._lock:
+            pending = self._pending.setdefault(collection, {})
+            for doc in snapshots:
+                doc_id = doc.get(key) if key else None
+                if doc_id is None:
+                    doc_id = ("new", self.stats["queued"], id(doc))  # no id, always appended
+                pending.pop(doc_id, None)  # keep arrival order for new documents
+                pending[doc_id] = doc
+                self.stats["queued"] += 1
+            self._queued[collection] = self._queued.get(collection, 0) + len(snapshots)
+        self._notify(collection)
+
+    def replace_all(self, collection: str, docs: List[Dict]):
+        with self._flush_lock:
+            with self._lock:
+                self._pending.pop(collection, None)
+            self.backend.replace_all(collection, docs)
+
+    def version(self, collection: str):
+        with self._lock:
+            queued = self._queued.get(collection, 0)
+        return (self.backend.version(collection), queued)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batches, self._pending = self._pending, {}
+            for collection, docs in batches.items():
+                try:
+                    self.backend.upsert(collection, list(docs.values()))
+                    self.stats["docs_written"] += len(docs)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print(f"[storage] flush of {collection} failed, will retry: {e}")
+                    with self._lock:  # put back, newer queued versions win
+                        retry = self._pending.setdefault(collection, {})
+                        for pk, doc in docs.items():
+                            retry.setdefault(pk, doc)
+            if batches:
+                self.stats["flushes"] += 1
+
+    def close(self):
+        if not self._stopped:
+            self._stopped = True
+            self._wakeup.set()
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def snapshot(self) -> Dict:
+        return {**self.stats, "pending": self.pending(), "interval": self.interval}
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            if self._pending:
+                self.flush()
+
+
+def open_storage(kind: str = STORAGE_BACKEND) -> StorageBackend:
+    if kind == "sqlite":
+        backend = SQLiteBackend()
+    elif kind == "json":
+        backend = JsonFileBackend()
+    else:
+        raise ValueError(f"unknown STORAGE_BACKEND: {kind}")
+    if STORAGE_FLUSH_INTERVAL > 0:
+        return WriteBehindStorage(backend, STORAGE_FLUSH_INTERVAL)
+    return backend
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("export", "import"):
+        print("usage: python storage.py export|import [dir]")
+        sys.exit(1)
+    json_dir = sys.argv[2] if len(sys.argv) > 2 else STORAGE_DIR
+    os.makedirs(json_dir, exist_ok=True)
+    files = JsonFileBackend(json_dir)
+    store = SQLiteBackend(seed_dir=None)
+    for name in COLLECTION_KEYS:
+        if sys.argv[1] == "export":
+            docs = store.load(name)
+            files.replace_all(name, docs)
+        else:
+            docs = files.load(name)
+            store.replace_all(name, docs)
+        print(f"{sys.argv[1]}ed {len(docs)} {name}")
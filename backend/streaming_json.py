@@ -0,0 +1,207 @@
+import json
+from collections.abc import Mapping, Sequence
+from typing import Any, List, Optional, Tuple
+
+
+def decode_partial_string(raw: str) -> str:
+    """
+    Decode the body of a JSON string literal that may be cut off mid-way,
+    e.g. 'Hello \\"wo' -> 'Hello "wo'. A trailing incomplete escape is dropped,
+    and so is a trailing \\uD800-\\uDBFF until its low surrogate arrives (alone it
+    would decode to a lone surrogate that can't be encoded as UTF-8).
+    """
+    i = 0
+    out = []
+    while i < len(raw):
+        if raw[i] == "\\":
+            escape_len = 6 if raw[i + 1 : i + 2] == "u" else 2
+            if i + escape_len > len(raw):
+                break  # escape sequence not complete yet
+            out.append(raw[i : i + escape_len])
+            i += escape_len
+            continue
+        out.append(raw[i])
+        i += 1
+    if out and len(out[-1]) == 6 and out[-1][1] == "u" and _is_high_surrogate(out[-1][2:]):
+        out.pop()
+    try:
+        return json.loads('"' + "".join(out) + '"')
+    except json.JSONDecodeError:
+        return ""
+
+
+def _is_high_surrogate(hex_digits: str) -> bool:
+    try:
+        return 0xD800 <= int(hex_digits, 16) <= 0xDBFF
+    except ValueError:
+        return False
+
+
+def matches_schema(value: Any, template: Any) -> bool:
+    """
+    Loose check of a value against the AI-friendly schema from dataclass_to_schema
+    ("string", "number(optional)", "a/b/c" enums, [item], {key: ...}).
+    Missing and unknown keys are allowed, nulls are allowed for scalars.
+    """
+    if isinstance(template, Mapping):
+        if not isinstance(value, dict):
+            return False
+        return all(
+            matches_schema(v, template[k]) for k, v in value.items() if k in template
+        )
+    if isinstance(template, Sequence) and not isinstance(template, str):
+        if value is None:
+            return True
+        if not isinstance(value, list):
+            return False
+        return not template or all(matches_schema(v, template[0]) for v in value)
+    if value is None or not isinstance(template, str):
+        return True
+    kind = template.replace("(optional)", "")
+    if kind == "string":
+        return isinstance(value, str)
+    if kind == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind == "boolean":
+        return isinstance(value, bool)
+    if "/" in kind:  # enum
+        return str(value) in kind.split("/")
+    return True
+
+
+class IncrementalJSONParser:
+    """
+    Consumes a top-level JSON object in chunks and reports pieces as soon as they
+    are complete, instead of waiting for the whole document:
+
+        ("partial", key, text)          top-level string value still arriving
+        ("field", key, value)           a top-level value closed
+        ("item", key, index, value, ok) an element of a top-level array closed;
+                                        ok = matches the schema for that key
+
+    Anything before the first "{" (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self, schema: Optional[Mapping] = None):
+        self.schema = schema or {}
+        self.buffer = ""
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key = None
+        self._expect_key = True
+        self._value_start = None  # start of the current top-level value
+        self._value_kind = None  # "string" / "container" / "scalar"
+        self._value_is_array = False
+        self._elem_start = None  # start of the current element of a top-level array
+        self._elem_kind = None
+        self._elem_index = 0
+        self._last_partial = ""
+
+    def feed(self, chunk: str) -> List[Tuple]:
+        self.buffer += chunk
+        events = []
+        buf = self.buffer
+        while self._pos < len(buf) and not self.done:
+            i = self._pos
+            c = buf[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._string_closed(i, events)
+                continue
+            if self._depth == 0:
+                if c == "{":
+                    self._depth = 1
+                continue
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+                self._start_value(i, "string")
+            elif c in "{[":
+                self._start_value(i, "container", is_array=(c == "["))
+                self._depth += 1
+            elif c in "}]":
+                self._end_scalar(i, events)
+                self._depth -= 1
+                self._container_closed(i, events)
+            elif c == ",":
+                self._end_scalar(i, events)
+                if self._depth == 1:
+                    self._expect_key = True
+            elif c == ":":
+                if self._depth == 1:
+                    self._expect_key = False
+            elif not c.isspace():
+                self._start_value(i, "scalar")
+        if self._in_string and self._depth == 1 and self._value_kind == "string":
+            text = decode_partial_string(buf[self._value_start + 1 : self._pos])
+            if text != self._last_partial:
+                self._last_partial = text
+                events.append(("partial", self._key, text))
+        return events
+
+    def _start_value(self, i: int, kind: str, is_array: bool = False):
+        if self._depth == 1 and not self._expect_key and self._value_start is None:
+            self._value_start, self._value_kind = i, kind
+            self._value_is_array = is_array
+            self._elem_index = 0
+            self._last_partial = ""
+        elif (
+            self._depth == 2
+            and self._value_is_array
+            and self._value_kind == "container"
+            and self._elem_start is None
+        ):
+            self._elem_start, self._elem_kind = i, kind
+
+    def _string_closed(self, i: int, events: List[Tuple]):
+        if self._depth == 1 and self._expect_key:
+            self._key = json.loads(self.buffer[self._string_start : i + 1])
+        elif self._depth == 1 and self._value_kind == "string":
+            self._emit_field(i + 1, events)
+        elif self._depth == 2 and self._elem_kind == "string":
+            self._emit_item(i + 1, events)
+
+    def _container_closed(self, i: int, events: List[Tuple]):
+        if self._depth == 0:
+            self.done = True
+        elif self._depth == 1 and self._value_kind == "container":
+            self._emit_field(i + 1, events)
+        elif self._depth == 2 and self._elem_kind == "container":
+            self._emit_item(i + 1, events)
+
+    def _end_scalar(self, i: int, events: List[Tuple]):
+        if self._depth == 1 and self._value_kind == "scalar":
+            self._emit_field(i, events)
+        elif self._depth == 2 and self._elem_kind == "scalar":
+            self._emit_item(i, events)
+
+    def _emit_field(self, end: int, events: List[Tuple]):
+        value = json.loads(self.buffer[self._value_start : end])
+        events.append(("field", self._key, value))
+        self._value_start = self._value_kind = None
+        self._value_is_array = False
+        self._elem_start = self._elem_kind = None
+
+    def _emit_item(self, end: int, events: List[Tuple]):
+        value = json.loads(self.buffer[self._elem_start : end])
+        template = self.schema.get(self._key) if isinstance(self.schema, Mapping) else None
+        ok = (
+            matches_schema(value, template[0])
+            if isinstance(template, Sequence) and not isinstance(template, str) and template
+            else True
+        )
+        events.append(("item", self._key, self._elem_index, value, ok))
+        self._elem_index += 1
+        self._elem_start = self._elem_kind = None
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend modules are flat, imported by name like backend.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,77 @@
+import json
+
+import chat_log
+from chat_log import ChatLog
+
+
+def turn(n):
+    return {"role": "user", "content": f"message {n}", "turn_id": f"user_{n}"}
+
+
+def test_append_read_and_patch_survive_reload(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    log = ChatLog(path)
+    log.append([turn(0), turn(1)])
+    log.patch("user_1", {"content": "edited"})
+    log.append([turn(2)])
+
+    reloaded = ChatLog(path)
+    assert reloaded.count() == 3
+    assert [t["seq"] for t in reloaded.read()] == [0, 1, 2]
+    assert reloaded.find("user_1")["content"] == "edited"
+
+
+def test_torn_last_line_is_cut_before_the_next_append(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    ChatLog(path).append([turn(0), turn(1)])
+    with open(path, "rb+") as f:  # crash while writing the newline of the last line
+        f.seek(-1, 2)
+        f.truncate()
+
+    log = ChatLog(path)
+    assert log.count() == 1  # the torn turn is gone...
+    log.append([turn(2), turn(3)])
+
+    reloaded = ChatLog(path)
+    assert reloaded.count() == 3  # ...and nothing appended after it is lost
+    assert [t["turn_id"] for t in reloaded.read()] == ["user_0", "user_2", "user_3"]
+
+
+def test_unreadable_line_is_skipped_not_the_rest(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    lines = [
+        json.dumps({"op": "turn", "turn": turn(0)}),
+        '{"op": "turn", "tu',
+        json.dumps({"op": "turn", "turn": turn(1)}),
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+    log = ChatLog(path)
+    log.append([turn(2)])
+    assert [t["turn_id"] for t in ChatLog(path).read()] == ["user_0", "user_1", "user_2"]
+
+
+def test_old_turns_are_read_back_from_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_log, "CHAT_LOG_TAIL", 2)
+    path = str(tmp_path / "s.jsonl")
+    ChatLog(path).append([turn(n) for n in range(5)])
+    with open(path, "ab") as f:
+        f.write(b"garbage\n")
+
+    log = ChatLog(path)
+    log.patch("user_0", {"content": "first"})
+    assert [t["content"] for t in log.read(0, 3)] == ["first", "message 1", "message 2"]
+    assert log.find("user_0")["content"] == "first"
+
+
+def test_compact_folds_patches(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    log = ChatLog(path)
+    log.append([turn(0)])
+    log.patch("user_0", {"content": "edited"})
+    log.compact()
+    with open(path, "rb") as f:
+        records = [json.loads(line) for line in f]
+    assert [r["op"] for r in records] == ["turn"]
+    assert records[0]["turn"]["content"] == "edited"
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import context_cache
+from context_cache import CONTEXT_CACHE_MIN_CHARS, ContextCache
+
+PREFIX = "x" * CONTEXT_CACHE_MIN_CHARS
+
+
+class StubCaches:
+    """client.aio.caches with the two coroutines ContextCache uses"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.created = []
+        self.deleted = []
+
+    async def create(self, model, config):
+        if self.fail:
+            raise RuntimeError("cache too small")
+        self.created.append((model, config))
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+def stub_client(fail=False):
+    return SimpleNamespace(aio=SimpleNamespace(caches=StubCaches(fail)))
+
+
+def get(cache, client, key="draft:post", prefix=PREFIX, collections=("products",)):
+    return asyncio.run(cache.get(client, "gemini-2.5-flash", key, prefix, collections))
+
+
+def test_creates_once_then_reuses():
+    cache, client = ContextCache(enabled=True, ttl=600), stub_client()
+    assert get(cache, client) == "cachedContents/1"
+    assert get(cache, client) == "cachedContents/1"
+    model, config = client.aio.caches.created[0]
+    assert config["contents"] == [PREFIX] and config["ttl"] == "600s"
+    assert len(client.aio.caches.created) == 1
+    assert cache.stats["created"] == 1 and cache.stats["hits"] == 1
+
+
+def test_changed_prefix_replaces_the_entry():
+    cache, client = ContextCache(enabled=True), stub_client()
+    get(cache, client)
+    assert get(cache, client, prefix=PREFIX + "y") == "cachedContents/2"
+    get(cache, client, prefix=PREFIX + "y")  # the old cache is deleted on the next call
+    assert client.aio.caches.deleted == ["cachedContents/1"]
+
+
+def test_expired_entry_is_created_again(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(context_cache.time, "monotonic", lambda: now[0])
+    cache, client = ContextCache(enabled=True, ttl=600), stub_client()
+    get(cache, client)
+    now[0] += 600 * 0.9 - 1
+    assert get(cache, client) == "cachedContents/1"
+    now[0] += 2  # renewed before the server side expiry
+    assert get(cache, client) == "cachedContents/2"
+    assert cache.stats["created"] == 2
+
+
+def test_storage_write_invalidates_and_deletes_remote_cache():
+    cache, client = ContextCache(enabled=True), stub_client()
+    get(cache, client, collections=("products", "posts"))
+    cache.invalidate("ads")
+    assert get(cache, client) == "cachedContents/1"
+    cache.invalidate("posts")
+    assert cache.snapshot()["entries"] == 0
+    assert get(cache, client) == "cachedContents/2"
+    assert client.aio.caches.deleted == ["cachedContents/1"]
+
+
+def test_short_prefix_or_disabled_sends_inline():
+    client = stub_client()
+    assert get(ContextCache(enabled=True), client, prefix="short") is None
+    assert get(ContextCache(enabled=False), client) is None
+    assert client.aio.caches.created == []
+
+
+def test_error_falls_back_and_is_not_retried_right_away(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(context_cache.time, "monotonic", lambda: now[0])
+    cache, client = ContextCache(enabled=True), stub_client(fail=True)
+    assert get(cache, client) is None
+    assert get(cache, client) is None
+    assert cache.stats["errors"] == 1 and cache.stats["skipped"] == 1
+
+    client.aio.caches.fail = False
+    now[0] += context_cache.CONTEXT_CACHE_RETRY_SECONDS
+    assert get(cache, client) == "cachedContents/1"
@@ -0,0 +1,101 @@
+import json
+import os
+
+import image_cache
+from image_cache import ImageCache
+
+
+def make_cache(tmp_path, max_bytes=10_000, **kwargs):
+    return ImageCache(
+        directory=str(tmp_path / "cache"),
+        max_bytes=max_bytes,
+        output_dir=str(tmp_path / "uploads"),
+        **kwargs,
+    )
+
+
+def generator(tmp_path, size=1000):
+    calls = []
+
+    def generate():
+        calls.append(1)
+        path = tmp_path / f"raw_{len(calls)}.png"
+        path.write_bytes(os.urandom(size))
+        return [str(path)]
+
+    return generate, calls
+
+
+def test_hit_hands_out_the_same_public_file(tmp_path):
+    cache = make_cache(tmp_path)
+    generate, calls = generator(tmp_path)
+    first = cache.get_or_generate("gemini", "m", "A  Lamp", None, generate)
+    second = cache.get_or_generate("gemini", "m", "a lamp", None, generate)
+    assert first == second and len(calls) == 1
+    assert os.path.dirname(first[0]) == str(tmp_path / "uploads")
+    assert os.listdir(tmp_path / "uploads") == [os.path.basename(first[0])]  # no manifest there
+    assert cache.snapshot()["bytes"] == 1000  # the hand-out is a link to the cached file
+
+
+def test_eviction_deletes_unreferenced_handouts(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_cache, "IMAGE_CACHE_GC_GRACE", 0)
+    cache = make_cache(tmp_path, max_bytes=2500)
+    generate, _ = generator(tmp_path)
+    kept = cache.get_or_generate("gemini", "m", "kept", None, generate)[0]
+    dropped = cache.get_or_generate("gemini", "m", "dropped", None, generate)[0]
+    cache.reference_check = lambda names: {n for n in names if n == os.path.basename(kept)}
+
+    latest = cache.get_or_generate("gemini", "m", "third", None, generate)[0]
+    assert os.path.exists(kept) and os.path.exists(latest)
+    assert not os.path.exists(dropped)
+    snap = cache.snapshot()
+    assert snap["handouts_removed"] == 1 and snap["evictions"] == 1
+    assert snap["bytes"] <= 2500
+    assert snap["bytes"] == sum(f.stat().st_size for f in (tmp_path / "uploads").iterdir())
+
+
+def test_referenced_handouts_count_toward_the_bound(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_cache, "IMAGE_CACHE_GC_GRACE", 0)
+    cache = make_cache(tmp_path, max_bytes=1500)
+    cache.reference_check = lambda names: set(names)  # everything still shown somewhere
+    generate, _ = generator(tmp_path)
+    for prompt in ("one", "two", "three"):
+        cache.get_or_generate("gemini", "m", prompt, None, generate)
+    snap = cache.snapshot()
+    assert snap["bytes"] == 3000  # nothing can be freed, and the stat says so
+    assert len(os.listdir(tmp_path / "uploads")) == 3
+
+
+def test_handouts_within_grace_or_without_a_check_are_kept(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=500)
+    generate, _ = generator(tmp_path)
+    cache.get_or_generate("gemini", "m", "one", None, generate)
+    cache.reference_check = lambda names: set()
+    cache.get_or_generate("gemini", "m", "two", None, generate)  # one is still in its grace period
+    assert len(os.listdir(tmp_path / "uploads")) == 2
+    assert cache.snapshot()["handouts_removed"] == 0
+
+
+def test_manifest_survives_reload(tmp_path):
+    generate, calls = generator(tmp_path)
+    path = make_cache(tmp_path).get_or_generate("gemini", "m", "lamp", None, generate)
+    reloaded = make_cache(tmp_path)
+    assert reloaded.get_or_generate("gemini", "m", "lamp", None, generate) == path
+    assert len(calls) == 1 and reloaded.snapshot()["handouts"] == 1
+
+
+def test_legacy_cache_under_uploads_is_moved_out(tmp_path):
+    legacy = tmp_path / "uploads" / "generated"
+    legacy.mkdir(parents=True)
+    key = ImageCache().key("gemini", "m", "lamp", [])
+    (legacy / f"{key}.png").write_bytes(b"x" * 100)
+    (legacy / "manifest.json").write_text(json.dumps({key: {
+        "file": f"{key}.png", "size": 100, "last_used": 1.0, "created_at": 1.0,
+    }}))
+
+    cache = make_cache(tmp_path, legacy_dir=str(legacy))
+    path = cache.get_or_generate("gemini", "m", "lamp", None, generator(tmp_path)[0])[0]
+    assert not legacy.exists()
+    assert os.path.exists(tmp_path / "cache" / f"{key}.png")
+    with open(path, "rb") as f:
+        assert f.read() == b"x" * 100
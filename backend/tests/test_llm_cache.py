@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+import llm_cache
+from llm_cache import ResponseCache, cache_key
+
+SHA = "ab" * 32
+
+
+def counting(text="out", delay=0.0):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return text
+
+    return compute, calls
+
+
+def test_cache_key_covers_every_input():
+    base = cache_key("m", "prompt", "schema", None)
+    assert base == cache_key("m", "prompt", "schema", None)
+    others = {
+        cache_key("m2", "prompt", "schema", None),
+        cache_key("m", "prompt!", "schema", None),
+        cache_key("m", "prompt", "schema2", None),
+        cache_key("m", "prompt", "schema", SHA),
+        cache_key("m", "prompt", "schema", "cd" * 32),
+    }
+    assert base not in others and len(others) == 5
+    # parts are separated, moving text between them changes the key
+    assert cache_key("m", "ab", "c", None) != cache_key("m", "a", "bc", None)
+
+
+def test_concurrent_identical_requests_share_one_call():
+    cache = ResponseCache(max_entries=8)
+    compute, calls = counting(delay=0.01)
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_compute("k", "draft", compute) for _ in range(5)])
+
+    assert asyncio.run(run()) == ["out"] * 5
+    assert len(calls) == 1
+    assert cache.stats["misses"] == 1 and cache.stats["shared"] == 4
+
+
+def test_failed_call_reaches_every_waiter_and_is_not_cached():
+    cache = ResponseCache(max_entries=8)
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(
+            *[cache.get_or_compute("k", "draft", failing) for _ in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(calls) == 1
+    compute, _ = counting()
+    assert asyncio.run(cache.get_or_compute("k", "draft", compute)) == "out"
+
+
+def test_memory_hit_and_expiry(monkeypatch):
+    cache = ResponseCache(max_entries=8)
+    compute, calls = counting()
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+
+    assert asyncio.run(cache.get_or_compute("k", "draft", compute)) == "out"
+    assert asyncio.run(cache.get_or_compute("k", "draft", compute)) == "out"
+    assert len(calls) == 1 and cache.stats["memory_hits"] == 1
+
+    now[0] += llm_cache.CACHE_TTLS["draft"] + 1
+    asyncio.run(cache.get_or_compute("k", "draft", compute))
+    assert len(calls) == 2
+
+
+def test_zero_ttl_site_bypasses_the_cache(monkeypatch):
+    monkeypatch.setitem(llm_cache.CACHE_TTLS, "draft", 0)
+    cache = ResponseCache(max_entries=8)
+    compute, calls = counting()
+    for _ in range(3):
+        asyncio.run(cache.get_or_compute("k", "draft", compute))
+    assert len(calls) == 3
+    assert cache.snapshot()["entries"] == 0
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    compute, calls = counting()
+    asyncio.run(ResponseCache(8, str(tmp_path)).get_or_compute("k" * 64, "draft", compute))
+    fresh = ResponseCache(8, str(tmp_path))
+    assert asyncio.run(fresh.get_or_compute("k" * 64, "draft", compute)) == "out"
+    assert len(calls) == 1 and fresh.stats["disk_hits"] == 1
+
+
+def test_lru_evicts_oldest_entry():
+    cache = ResponseCache(max_entries=2)
+    compute, calls = counting()
+    for key in ("a", "b", "a", "c", "a", "b"):
+        asyncio.run(cache.get_or_compute(key, "draft", compute))
+    assert len(calls) == 4  # a, b, c, then b again after c pushed it out
+    assert cache.stats["evictions"] >= 1
+
+
+@pytest.mark.parametrize("site", ["routing", "finalize"])
+def test_sites_are_counted_separately(site):
+    cache = ResponseCache(max_entries=8)
+    compute, _ = counting()
+    asyncio.run(cache.get_or_compute("k", site, compute))
+    asyncio.run(cache.get_or_compute("k", site, compute))
+    assert cache.stats["by_site"][site] == {"hits": 1, "misses": 1}
@@ -0,0 +1,72 @@
+import pytest
+
+from storage import JsonFileBackend, SQLiteBackend, WriteBehindStorage
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "json":
+        return JsonFileBackend(str(tmp_path))
+    return SQLiteBackend(str(tmp_path / "store.db"), seed_dir=None)
+
+
+def test_upsert_replaces_by_key_and_keeps_order(backend):
+    backend.upsert("posts", [{"post_id": "a", "v": 1}, {"post_id": "b", "v": 1}])
+    before = backend.version("posts")
+    backend.upsert("posts", [{"post_id": "a", "v": 2}, {"post_id": "c", "v": 1}])
+    assert backend.version("posts") != before
+    assert backend.load("posts") == [
+        {"post_id": "a", "v": 2},
+        {"post_id": "b", "v": 1},
+        {"post_id": "c", "v": 1},
+    ]
+
+
+def test_keyless_collection_upsert_appends(backend):
+    backend.upsert("research", [{"product_id": "p1", "notes": "x"}])
+    backend.upsert("research", [{"product_id": "p1", "notes": "x"}, {"notes": "y"}])
+    assert backend.load("research") == [
+        {"product_id": "p1", "notes": "x"},
+        {"product_id": "p1", "notes": "x"},
+        {"notes": "y"},
+    ]
+    backend.replace_all("research", [{"notes": "z"}])
+    assert backend.load("research") == [{"notes": "z"}]
+
+
+def test_sqlite_keeps_documents_across_reopen(tmp_path):
+    path = str(tmp_path / "store.db")
+    SQLiteBackend(path, seed_dir=None).upsert("products", [{"product_id": "p1", "name": "lamp"}])
+    assert SQLiteBackend(path, seed_dir=None).load("products") == [{"product_id": "p1", "name": "lamp"}]
+
+
+def test_write_behind_reads_pending_and_flushes_in_one_batch(backend):
+    store = WriteBehindStorage(backend, interval=3600)  # flushed by hand only
+    try:
+        backend.upsert("posts", [{"post_id": "a", "v": 1}])
+        store.upsert("posts", [{"post_id": "a", "v": 2}, {"post_id": "b", "v": 1}])
+        store.upsert("posts", [{"post_id": "b", "v": 2}])
+        store.upsert("research", [{"notes": "x"}, {"notes": "x"}])
+        assert backend.load("posts") == [{"post_id": "a", "v": 1}]  # nothing written yet
+        assert store.load("posts") == [{"post_id": "a", "v": 2}, {"post_id": "b", "v": 2}]
+        assert store.pending() == 4
+
+        store.flush()
+        assert store.pending() == 0
+        assert backend.load("posts") == [{"post_id": "a", "v": 2}, {"post_id": "b", "v": 2}]
+        assert backend.load("research") == [{"notes": "x"}, {"notes": "x"}]
+        assert store.stats["flushes"] == 1 and store.stats["errors"] == 0
+    finally:
+        store.close()
+
+
+def test_write_behind_snapshots_documents_when_queued(backend):
+    store = WriteBehindStorage(backend, interval=3600)
+    try:
+        doc = {"post_id": "a", "v": 1}
+        store.upsert("posts", [doc])
+        doc["v"] = 2  # caller keeps mutating its copy
+        store.close()
+        assert backend.load("posts") == [{"post_id": "a", "v": 1}]
+    finally:
+        store.close()
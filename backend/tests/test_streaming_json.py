@@ -0,0 +1,56 @@
+import json
+
+from streaming_json import IncrementalJSONParser, decode_partial_string
+
+SCHEMA = {
+    "assistant_message": "string",
+    "drafts": [{"draft_id": "string", "price": "number"}],
+}
+
+
+def feed_in_chunks(parser, text, size):
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i : i + size]))
+    return events
+
+
+def test_decode_partial_string_drops_incomplete_escapes():
+    assert decode_partial_string('Hello \\"wo') == 'Hello "wo'
+    assert decode_partial_string("Hello \\") == "Hello "
+    assert decode_partial_string("Hello \\u00") == "Hello "
+    assert decode_partial_string("caf\\u00e9") == "café"
+
+
+def test_decode_partial_string_holds_back_high_surrogate():
+    assert decode_partial_string("hi \\uD83D") == "hi "
+    assert decode_partial_string("hi \\uD83D\\uDE") == "hi "
+    assert decode_partial_string("hi \\uD83D\\uDE00") == "hi 😀"
+
+
+def test_partials_never_contain_lone_surrogates():
+    doc = json.dumps({"assistant_message": "smile \U0001F600 done"})  # 😀 escapes
+    parser = IncrementalJSONParser(SCHEMA)
+    texts = [e[2] for e in feed_in_chunks(parser, doc, 1) if e[0] in ("partial", "field")]
+    for text in texts:
+        text.encode("utf-8")  # raises on a lone surrogate
+    assert all(b.startswith(a) for a, b in zip(texts, texts[1:]))  # only ever grows
+    assert texts[-1] == "smile \U0001F600 done"
+
+
+def test_items_and_fields_in_any_chunking():
+    doc = "```json\n" + json.dumps(
+        {
+            "assistant_message": 'say "hi"',
+            "drafts": [{"draft_id": "d1", "price": 5}, {"draft_id": "d2", "price": "free"}],
+            "charts": [],
+        }
+    )
+    for size in (1, 3, 7, len(doc)):
+        parser = IncrementalJSONParser(SCHEMA)
+        events = feed_in_chunks(parser, doc, size)
+        items = [(e[2], e[3]["draft_id"], e[4]) for e in events if e[0] == "item"]
+        fields = {e[1]: e[2] for e in events if e[0] == "field"}
+        assert items == [(0, "d1", True), (1, "d2", False)]
+        assert fields["assistant_message"] == 'say "hi"'
+        assert fields["charts"] == []